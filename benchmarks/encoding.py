@@ -0,0 +1,62 @@
+"""
+    Benchmarks the encoding of measurement responses (agent.utils.formats.encode_json) and their compression (agent.utils.compression).
+
+    For every series length, the time of encoding the JSON body is compared with the previous fastapi.responses.JSONResponse
+    (standard library json), followed by the size of the body and the time of compressing it with every available content coding.
+    The fast path requires the optional orjson package - without it, encode_json falls back to the standard library.
+
+    Usage (from the repository root directory):
+        PYTHONPATH=src python benchmarks/encoding.py [--sizes 24 744 8760 26280] [--repeats 5]
+"""
+import argparse
+import json
+import timeit
+
+import fastapi.responses
+
+import extraction  # pylint: disable=import-error
+
+import agent.routers.energa
+import agent.utils.compression
+import agent.utils.formats
+
+
+def measure(procedure, repeats: int) -> float:
+    return min(timeit.repeat(procedure, number=1, repeat=repeats))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[24, 744, 8760, 26280], help='hourly measurements per response')
+    parser.add_argument('--repeats', type=int, default=5)
+    arguments = parser.parse_args()
+
+    codings = agent.utils.compression.available_codings()
+    orjson_available = agent.utils.formats._import_orjson() is not None  # pylint: disable=protected-access
+    print(f'JSON encoder: {"orjson" if orjson_available else "json (orjson is not installed)"}, content codings: {", ".join(codings)}')
+    print(
+        f'{"measurements":>12} {"JSONResponse [ms]":>18} {"encode_json [ms]":>17} {"speedup":>8} {"size [kB]":>10}'
+        + ''.join(f' {coding + " [kB]":>10} {coding + " [ms]":>10}' for coding in codings)
+    )
+    for size in arguments.sizes:
+        measurements = agent.routers.energa._extract_measurement_values_from_fetched_data(  # pylint: disable=protected-access
+            extraction.generate_fetched_data(size), 0.85
+        )
+        content = {'status': 'success', 'data': measurements}
+        body = agent.utils.formats.encode_json(content)
+        assert json.loads(body) == json.loads(fastapi.responses.JSONResponse(content).body)
+        response_elapsed = measure(lambda: fastapi.responses.JSONResponse(content).body, arguments.repeats)  # pylint: disable=cell-var-from-loop
+        encode_elapsed = measure(lambda: agent.utils.formats.encode_json(content), arguments.repeats)  # pylint: disable=cell-var-from-loop
+        row = (
+            f'{size:>12} {response_elapsed * 1e3:>18.2f} {encode_elapsed * 1e3:>17.2f} '
+            f'{response_elapsed / encode_elapsed:>7.1f}x {len(body) / 1024:>10.1f}'
+        )
+        for coding in codings:
+            compressed_body, _ = agent.utils.compression.compress(body, coding, 0)
+            compress_elapsed = measure(lambda: agent.utils.compression.compress(body, coding, 0), arguments.repeats)  # pylint: disable=cell-var-from-loop
+            row += f' {len(compressed_body) / 1024:>10.1f} {compress_elapsed * 1e3:>10.2f}'
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
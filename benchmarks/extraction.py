@@ -0,0 +1,76 @@
+"""
+    Benchmarks the conversion of Energa datapoints into measurements (agent.routers.energa._extract_measurement_values_from_fetched_data).
+
+    The time per datapoint should stay flat as the number of datapoints grows, i.e. the conversion should scale linearly.
+    For comparison, the previous functools.reduce based implementation (which copied the list on every row) is timed as well.
+
+    Usage (from the repository root directory):
+        PYTHONPATH=src python benchmarks/extraction.py [--sizes 1000 4000 16000 64000] [--repeats 5]
+"""
+import argparse
+import datetime
+import functools
+import random
+import timeit
+
+import agent.routers.energa
+
+HOUR = 60 * 60 * 1000
+
+
+def generate_fetched_data(size: int) -> list[agent.routers.energa.EnergaMeasurementData]:
+    first_timestamp = int(datetime.datetime(2020, 1, 1).timestamp() * 1000)
+    return [
+        {
+            'tm': str(first_timestamp + index * HOUR),
+            'tarAvg': 0.5,
+            'zones': [random.random(), random.choice([None, random.random()]), None],
+            'est': False,
+            'cplt': True,
+        }
+        for index in range(size)
+    ]
+
+
+def extract_with_reduce(
+    fetched_data: list[agent.routers.energa.EnergaMeasurementData],
+    conversion_coefficient: float
+) -> list[agent.routers.energa.Measurement]:
+    def reducer(
+        measurements_collection: list[agent.routers.energa.Measurement],
+        measurement_data: agent.routers.energa.EnergaMeasurementData
+    ) -> list[agent.routers.energa.Measurement]:
+        zones = measurement_data['zones']
+        measurement_time = datetime.datetime.fromtimestamp(int(measurement_data['tm']) / 1000).strftime('%Y-%m-%d %H:%M:%S')
+        return measurements_collection + [agent.routers.energa.Measurement(measurement_time, agent.routers.energa.EnergyConsumptionPerZone(
+            (zones[0] or 0.0) * conversion_coefficient,
+            (zones[1] or 0.0) * conversion_coefficient,
+            (zones[2] or 0.0) * conversion_coefficient,
+        ))]
+    return functools.reduce(reducer, fetched_data, [])
+
+
+def measure(procedure, fetched_data, repeats: int) -> float:
+    return min(timeit.repeat(lambda: procedure(fetched_data, 0.85), number=1, repeat=repeats))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000, 16000, 64000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--reduce-limit', type=int, default=16000, help='largest size for which the reduce based implementation is timed')
+    arguments = parser.parse_args()
+
+    print(f'{"datapoints":>10} {"total [ms]":>12} {"per point [us]":>16} {"reduce [ms]":>12}')
+    for size in arguments.sizes:
+        fetched_data = generate_fetched_data(size)
+        assert agent.routers.energa._extract_measurement_values_from_fetched_data(  # pylint: disable=protected-access
+            fetched_data[:100], 0.85
+        ) == extract_with_reduce(fetched_data[:100], 0.85)
+        elapsed = measure(agent.routers.energa._extract_measurement_values_from_fetched_data, fetched_data, arguments.repeats)  # pylint: disable=protected-access
+        reduce_elapsed = measure(extract_with_reduce, fetched_data, 1) if size <= arguments.reduce_limit else float('nan')
+        print(f'{size:>10} {elapsed * 1e3:>12.2f} {elapsed / size * 1e6:>16.3f} {reduce_elapsed * 1e3:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
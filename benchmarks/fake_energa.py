@@ -0,0 +1,145 @@
+"""
+    A local stand-in for the Energa MojLicznik app, which replays the recorded pages and chart payloads from the fixtures directory.
+
+    The login page, the UserData.do script (listing the meters) and the chart JSON are served as recorded - chart datapoints are replayed
+    for every hour (day or month) of the requested window. Every response can be delayed and failed on purpose, so the agent can be
+    benchmarked against a slow or flaky upstream:
+
+    * latency / jitter - every request is delayed by latency seconds, plus a random delay of up to jitter seconds,
+    * error_rate - fraction of chart requests answered with 503 Service Unavailable,
+    * expiry_rate - fraction of chart requests redirected to the login page, as if the session had expired.
+
+    Usage (from the repository root directory):
+        PYTHONPATH=src python benchmarks/fake_energa.py [--port 8081] [--latency 0.05] [--jitter 0.02] [--error-rate 0.01]
+
+    Then point the agent at it with energa_base_url=http://127.0.0.1:8081 in the [AGENT] section of its configuration file.
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import os
+import random
+import typing
+
+import fastapi
+import fastapi.responses
+import uvicorn
+
+import agent.utils.consts
+import agent.utils.periods
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures')
+SESSION_COOKIE = 'JSESSIONID'
+
+
+@dataclasses.dataclass
+class FakeEnergaSettings:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    expiry_rate: float = 0.0
+    requests: dict[str, int] = dataclasses.field(default_factory=dict)
+
+
+def read_fixture(file_name: str) -> str:
+    with open(os.path.join(FIXTURES_PATH, file_name), encoding='utf-8') as fixture:
+        return fixture.read()
+
+
+def replay_chart(recorded_chart: dict[str, typing.Any], epoch: int, period: str) -> dict[str, typing.Any]:
+    """
+        Replays the recorded datapoints (cyclically) for every datapoint of the requested window.
+    """
+    window_start, window_end = agent.utils.periods.window_bounds(epoch, period)
+    recorded_rows = recorded_chart['response']['mainChart']
+    timestamps: list[int] = []
+    datapoint_start = datetime.datetime.fromtimestamp(window_start / 1000)
+    while (timestamp := int(datapoint_start.timestamp() * 1000)) < window_end:
+        timestamps.append(timestamp)
+        match period:
+            case 'DAY':
+                datapoint_start += datetime.timedelta(hours=1)
+            case 'WEEK' | 'MONTH':
+                datapoint_start += datetime.timedelta(days=1)
+            case _:
+                datapoint_start = (datapoint_start + datetime.timedelta(days=32)).replace(day=1)
+    return recorded_chart | {'response': recorded_chart['response'] | {
+        'type': period,
+        'mainChartDate': str(epoch),
+        'mainChart': [
+            recorded_rows[index % len(recorded_rows)] | {'tm': str(timestamp)}
+            for index, timestamp in enumerate(timestamps)
+        ],
+    }}
+
+
+def create_fake_energa_app(settings: FakeEnergaSettings) -> fastapi.FastAPI:
+    login_page = read_fixture('login.html')
+    user_data_page = read_fixture('user_data.html')
+    recorded_chart = json.loads(read_fixture('chart.json'))
+    app = fastapi.FastAPI()
+
+    @app.middleware('http')
+    async def inject_latency(request: fastapi.Request, call_next):
+        settings.requests[request.url.path] = settings.requests.get(request.url.path, 0) + 1
+        if settings.latency or settings.jitter:
+            await asyncio.sleep(settings.latency + random.uniform(0, settings.jitter))
+        return await call_next(request)
+
+    @app.get(agent.utils.consts.PPE_LOGIN_PATH)
+    async def get_login_page() -> fastapi.responses.Response:
+        return fastapi.responses.HTMLResponse(login_page)
+
+    @app.post(agent.utils.consts.PPE_LOGIN_PATH)
+    async def log_in() -> fastapi.responses.Response:
+        response = fastapi.responses.RedirectResponse(agent.utils.consts.PPE_DATA_SCRIPT_PATH, status_code=302)
+        response.set_cookie(SESSION_COOKIE, f'{random.getrandbits(64):016x}', path='/dp')
+        return response
+
+    @app.get(agent.utils.consts.PPE_LOGOUT_PATH)
+    async def log_out() -> fastapi.responses.Response:
+        response = fastapi.responses.HTMLResponse(login_page)
+        response.delete_cookie(SESSION_COOKIE, path='/dp')
+        return response
+
+    @app.get(agent.utils.consts.PPE_DATA_SCRIPT_PATH)
+    async def get_user_data(request: fastapi.Request) -> fastapi.responses.Response:
+        if SESSION_COOKIE not in request.cookies:
+            return fastapi.responses.RedirectResponse(agent.utils.consts.PPE_LOGIN_PATH, status_code=302)
+        return fastapi.responses.HTMLResponse(user_data_page)
+
+    @app.get(agent.utils.consts.PPE_DATA_CHARTS_PATH)
+    async def get_chart(request: fastapi.Request) -> fastapi.responses.Response:
+        if SESSION_COOKIE not in request.cookies or random.random() < settings.expiry_rate:
+            return fastapi.responses.RedirectResponse(agent.utils.consts.PPE_LOGIN_PATH, status_code=302)
+        if random.random() < settings.error_rate:
+            return fastapi.responses.HTMLResponse('Service Unavailable', status_code=503)
+        return fastapi.responses.JSONResponse(replay_chart(
+            recorded_chart,
+            int(request.query_params['mainChartDate']),
+            request.query_params['type'].upper()
+        ))
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local stand-in for the Energa MojLicznik app')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every response, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random delay added to every response, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of chart requests failed with 503')
+    parser.add_argument('--expiry-rate', type=float, default=0.0, help='fraction of chart requests redirected to the login page')
+    arguments = parser.parse_args()
+    uvicorn.run(
+        create_fake_energa_app(FakeEnergaSettings(arguments.latency, arguments.jitter, arguments.error_rate, arguments.expiry_rate)),
+        host=arguments.host,
+        port=arguments.port
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+    Load test of the query path of the agent (PPEAgentService._app), against the local stand-in for Energa (benchmarks/fake_energa.py).
+
+    For every concurrency level, a fresh agent (with an empty measurement store) is started and the given number of /energy/query
+    requests for random days, weeks and months is sent to it by that many concurrent clients. The latency percentiles (p50, p99),
+    throughput, peak RSS of the process and the number of chart requests that reached the fake Energa server are reported.
+
+    Usage (from the repository root directory):
+        PYTHONPATH=src python benchmarks/load.py [--concurrency 1 8 32 128] [--requests 1000] [--latency 0.02] [--error-rate 0.0]
+                                                 [--upstream-rate-limit 0] [--json results.json] [--max-p99 250]
+
+    With --max-p99 (in milliseconds), the script exits with a non-zero status, if any of the levels exceeds that p99 latency.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+import httpx
+import uvicorn
+
+import fake_energa  # pylint: disable=import-error
+
+import agent.service
+import agent.utils.consts
+
+PERIODS = ('day', 'week', 'month')
+
+
+def start_fake_energa(settings: fake_energa.FakeEnergaSettings) -> tuple[str, uvicorn.Server]:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        fake_energa.create_fake_energa_app(settings),
+        host='127.0.0.1',
+        port=port,
+        log_level='warning',
+        access_log=False
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f'http://127.0.0.1:{port}', server
+
+
+def generate_query_paths(count: int, days: int) -> list[str]:
+    today = datetime.date.today()
+    return [
+        f'/energy/query?date={today - datetime.timedelta(days=random.randrange(days)):%d-%m-%Y}&period={random.choice(PERIODS)}'
+        for _ in range(count)
+    ]
+
+
+async def run_level(  # pylint: disable=too-many-locals
+    energa_base_url: str,
+    settings: fake_energa.FakeEnergaSettings,
+    concurrency: int,
+    arguments: argparse.Namespace
+) -> dict[str, typing.Any]:
+    with tempfile.TemporaryDirectory() as storage_directory:
+        config_path = os.path.join(storage_directory, 'agent.cfg')
+        with open(config_path, 'w', encoding='utf-8') as config_file:
+            config_file.write(
+                '[AGENT]\n'
+                f'energa_base_url={energa_base_url}\n'
+                f'storage_path={os.path.join(storage_directory, "measurements.sqlite3")}\n'
+                f'max_connections={arguments.max_connections}\n'
+                f'upstream_rate_limit={arguments.upstream_rate_limit}\n'
+                'prefetch_interval=0\n'
+            )
+        os.environ['PPE_AGENT_CONFIG'] = config_path
+        ppe_agent = agent.service.PPEAgentService({
+            'credentials': {'email': 'benchmark@example.com', 'password': 'benchmark'}
+        })
+        app = ppe_agent._app  # pylint: disable=protected-access
+
+        paths = collections.deque(generate_query_paths(arguments.requests, arguments.days))
+        latencies: list[float] = []
+        statuses: collections.Counter[int] = collections.Counter()
+
+        async def run_client(client: httpx.AsyncClient) -> None:
+            while paths:
+                path = paths.popleft()
+                request_start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - request_start)
+                statuses[response.status_code] += 1
+
+        async with app.router.lifespan_context(app):
+            chart_requests_before = settings.requests.get(agent.utils.consts.PPE_DATA_CHARTS_PATH, 0)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://agent') as client:  # type: ignore
+                level_start = time.perf_counter()
+                await asyncio.gather(*(run_client(client) for _ in range(concurrency)))
+                elapsed = time.perf_counter() - level_start
+            chart_requests = settings.requests.get(agent.utils.consts.PPE_DATA_CHARTS_PATH, 0) - chart_requests_before
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'p50_ms': round(percentiles[49] * 1000, 2),
+        'p99_ms': round(percentiles[98] * 1000, 2),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'upstream_chart_requests': chart_requests,
+        'statuses': dict(statuses),
+    }
+
+
+async def run_benchmark(arguments: argparse.Namespace) -> list[dict[str, typing.Any]]:
+    settings = fake_energa.FakeEnergaSettings(arguments.latency, arguments.jitter, arguments.error_rate, arguments.expiry_rate)
+    energa_base_url, fake_energa_server = start_fake_energa(settings)
+    try:
+        return [
+            await run_level(energa_base_url, settings, concurrency, arguments)
+            for concurrency in arguments.concurrency
+        ]
+    finally:
+        fake_energa_server.should_exit = True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test of the /energy/query path against a fake Energa server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--requests', type=int, default=1000, help='number of requests sent at every concurrency level')
+    parser.add_argument('--days', type=int, default=90, help='queried dates are drawn from that many most recent days')
+    parser.add_argument('--max-connections', type=int, default=10, help='max_connections setting of the agent')
+    parser.add_argument('--upstream-rate-limit', type=float, default=0, help='upstream_rate_limit setting of the agent (0 disables it)')
+    parser.add_argument('--latency', type=float, default=0.02, help='latency of the fake Energa server, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='maximum random delay added by the fake Energa server, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of chart requests failed by the fake Energa server')
+    parser.add_argument('--expiry-rate', type=float, default=0.0, help='fraction of chart requests answered as if the session expired')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='path of the file, to which the results are written (as JSON)')
+    parser.add_argument('--max-p99', type=float, help='maximum p99 latency (in milliseconds) accepted at any concurrency level')
+    arguments = parser.parse_args()
+    os.environ.setdefault('PPE_AGENT_LOG_LEVEL', 'WARNING')
+    random.seed(arguments.seed)
+
+    results = asyncio.run(run_benchmark(arguments))
+    print(f'{"concurrency":>11} {"p50 [ms]":>9} {"p99 [ms]":>9} {"req/s":>8} {"RSS [MB]":>9} {"upstream":>9}  statuses')
+    for result in results:
+        print(
+            f'{result["concurrency"]:>11} {result["p50_ms"]:>9} {result["p99_ms"]:>9} {result["throughput_rps"]:>8} '
+            f'{result["peak_rss_mb"]:>9} {result["upstream_chart_requests"]:>9}  {result["statuses"]}'
+        )
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf-8') as results_file:
+            json.dump(results, results_file, indent=2)
+    if arguments.max_p99 is not None and any(result['p99_ms'] > arguments.max_p99 for result in results):
+        sys.exit(f'p99 latency exceeded {arguments.max_p99} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+    Benchmarks the compact in-memory window of recent readings (agent.utils.readings.ReadingsRing) against the list representations.
+
+    For every number of days of hourly readings, the memory per reading is reported for the Energa datapoints (dictionaries, as they are
+    cached and loaded from the store) and for the measurements (named tuples with formatted timestamps), as traced by tracemalloc,
+    and for the typed arrays of the ring (including their spare capacity). The time of looking up the readings of the last day
+    is compared as well - by filtering the datapoints and by slicing the ring.
+
+    Usage (from the repository root directory):
+        PYTHONPATH=src python benchmarks/recent_readings.py [--days 1 7 31 365] [--repeats 5]
+"""
+import argparse
+import sys
+import timeit
+import tracemalloc
+import typing
+
+import extraction  # pylint: disable=import-error
+
+import agent.routers.energa
+import agent.utils.consts
+import agent.utils.readings
+
+HOUR = 60 * 60 * 1000
+
+
+def allocated_bytes(build: typing.Callable[[], typing.Any]) -> tuple[int, typing.Any]:
+    tracemalloc.start()
+    try:
+        built = build()
+        return tracemalloc.get_traced_memory()[0], built
+    finally:
+        tracemalloc.stop()
+
+
+def build_ring(fetched_data: list[agent.routers.energa.EnergaMeasurementData], days: int) -> agent.utils.readings.ReadingsRing:
+    ring = agent.utils.readings.ReadingsRing(days * agent.utils.consts.READINGS_MAX_PER_DAY)
+    readings = agent.utils.readings.ReadingsSlice.from_datapoints(fetched_data)
+    ring.replace(readings.timestamps[0], readings.timestamps[-1] + 1, readings)
+    return ring
+
+
+def filter_since(fetched_data: list[agent.routers.energa.EnergaMeasurementData], cursor: int) -> list[typing.Any]:
+    return [
+        measurement_data
+        for measurement_data in fetched_data
+        if 'tm' in measurement_data and int(measurement_data['tm']) > cursor
+        and any(zone is not None for zone in measurement_data.get('zones') or [])
+    ]
+
+
+def measure(procedure: typing.Callable[[], typing.Any], repeats: int) -> float:
+    return min(timeit.repeat(procedure, number=1, repeat=repeats))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 7, 31, 365])
+    parser.add_argument('--repeats', type=int, default=5)
+    arguments = parser.parse_args()
+
+    print(
+        f'{"days":>5} {"readings":>9} {"datapoints [B/pt]":>18} {"measurements [B/pt]":>20} {"ring [B/pt]":>12} '
+        f'{"filter last day [us]":>21} {"slice last day [us]":>20}'
+    )
+    for days in arguments.days:
+        size = days * 24
+        datapoints_bytes, fetched_data = allocated_bytes(lambda: extraction.generate_fetched_data(size))  # pylint: disable=cell-var-from-loop
+        measurements_bytes, _ = allocated_bytes(
+            lambda: agent.routers.energa._extract_measurement_values_from_fetched_data(fetched_data, 1.0)  # pylint: disable=protected-access,cell-var-from-loop
+        )
+        ring = build_ring(fetched_data, days)
+        ring_bytes = sum(sys.getsizeof(column) for column in (ring.timestamps, *ring.zones))
+        cursor = int(fetched_data[-24]['tm']) - 1
+        assert [int(measurement_data['tm']) for measurement_data in filter_since(fetched_data, cursor)] == list(
+            ring.slice(cursor + 1, cursor + 24 * HOUR + 1).timestamps
+        )
+        filter_elapsed = measure(lambda: filter_since(fetched_data, cursor), arguments.repeats)  # pylint: disable=cell-var-from-loop
+        slice_elapsed = measure(lambda: ring.slice(cursor + 1, cursor + 24 * HOUR + 1), arguments.repeats)  # pylint: disable=cell-var-from-loop
+        print(
+            f'{days:>5} {size:>9} {datapoints_bytes / size:>18.0f} {measurements_bytes / size:>20.0f} {ring_bytes / size:>12.0f} '
+            f'{filter_elapsed * 1e6:>21.1f} {slice_elapsed * 1e6:>20.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,51 @@
 """
     This module provides a FastAPI router that is responsible for handling the requests related to fetching the energy consumption data from the Energa MojLicznik app.
 """
+import asyncio
+import collections
 import datetime
 import functools
+import json
+import time
 import typing
 
 import fastapi
+import fastapi.concurrency
 import fastapi.responses
-import requests
+import httpx
 
+import agent.utils.aggregation
+import agent.utils.assets
+import agent.utils.broadcast
+import agent.utils.cache
+import agent.utils.coalescing
+import agent.utils.compression
 import agent.utils.consts
+import agent.utils.formats
+import agent.utils.http_cache
+import agent.utils.interprocess
+import agent.utils.metrics
+import agent.utils.periods
+import agent.utils.ratelimit
+import agent.utils.readings
 import agent.utils.retry
+import agent.utils.session
+import agent.utils.startup
+import agent.utils.storage
+
+
+async def wait_until_ready(request: fastapi.Request) -> None:
+    """
+        Holds the queries received before the agent has logged into Energa for a while, so they are not failed right after startup.
+    """
+    await request.app.extra.get(
+        agent.utils.consts.AGENT_STARTUP_FIELD
+    ).wait_until_ready()  # type: ignore
+
 
 MEASUREMENTS_ROUTER = fastapi.APIRouter()
+# The static pages are served right away, while the routes that need an Energa session wait for the login
+REQUIRES_LOGIN = [fastapi.Depends(wait_until_ready)]
 
 
 class EnergaMeasurementData(typing.TypedDict):
@@ -21,7 +54,7 @@ class EnergaMeasurementData(typing.TypedDict):
     """
     tm: str  # timestamp
     tarAvg: float  # average across tariff
-    zones: list[float]  # measurements for each zone
+    zones: list[float | None]  # measurements for each zone (null, if the tariff has no such zone)
     est: bool  # was the value estimated using simulation?
     cplt: bool  # literally have no idea what this is
 
@@ -45,6 +78,28 @@ class Measurement(typing.NamedTuple):
     consumption: EnergyConsumptionPerZone
 
 
+class MeasurementColumns(typing.NamedTuple):
+    """
+        This is a named tuple that represents a series of measurements in a columnar form i.e. as parallel lists of values.
+    """
+    timestamp: list[str]
+    round_the_clock: list[float]
+    daily: list[float]
+    nightly: list[float]
+
+
+class MeasurementWindow(typing.NamedTuple):
+    """
+        This is a named tuple that represents the datapoints of a single window, along with the time they were fetched from Energa
+        and their digest - computed once, when the data is fetched (or aggregated), and kept next to it in the warm cache and the store.
+        The time the digest last changed stays behind, when the data is fetched again and turns out to be unchanged.
+    """
+    data: list[EnergaMeasurementData]
+    fetched_at: float
+    digest: str
+    modified_at: float
+
+
 def date_to_epoch(date: str) -> int:
     return int(
         datetime.datetime.strptime(date, '%d-%m-%Y').timestamp() * 1000
@@ -53,58 +108,193 @@ def date_to_epoch(date: str) -> int:
 
 @MEASUREMENTS_ROUTER.get('/energy/info')
 async def get_measurements_api_info(request: fastapi.Request) -> fastapi.responses.Response:
-    assets_path: str = request.app.extra.get(
-        agent.utils.consts.AGENT_CONFIG_FIELD
-    ).assets_path
-    return fastapi.responses.HTMLResponse(
-        content=open(f'{assets_path}/energy_info.html', encoding='utf-8').read(),
-    )
+    asset_cache: agent.utils.assets.AssetCache = request.app.extra.get(
+        agent.utils.consts.AGENT_ASSETS_FIELD
+    )  # type: ignore
+    return asset_cache.response('energy_info.html', request)
 
 
-@MEASUREMENTS_ROUTER.get('/energy/query')
-async def query_measurements(request: fastapi.Request) -> fastapi.responses.Response:
-    starting_date = request.query_params.get('date')
-    if starting_date is None:
+class InvalidQueryError(ValueError):
+    """
+        Raised when the query parameters of a request are missing or invalid - carries the HTTP status code of the error response.
+    """
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+    def to_response(self) -> fastapi.responses.Response:
         return fastapi.responses.JSONResponse(
-            content={'status': 'error', 'message': 'Missing date parameter'},
-            status_code=400
+            content={'status': 'error', 'message': str(self)},
+            status_code=self.status_code
         )
-    period = request.query_params.get('period', '').upper()
-    if not period:
+
+
+@MEASUREMENTS_ROUTER.get('/energy/meters', dependencies=REQUIRES_LOGIN)
+async def list_meters(request: fastapi.Request) -> fastapi.responses.Response:
+    session_pool: agent.utils.session.EnergaSessionPool = request.app.extra.get(
+        agent.utils.consts.AGENT_ENERGA_SESSION_FIELD
+    )  # type: ignore
+    return fastapi.responses.JSONResponse(
+        content={'status': 'success', 'data': [
+            {'meter': meter_id, 'account': account_name, 'default': meter_id == session_pool.default_meter_id}
+            for meter_id, account_name in session_pool.meters.items()
+        ]},
+    )
+
+
+@MEASUREMENTS_ROUTER.get('/energy/query', dependencies=REQUIRES_LOGIN)
+async def query_measurements(request: fastapi.Request) -> fastapi.responses.Response:
+    try:
+        epoch, period, output_format = _parse_window_query(request)
+        meter_id = _resolve_meter_id(request, request.query_params.get('meter'))
+    except InvalidQueryError as invalid_query:
+        return invalid_query.to_response()
+
+    measurement_window = await fetch_measurement_data(request.app, meter_id, epoch, period)
+    if measurement_window is None:
         return fastapi.responses.JSONResponse(
-            content={'status': 'error', 'message': 'Missing period parameter'},
-            status_code=400
+            content={'status': 'error', 'message': 'Failed to fetch data'},
+            status_code=500
         )
-
-    current_agent_app_state: fastapi.FastAPI = request.app
-    meter_id = current_agent_app_state.extra.get(
-        agent.utils.consts.AGENT_METER_ID_FIELD
+    return _build_measurements_response(
+        request,
+        measurement_window,
+        output_format,
+        agent.utils.periods.is_window_closed(epoch, period),
+        {'period': period, 'meter': meter_id}
     )
 
-    authorized_energa_session: requests.Session = current_agent_app_state.extra.get(
+
+@MEASUREMENTS_ROUTER.get('/energy/aggregate', dependencies=REQUIRES_LOGIN)
+async def query_aggregated_measurements(request: fastapi.Request) -> fastapi.responses.Response:
+    """
+        Queries the same window of several meters (all of them by default) concurrently and sums their series per timestamp and zone.
+    """
+    session_pool: agent.utils.session.EnergaSessionPool = request.app.extra.get(
         agent.utils.consts.AGENT_ENERGA_SESSION_FIELD
     )  # type: ignore
+    try:
+        epoch, period, output_format = _parse_window_query(request)
+        requested_meters = request.query_params.get('meters')
+        meter_ids = [
+            _resolve_meter_id(request, requested_meter.strip())
+            for requested_meter in requested_meters.split(',')
+        ] if requested_meters else [*session_pool.meters]
+    except InvalidQueryError as invalid_query:
+        return invalid_query.to_response()
 
-    with agent.utils.retry.retry_procedure(
-        max_retries=current_agent_app_state.extra.get(
-            agent.utils.consts.AGENT_CONFIG_FIELD,
-        ).max_retries  # type: ignore
-    ):
-        data_query_url = f'{agent.utils.consts.PPE_DATA_CHARTS_BASE_URL}?mainChartDate={date_to_epoch(starting_date)}&type={period}&meterPoint={meter_id}&mo=A%2B'
-        response = authorized_energa_session.get(
-            url=data_query_url,
-            timeout=current_agent_app_state.extra.get(
-                agent.utils.consts.AGENT_CONFIG_FIELD
-            ).timeout  # type: ignore
-        )
-        response.raise_for_status()
-    if response.status_code != 200:
+    measurement_windows = await asyncio.gather(*(
+        fetch_measurement_data(request.app, meter_id, epoch, period)
+        for meter_id in dict.fromkeys(meter_ids)
+    ))
+    if any(measurement_window is None for measurement_window in measurement_windows):
         return fastapi.responses.JSONResponse(
             content={'status': 'error', 'message': 'Failed to fetch data'},
             status_code=500
         )
+    return _build_measurements_response(
+        request,
+        _merge_measurement_windows(measurement_windows),  # type: ignore
+        output_format,
+        agent.utils.periods.is_window_closed(epoch, period),
+        {'period': period, 'meter': 'aggregate'}
+    )
+
+
+def _parse_window_query(request: fastapi.Request) -> tuple[int, str, str]:
+    """
+        Parses the date, period and output format of a query for a single window of measurements.
+    """
+    starting_date = request.query_params.get('date')
+    if starting_date is None:
+        raise InvalidQueryError('Missing date parameter')
+    period = request.query_params.get('period', '').upper()
+    if not period:
+        raise InvalidQueryError('Missing period parameter')
+    try:
+        period = agent.utils.periods.validate_period(period)
+        epoch = date_to_epoch(starting_date)
+    except ValueError as invalid_parameter:
+        raise InvalidQueryError(str(invalid_parameter)) from invalid_parameter
+    try:
+        output_format = agent.utils.formats.negotiate_format(
+            request.query_params.get('format'),
+            request.headers.get('accept')
+        )
+        agent.utils.formats.ensure_format_available(output_format)
+    except agent.utils.formats.UnsupportedFormatError as unsupported_format:
+        raise InvalidQueryError(str(unsupported_format), status_code=406) from unsupported_format
+    return epoch, period, output_format
+
+
+def _resolve_meter_id(request: fastapi.Request, requested_meter: str | None) -> int:
+    """
+        Returns the ID of the requested meter or the default one (first meter of the first account), if no meter was requested.
+    """
+    session_pool: agent.utils.session.EnergaSessionPool = request.app.extra.get(
+        agent.utils.consts.AGENT_ENERGA_SESSION_FIELD
+    )  # type: ignore
+    if not requested_meter:
+        return request.app.extra.get(agent.utils.consts.AGENT_METER_ID_FIELD)  # type: ignore
+    if not requested_meter.isdigit():
+        raise InvalidQueryError(f'Invalid meter: {requested_meter}')
+    if int(requested_meter) not in session_pool.meters:
+        startup: agent.utils.startup.StartupState = request.app.extra.get(
+            agent.utils.consts.AGENT_STARTUP_FIELD
+        )  # type: ignore
+        if startup.failed_accounts:  # The meter may be registered in one of the accounts, which are not logged in yet
+            raise agent.utils.startup.ServiceNotReadyError(
+                f'Not logged into every Energa account yet ({", ".join(startup.failed_accounts)})',
+                retry_after=agent.utils.consts.STARTUP_LOGIN_RETRY_DELAY
+            )
+        raise InvalidQueryError(f'Unknown meter: {requested_meter}', status_code=404)
+    return int(requested_meter)
 
-    fetched_data: list[EnergaMeasurementData] = response.json().get('response', {}).get('mainChart', [])
+
+def _merge_measurement_windows(measurement_windows: list[MeasurementWindow]) -> MeasurementWindow:
+    merged_data: dict[int, EnergaMeasurementData] = {}
+    for measurement_window in measurement_windows:
+        for measurement_data in measurement_window.data:
+            if 'zones' not in measurement_data or 'tm' not in measurement_data:
+                continue
+            timestamp = int(measurement_data['tm'])
+            if timestamp not in merged_data:
+                merged_data[timestamp] = {
+                    'tm': measurement_data['tm'],
+                    'tarAvg': measurement_data.get('tarAvg'),  # type: ignore
+                    'zones': [None, None, None],
+                    'est': False,
+                    'cplt': True,
+                }
+            merged_measurement = merged_data[timestamp]
+            merged_measurement['zones'] = [
+                None if merged_zone is None and zone is None else (merged_zone or 0.0) + (zone or 0.0)
+                for merged_zone, zone in zip(merged_measurement['zones'], [*measurement_data['zones'], None, None, None])
+            ]
+            merged_measurement['est'] = merged_measurement['est'] or measurement_data.get('est', False)
+            merged_measurement['cplt'] = merged_measurement['cplt'] and measurement_data.get('cplt', True)
+    return MeasurementWindow(
+        [merged_data[timestamp] for timestamp in sorted(merged_data)],
+        min(measurement_window.fetched_at for measurement_window in measurement_windows),
+        agent.utils.http_cache.digest_data([measurement_window.digest for measurement_window in measurement_windows]),
+        max(measurement_window.modified_at for measurement_window in measurement_windows)
+    )
+
+
+def _build_measurements_response(  # pylint: disable=too-many-locals
+    request: fastapi.Request,
+    measurement_window: MeasurementWindow,
+    output_format: str,
+    closed: bool,
+    metric_labels: dict[str, typing.Any]
+) -> fastapi.responses.Response:
+    """
+        Builds the response in the requested format, along with the validators (ETag, Last-Modified) and caching policy of its data.
+
+        Conditional requests, whose validators match, are answered with 304 Not Modified before the measurements are serialized.
+        The body depends on the data and the query options only (the fetch time is sent in a header), so the ETag can be a strong one.
+    """
+    fetched_data = measurement_window.data
     if not fetched_data:
         return fastapi.responses.JSONResponse(
             content={'status': 'error', 'message': 'No data available'},
@@ -113,39 +303,593 @@ async def query_measurements(request: fastapi.Request) -> fastapi.responses.Resp
 
     limit = request.query_params.get('limit', len(fetched_data))
     cost = request.query_params.get('cost', 1.0)
+    fetched_at = datetime.datetime.fromtimestamp(measurement_window.fetched_at).astimezone().isoformat(timespec='seconds')
+    # Only the (buffered) JSON bodies are compressed, the streamed formats are sent as they are encoded
+    coding = agent.utils.compression.negotiate_coding(request.headers.get('accept-encoding')) if output_format == 'json' else None
+    etag = agent.utils.http_cache.build_etag(measurement_window.digest, output_format, limit, cost, coding)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': agent.utils.http_cache.format_http_date(measurement_window.modified_at),
+        'Cache-Control': agent.utils.http_cache.cache_control(closed),
+        'Vary': 'Accept, Accept-Encoding',  # The output format and the compression may be negotiated
+        agent.utils.consts.AGENT_FETCHED_AT_HEADER: fetched_at,
+    }
+    if agent.utils.http_cache.is_not_modified(request.headers, etag, measurement_window.modified_at):
+        return fastapi.responses.Response(status_code=304, headers=headers)
+
+    if output_format != 'json':
+        with agent.utils.metrics.EXTRACTION_SECONDS.time(**metric_labels):
+            measurement_columns = _extract_measurement_columns_from_fetched_data(fetched_data[:int(limit)], float(cost))
+        return fastapi.responses.StreamingResponse(
+            content=agent.utils.metrics.SERIALIZATION_SECONDS.time_iterator(
+                agent.utils.formats.ENCODERS[output_format](measurement_columns._asdict()),
+                format=output_format,
+                **metric_labels
+            ),
+            media_type=agent.utils.formats.FORMAT_MEDIA_TYPES[output_format],
+            headers=headers
+        )
+    with agent.utils.metrics.EXTRACTION_SECONDS.time(**metric_labels):
+        measurements = _extract_measurement_values_from_fetched_data(fetched_data[:int(limit)], float(cost))
+    compression_min_size: int = request.app.extra.get(
+        agent.utils.consts.AGENT_CONFIG_FIELD
+    ).compression_min_size  # type: ignore
+    with agent.utils.metrics.SERIALIZATION_SECONDS.time(format=output_format, **metric_labels):
+        body, applied_coding = agent.utils.compression.compress(
+            agent.utils.formats.encode_json({'status': 'success', 'data': measurements}),
+            coding,
+            compression_min_size
+        )
+    if applied_coding is not None:
+        headers['Content-Encoding'] = applied_coding
+    return fastapi.responses.Response(content=body, media_type='application/json', headers=headers, status_code=200)
+
+
+@MEASUREMENTS_ROUTER.get('/energy/range', dependencies=REQUIRES_LOGIN)
+async def query_measurements_range(request: fastapi.Request) -> fastapi.responses.Response:
+    starting_date = request.query_params.get('from')
+    ending_date = request.query_params.get('to')
+    if starting_date is None or ending_date is None:
+        return fastapi.responses.JSONResponse(
+            content={'status': 'error', 'message': 'Missing from or to parameter'},
+            status_code=400
+        )
+    resolution = request.query_params.get('resolution', 'hour').upper()
+    if resolution not in agent.utils.consts.PPE_DATA_RESOLUTION_PERIODS:
+        return fastapi.responses.JSONResponse(
+            content={'status': 'error', 'message': f'Unsupported resolution: {resolution}'},
+            status_code=400
+        )
+    try:
+        range_start = date_to_epoch(starting_date)
+        _, range_end = agent.utils.periods.window_bounds(date_to_epoch(ending_date), 'DAY')
+    except ValueError as invalid_parameter:
+        return fastapi.responses.JSONResponse(
+            content={'status': 'error', 'message': str(invalid_parameter)},
+            status_code=400
+        )
+    if range_start >= range_end:
+        return fastapi.responses.JSONResponse(
+            content={'status': 'error', 'message': 'The from date must not be later than the to date'},
+            status_code=400
+        )
+
+    try:
+        meter_id = _resolve_meter_id(request, request.query_params.get('meter'))
+    except InvalidQueryError as invalid_query:
+        return invalid_query.to_response()
+
+    return fastapi.responses.StreamingResponse(
+        content=_stream_measurements_range(
+            request.app,
+            meter_id,
+            agent.utils.consts.PPE_DATA_RESOLUTION_PERIODS[resolution],
+            (range_start, range_end),
+            float(request.query_params.get('cost', 1.0))
+        ),
+        media_type='application/x-ndjson'
+    )
+
+
+async def _stream_measurements_range(  # pylint: disable=too-many-locals
+    app: fastapi.FastAPI,
+    meter_id: int,
+    period: str,
+    measurements_range: tuple[int, int],
+    conversion_coefficient: float
+) -> typing.AsyncIterator[str]:
+    """
+        Fetches the windows covering the range concurrently (at most range_concurrency at a time) and yields
+        their measurements as NDJSON lines in timestamp order, as soon as each consecutive window is available.
+    """
+    range_start, range_end = measurements_range
+    window_epochs = iter(agent.utils.periods.split_range(range_start, range_end, period))
+    concurrency: int = app.extra.get(
+        agent.utils.consts.AGENT_CONFIG_FIELD
+    ).range_concurrency  # type: ignore
+
+    def schedule_next_window() -> None:
+        if (window_epoch := next(window_epochs, None)) is not None:
+            pending_windows.append((
+                window_epoch,
+                asyncio.ensure_future(fetch_measurement_data(app, meter_id, window_epoch, period))
+            ))
+
+    pending_windows: collections.deque[tuple[int, asyncio.Future]] = collections.deque()
+    for _ in range(concurrency):
+        schedule_next_window()
+    try:
+        while pending_windows:
+            window_epoch, pending_window = pending_windows.popleft()
+            try:
+                measurement_window = await pending_window
+            except agent.utils.retry.UpstreamUnavailableError as upstream_error:
+                yield json.dumps({'status': 'error', 'message': str(upstream_error), 'window': window_epoch}) + '\n'
+                return
+            schedule_next_window()
+            if measurement_window is None:
+                yield json.dumps({'status': 'error', 'message': 'Failed to fetch data', 'window': window_epoch}) + '\n'
+                return
+            for measurement in _extract_measurement_values_from_fetched_data(
+                [
+                    measurement_data
+                    for measurement_data in measurement_window.data
+                    if 'tm' in measurement_data and range_start <= int(measurement_data['tm']) < range_end
+                ],
+                conversion_coefficient
+            ):
+                yield json.dumps(measurement) + '\n'
+    finally:
+        for _, pending_window in pending_windows:
+            pending_window.cancel()
 
+
+@MEASUREMENTS_ROUTER.get('/energy/since', dependencies=REQUIRES_LOGIN)
+async def query_measurements_since(request: fastapi.Request) -> fastapi.responses.Response:
+    """
+        Returns the hourly measurements newer than the tm cursor (epoch milliseconds), along with the cursor to pass in the next query.
+    """
+    try:
+        cursor = _parse_cursor(request.query_params.get('tm'))
+        meter_id = _resolve_meter_id(request, request.query_params.get('meter'))
+    except InvalidQueryError as invalid_query:
+        return invalid_query.to_response()
+
+    recent_readings: agent.utils.readings.RecentReadings = request.app.extra.get(
+        agent.utils.consts.AGENT_RECENT_READINGS_FIELD
+    )  # type: ignore
+    warm_cache: agent.utils.cache.WarmCache = request.app.extra.get(
+        agent.utils.consts.AGENT_WARM_CACHE_FIELD
+    )  # type: ignore
+    readings = recent_readings.since(meter_id, cursor, time.time() - warm_cache.max_age)
+    if readings is None:  # The collected days are kept in memory for the subsequent queries
+        new_data = await collect_measurements_since(request.app, meter_id, cursor)
+        if new_data is None:
+            return fastapi.responses.JSONResponse(
+                content={'status': 'error', 'message': 'Failed to fetch data'},
+                status_code=500
+            )
+        readings = agent.utils.readings.ReadingsSlice.from_datapoints(new_data)
     return fastapi.responses.JSONResponse(
-        content={'status': 'success', 'data': _extract_measurement_values_from_fetched_data(
-            fetched_data[:int(limit)],
-            float(cost)
-        )},
+        content={
+            'status': 'success',
+            'cursor': readings.timestamps[-1] if readings.timestamps else cursor,
+            'data': _extract_measurement_values_from_readings(readings, float(request.query_params.get('cost', 1.0))),
+        },
         status_code=200
     )
 
 
+@MEASUREMENTS_ROUTER.get('/energy/stream', dependencies=REQUIRES_LOGIN)
+async def stream_measurements(request: fastapi.Request) -> fastapi.responses.Response:
+    """
+        Pushes the hourly measurements of the meter as server-sent events, as soon as the agent sees them.
+
+        Every event carries the timestamp of its measurement as the event ID, so reconnecting clients (sending Last-Event-ID)
+        receive the measurements they have missed first. A stream, which cannot go on, is closed with an error event
+        (carrying the status code and message of the error), along with the time after which the client should reconnect.
+    """
+    try:
+        cursor = _parse_cursor(
+            request.query_params.get('tm') or request.headers.get('last-event-id') or str(int(time.time() * 1000))
+        )
+        meter_id = _resolve_meter_id(request, request.query_params.get('meter'))
+    except InvalidQueryError as invalid_query:
+        return invalid_query.to_response()
+    return fastapi.responses.StreamingResponse(
+        content=_stream_new_measurements(request.app, meter_id, cursor, float(request.query_params.get('cost', 1.0))),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _parse_cursor(cursor: str | None) -> int:
+    if cursor is None:
+        raise InvalidQueryError('Missing tm parameter')
+    if not cursor.isdigit():
+        raise InvalidQueryError(f'Invalid tm: {cursor}')
+    if int(cursor) < (time.time() - agent.utils.consts.SINCE_MAX_SPAN) * 1000:
+        raise InvalidQueryError('The tm cursor is too old, query /energy/range instead')
+    return int(cursor)
+
+
+async def _stream_new_measurements(
+    app: fastapi.FastAPI,
+    meter_id: int,
+    cursor: int,
+    conversion_coefficient: float
+) -> typing.AsyncIterator[str]:
+    broadcaster: agent.utils.broadcast.MeasurementBroadcaster = app.extra.get(
+        agent.utils.consts.AGENT_BROADCASTER_FIELD
+    )  # type: ignore
+    try:
+        async with broadcaster.subscribe(meter_id) as new_data_queue:  # Subscribed before catching up, so nothing falls in between
+            new_data = await collect_measurements_since(app, meter_id, cursor)
+            if new_data is None:
+                yield _format_error_event(502, 'Failed to fetch data', agent.utils.consts.RETRY_MAX_DELAY)
+                return
+            while new_data is not None:
+                new_data = [measurement_data for measurement_data in new_data if int(measurement_data['tm']) > cursor]
+                for measurement_data, measurement in zip(
+                    new_data,
+                    _extract_measurement_values_from_fetched_data(new_data, conversion_coefficient)
+                ):
+                    cursor = int(measurement_data['tm'])
+                    yield f'id: {cursor}\nevent: measurement\ndata: {json.dumps(measurement)}\n\n'
+                try:
+                    new_data = await asyncio.wait_for(new_data_queue.get(), agent.utils.consts.STREAM_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    new_data = []
+                    yield ': keepalive\n\n'
+            # Disconnected by the broadcaster for not keeping up - the missed measurements are sent once the client reconnects
+            yield _format_error_event(503, 'Disconnected for not keeping up with the stream', agent.utils.consts.STREAM_RECONNECT_DELAY)
+    except agent.utils.retry.UpstreamUnavailableError as upstream_error:
+        yield _format_error_event(upstream_error.status_code, str(upstream_error), upstream_error.retry_after)
+
+
+def _format_error_event(status_code: int, message: str, retry_after: float) -> str:
+    """
+        Formats the server-sent event closing the stream - the retry field tells the client how long to wait (in milliseconds) before reconnecting.
+    """
+    return (
+        f'event: error\nretry: {max(1000, int(retry_after * 1000))}\n'
+        f'data: {json.dumps({"status": "error", "code": status_code, "message": message})}\n\n'
+    )
+
+
+async def collect_measurements_since(app: fastapi.FastAPI, meter_id: int, cursor: int) -> list[EnergaMeasurementData] | None:
+    """
+        Returns the datapoints (with at least one zone measured) newer than the cursor, from the DAY windows between the cursor and now.
+    """
+    window_epochs = agent.utils.periods.split_range(cursor + 1, int(time.time() * 1000), 'DAY')
+    measurement_windows = await asyncio.gather(*(
+        fetch_measurement_data(app, meter_id, window_epoch, 'DAY')
+        for window_epoch in window_epochs
+    ))
+    if any(measurement_window is None for measurement_window in measurement_windows):
+        return None
+    recent_readings: agent.utils.readings.RecentReadings = app.extra.get(
+        agent.utils.consts.AGENT_RECENT_READINGS_FIELD
+    )  # type: ignore
+    for window_epoch, measurement_window in zip(window_epochs, measurement_windows):
+        recent_readings.record(meter_id, window_epoch, measurement_window.data, measurement_window.fetched_at)  # type: ignore
+    return [
+        measurement_data
+        for measurement_window in measurement_windows
+        for measurement_data in measurement_window.data  # type: ignore
+        if 'tm' in measurement_data and int(measurement_data['tm']) > cursor
+        and any(zone is not None for zone in measurement_data.get('zones') or [])
+    ]
+
+
+async def fetch_measurement_data(
+    app: fastapi.FastAPI,
+    meter_id: int,
+    epoch: int,
+    period: str
+) -> MeasurementWindow | None:
+    """
+        Returns the measurements of the window that contains the given epoch, answering from the warm cache for recently (pre)fetched
+        open windows, from the local store for closed windows (and open ones recently fetched by other workers), aggregating
+        the coarse (week, month, year) windows from the finer data at hand and fetching (and storing) the data from Energa otherwise.
+        Returns None, if the upstream request did not succeed.
+
+        Identical concurrent upstream fetches (same meter, epoch and period) are coalesced into a single request.
+    """
+    epoch, _ = agent.utils.periods.window_bounds(epoch, period)  # Any date within the window yields the same data
+    warm_cache: agent.utils.cache.WarmCache = app.extra.get(
+        agent.utils.consts.AGENT_WARM_CACHE_FIELD
+    )  # type: ignore
+    cached_window = warm_cache.get((meter_id, epoch, period))
+    agent.utils.metrics.record_cache_lookup('warm', hit=cached_window is not None)
+    if cached_window is not None:
+        return MeasurementWindow(cached_window.data, cached_window.fetched_at, cached_window.digest, cached_window.modified_at)
+
+    store: agent.utils.storage.MeasurementStore = app.extra.get(
+        agent.utils.consts.AGENT_STORE_FIELD
+    )  # type: ignore
+    stored_window = await fastapi.concurrency.run_in_threadpool(
+        store.load_window, meter_id, period, epoch, time.time() - warm_cache.max_age
+    )
+    agent.utils.metrics.record_cache_lookup('store', hit=stored_window is not None)
+    if stored_window is not None:
+        return MeasurementWindow(*stored_window)  # type: ignore
+    if period in agent.utils.aggregation.AGGREGATED_PERIODS:
+        aggregated_window = await _aggregate_measurement_data(app, meter_id, epoch, period, time.time() - warm_cache.max_age)
+        agent.utils.metrics.record_cache_lookup('rollups', hit=aggregated_window is not None)
+        if aggregated_window is not None:
+            return aggregated_window
+    return await refresh_measurement_data(app, meter_id, epoch, period)
+
+
+async def _aggregate_measurement_data(
+    app: fastapi.FastAPI,
+    meter_id: int,
+    epoch: int,
+    period: str,
+    fresh_since: float
+) -> MeasurementWindow | None:
+    """
+        Assembles the coarse window out of the daily (or monthly) rollups, fetching the few finer windows still missing.
+
+        Returns None, if too many (or unavailable) windows are missing, so fetching the coarse window as a whole is cheaper.
+    """
+    aggregation_engine: agent.utils.aggregation.AggregationEngine = app.extra.get(
+        agent.utils.consts.AGENT_AGGREGATION_FIELD
+    )  # type: ignore
+    aggregated_window = await fastapi.concurrency.run_in_threadpool(
+        aggregation_engine.load, meter_id, period, epoch, fresh_since
+    )
+    if len(aggregated_window.missing) > aggregation_engine.max_missing_windows:
+        aggregation_engine.fallbacks += 1
+        return None
+    if aggregated_window.missing:
+        # Missing daily buckets are filled with DAY windows, missing monthly ones with (possibly aggregated) MONTH windows
+        fill_period = agent.utils.aggregation.ROLLUP_RESOLUTIONS[period]
+        filled_windows = await asyncio.gather(*(
+            fetch_measurement_data(app, meter_id, bucket_start, fill_period)
+            for bucket_start in aggregated_window.missing
+        ))
+        for filled_window in filled_windows:
+            if filled_window is None:
+                aggregation_engine.fallbacks += 1
+                return None
+            # Windows served from the store may predate their rollups - recording them again keeps the buckets fetched since
+            await fastapi.concurrency.run_in_threadpool(
+                aggregation_engine.record, meter_id, fill_period, filled_window.data, filled_window.fetched_at
+            )
+        aggregated_window = await fastapi.concurrency.run_in_threadpool(
+            aggregation_engine.load, meter_id, period, epoch, fresh_since
+        )
+        if aggregated_window.missing:  # Energa has no data for some of the buckets
+            aggregation_engine.fallbacks += 1
+            return None
+        aggregation_engine.filled += len(filled_windows)
+    aggregation_engine.aggregated += 1
+    digest = agent.utils.http_cache.digest_data(aggregated_window.data)
+    modified_at = aggregated_window.modified_at
+    if agent.utils.periods.is_window_closed(epoch, period):
+        store: agent.utils.storage.MeasurementStore = app.extra.get(
+            agent.utils.consts.AGENT_STORE_FIELD
+        )  # type: ignore
+        modified_at = await fastapi.concurrency.run_in_threadpool(
+            store.save_window, meter_id, period, epoch, aggregated_window.data, True, aggregated_window.fetched_at, digest  # type: ignore
+        )
+    return MeasurementWindow(aggregated_window.data, aggregated_window.fetched_at, digest, modified_at)  # type: ignore
+
+
+async def refresh_measurement_data(
+    app: fastapi.FastAPI,
+    meter_id: int,
+    epoch: int,
+    period: str
+) -> MeasurementWindow | None:
+    """
+        Fetches the measurements of the window that contains the given epoch from Energa, bypassing the local store and the warm cache.
+    """
+    epoch, _ = agent.utils.periods.window_bounds(epoch, period)
+    single_flight: agent.utils.coalescing.SingleFlight = app.extra.get(
+        agent.utils.consts.AGENT_SINGLE_FLIGHT_FIELD
+    )  # type: ignore
+    return await single_flight.run(
+        (meter_id, epoch, period),
+        lambda: _fetch_measurement_data_once(app, meter_id, epoch, period)
+    )
+
+
+async def _fetch_measurement_data_once(
+    app: fastapi.FastAPI,
+    meter_id: int,
+    epoch: int,
+    period: str
+) -> MeasurementWindow | None:
+    """
+        Fetches the window from Energa, unless another worker has fetched it while this one was waiting for its turn.
+    """
+    store: agent.utils.storage.MeasurementStore = app.extra.get(
+        agent.utils.consts.AGENT_STORE_FIELD
+    )  # type: ignore
+    worker_locks: agent.utils.interprocess.WorkerLocks = app.extra.get(
+        agent.utils.consts.AGENT_WORKER_LOCKS_FIELD
+    )  # type: ignore
+    waiting_since = time.time()
+    async with worker_locks.hold((meter_id, epoch, period)):
+        stored_window = await fastapi.concurrency.run_in_threadpool(
+            store.load_window, meter_id, period, epoch, waiting_since
+        )
+        if stored_window is not None:
+            return MeasurementWindow(*stored_window)  # type: ignore
+        return await _fetch_upstream_measurement_data(app, meter_id, epoch, period)
+
+
+async def _fetch_upstream_measurement_data(  # pylint: disable=too-many-locals
+    app: fastapi.FastAPI,
+    meter_id: int,
+    epoch: int,
+    period: str
+) -> MeasurementWindow | None:
+    store: agent.utils.storage.MeasurementStore = app.extra.get(
+        agent.utils.consts.AGENT_STORE_FIELD
+    )  # type: ignore
+    warm_cache: agent.utils.cache.WarmCache = app.extra.get(
+        agent.utils.consts.AGENT_WARM_CACHE_FIELD
+    )  # type: ignore
+    authorized_energa_session = app.extra.get(
+        agent.utils.consts.AGENT_ENERGA_SESSION_FIELD
+    ).session_for(meter_id)  # type: ignore
+    retry_policy: agent.utils.retry.RetryPolicy = app.extra.get(
+        agent.utils.consts.AGENT_RETRY_POLICY_FIELD
+    )  # type: ignore
+    rate_limiter: agent.utils.ratelimit.OutboundRateLimiter = app.extra.get(
+        agent.utils.consts.AGENT_RATE_LIMITER_FIELD
+    )  # type: ignore
+
+    async def fetch_chart() -> httpx.Response:
+        await rate_limiter.acquire()
+        response = await authorized_energa_session.get(
+            url=f'{agent.utils.consts.PPE_DATA_CHARTS_PATH}?mainChartDate={epoch}&type={period}&meterPoint={meter_id}&mo=A%2B',
+            expect_json=True,
+            timeout=app.extra.get(
+                agent.utils.consts.AGENT_CONFIG_FIELD
+            ).timeout  # type: ignore
+        )
+        response.raise_for_status()
+        return response
+
+    metric_labels = {'period': period, 'meter': meter_id}
+    try:
+        with agent.utils.metrics.UPSTREAM_IN_FLIGHT.track_in_progress(**metric_labels), \
+                agent.utils.metrics.UPSTREAM_FETCH_SECONDS.time(**metric_labels):
+            response = await retry_policy.acall(fetch_chart)
+    except Exception as failed_fetch:
+        agent.utils.metrics.ERRORS.inc(type=type(failed_fetch).__name__)
+        raise
+    if response.status_code != 200:  # A successful response without the chart (e.g. 202 or 204) must not be served as a window without data
+        agent.utils.metrics.ERRORS.inc(type=f'HTTP {response.status_code}')
+        raise agent.utils.retry.UpstreamUnavailableError(
+            f'Energa answered with HTTP {response.status_code} instead of the chart',
+            retry_after=agent.utils.consts.RETRY_MAX_DELAY
+        )
+
+    try:
+        with agent.utils.metrics.JSON_DECODE_SECONDS.time(**metric_labels):
+            fetched_data: list[EnergaMeasurementData] = response.json().get('response', {}).get('mainChart', [])
+    except (ValueError, AttributeError) as malformed_chart:  # Not a JSON body (e.g. an error page) or not a JSON object
+        agent.utils.metrics.ERRORS.inc(type='MalformedChart')
+        raise agent.utils.retry.UpstreamUnavailableError(
+            'Energa returned a malformed chart',
+            retry_after=agent.utils.consts.RETRY_MAX_DELAY
+        ) from malformed_chart
+    fetched_at = time.time()
+    digest = await fastapi.concurrency.run_in_threadpool(agent.utils.http_cache.digest_data, fetched_data)
+    aggregation_engine: agent.utils.aggregation.AggregationEngine = app.extra.get(
+        agent.utils.consts.AGENT_AGGREGATION_FIELD
+    )  # type: ignore
+    await fastapi.concurrency.run_in_threadpool(
+        aggregation_engine.record, meter_id, period, fetched_data, fetched_at
+    )
+    if period == 'DAY':
+        app.extra.get(
+            agent.utils.consts.AGENT_RECENT_READINGS_FIELD
+        ).record(meter_id, epoch, fetched_data, fetched_at)  # type: ignore
+        app.extra.get(
+            agent.utils.consts.AGENT_BROADCASTER_FIELD
+        ).publish(meter_id, fetched_data)  # type: ignore
+    is_closed = agent.utils.periods.is_window_closed(epoch, period)
+    if is_closed:
+        warm_cache.discard((meter_id, epoch, period))
+    if is_closed or warm_cache.differs((meter_id, epoch, period), digest):
+        modified_at = await fastapi.concurrency.run_in_threadpool(
+            store.save_window, meter_id, period, epoch, fetched_data, is_closed, fetched_at, digest  # type: ignore
+        )
+    else:
+        modified_at = await fastapi.concurrency.run_in_threadpool(
+            store.touch_window, meter_id, period, epoch, fetched_at
+        )
+    if not is_closed:
+        warm_cache.put((meter_id, epoch, period), fetched_data, fetched_at, digest, modified_at)
+    return MeasurementWindow(fetched_data, fetched_at, digest, modified_at)
+
+
 def _extract_measurement_values_from_fetched_data(
     fetched_data: list[EnergaMeasurementData],
     conversion_coefficient: float
 ) -> list[Measurement]:
-    def __energa_data_reducer(
-        measurements_collection: list[Measurement],
-        measurement_data: EnergaMeasurementData
-    ) -> list[Measurement]:
-        if 'zones' not in measurement_data or 'tm' not in measurement_data:
-            return measurements_collection
-        data_for_each_zone = measurement_data.get('zones', (0.0, 0.0, 0.0))
-        measurement_time = datetime.datetime.fromtimestamp(
-            int(measurement_data.get('tm')) / 1000  # type: ignore
-        ).strftime('%Y-%m-%d %H:%M:%S')
-        return measurements_collection + [Measurement(measurement_time, EnergyConsumptionPerZone(
-            round_the_clock=data_for_each_zone[0] or 0.0 * conversion_coefficient,
-            daily=data_for_each_zone[1] or 0.0 * conversion_coefficient,
-            nightly=data_for_each_zone[2] or 0.0 * conversion_coefficient
-        ))]
-
-    extracted_values: list[Measurement] = functools.reduce(
-        __energa_data_reducer,
-        fetched_data,
-        []
+    return [
+        Measurement(measurement_time, EnergyConsumptionPerZone(round_the_clock, daily, nightly))
+        for measurement_time, round_the_clock, daily, nightly in zip(
+            *_extract_measurement_columns_from_fetched_data(fetched_data, conversion_coefficient)
+        )
+    ]
+
+
+def _extract_measurement_values_from_readings(
+    readings: agent.utils.readings.ReadingsSlice,
+    conversion_coefficient: float
+) -> list[Measurement]:
+    return [
+        Measurement(measurement_time, EnergyConsumptionPerZone(
+            round_the_clock * conversion_coefficient,
+            daily * conversion_coefficient,
+            nightly * conversion_coefficient
+        ))
+        for measurement_time, round_the_clock, daily, nightly in zip(format_timestamps(readings.timestamps.tolist()), *readings.zones)
+    ]
+
+
+def _extract_measurement_columns_from_fetched_data(
+    fetched_data: list[EnergaMeasurementData],
+    conversion_coefficient: float
+) -> MeasurementColumns:
+    """
+        Converts the datapoints returned by Energa into measurement columns, in a single pass over the timestamp and zone columns.
+
+        Missing zone values are treated as zero, and every zone is multiplied by the conversion coefficient (e.g. cost of a kWh).
+    """
+    valid_data = [
+        measurement_data
+        for measurement_data in fetched_data
+        if 'zones' in measurement_data and 'tm' in measurement_data
+    ]
+    zones_columns = [
+        [(zone or 0.0) * conversion_coefficient for zone in zones_column]
+        for zones_column in zip(*(
+            [*measurement_data['zones'], None, None, None][:3]
+            for measurement_data in valid_data
+        ))
+    ] or [[], [], []]
+    return MeasurementColumns(
+        format_timestamps([int(measurement_data['tm']) for measurement_data in valid_data]),
+        *zones_columns
     )
-    return [*filter(bool, extracted_values)]
+
+
+def format_timestamps(timestamps: list[int]) -> list[str]:
+    """
+        Formats epoch milliseconds as local '%Y-%m-%d %H:%M:%S' strings.
+
+        The date part is formatted once per day and the time of day is computed arithmetically from the local midnight,
+        which is much cheaper than calling strftime for every timestamp. Days with a DST transition fall back to time.strftime.
+    """
+    formatted_timestamps: list[str] = []
+    day_start = day_end = 0
+    date_prefix = ''
+    is_regular_day = True
+    for timestamp in timestamps:
+        seconds = timestamp // 1000
+        if not day_start <= seconds < day_end:
+            midnight = datetime.datetime.fromtimestamp(seconds).replace(hour=0, minute=0, second=0, microsecond=0)
+            day_start = int(midnight.timestamp())
+            day_end = int((midnight + datetime.timedelta(days=1)).timestamp())
+            is_regular_day = day_end - day_start == 24 * 60 * 60
+            date_prefix = midnight.strftime('%Y-%m-%d ')
+        if is_regular_day:
+            formatted_timestamps.append(date_prefix + _format_time_of_day(seconds - day_start))
+        else:
+            formatted_timestamps.append(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds)))
+    return formatted_timestamps
+
+
+@functools.lru_cache(maxsize=24 * 60)
+def _format_time_of_day(seconds_since_midnight: int) -> str:
+    return f'{seconds_since_midnight // 3600:02d}:{seconds_since_midnight // 60 % 60:02d}:{seconds_since_midnight % 60:02d}'
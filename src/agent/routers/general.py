@@ -1,7 +1,12 @@
+import typing
+
 import fastapi
 import fastapi.responses
 
+import agent.utils.assets
 import agent.utils.consts
+import agent.utils.metrics
+import agent.utils.startup
 
 
 GENERAL_ROUTER = fastapi.APIRouter()
@@ -9,12 +14,10 @@ GENERAL_ROUTER = fastapi.APIRouter()
 
 @GENERAL_ROUTER.get('/')
 async def get_root_path(request: fastapi.Request) -> fastapi.responses.Response:
-    assets_path: str = request.app.extra.get(
-        agent.utils.consts.AGENT_CONFIG_FIELD
-    ).assets_path
-    return fastapi.responses.HTMLResponse(
-        content=open(f'{assets_path}/index.html', encoding='utf-8').read(),
-    )
+    asset_cache: agent.utils.assets.AssetCache = request.app.extra.get(
+        agent.utils.consts.AGENT_ASSETS_FIELD
+    )  # type: ignore
+    return asset_cache.response('index.html', request)
 
 
 @GENERAL_ROUTER.get('/health')
@@ -22,3 +25,43 @@ async def get_health_check() -> fastapi.responses.Response:
     return fastapi.responses.JSONResponse(
         content={'status': 'ok'},
     )
+
+
+@GENERAL_ROUTER.get('/ready')
+async def get_readiness_check(request: fastapi.Request) -> fastapi.responses.Response:
+    """
+        Unlike the health check, passes only once the agent has logged into Energa and knows the meters to serve.
+        Accounts, which are not logged in yet (while the others are), are listed, but do not fail the check.
+    """
+    startup: agent.utils.startup.StartupState = request.app.extra.get(
+        agent.utils.consts.AGENT_STARTUP_FIELD
+    )  # type: ignore
+    if not startup.is_ready:
+        return fastapi.responses.JSONResponse(
+            content={'status': 'error', 'message': 'Not logged into Energa service yet'},
+            status_code=503,
+        )
+    return fastapi.responses.JSONResponse(
+        content={'status': 'ok', **({'failed_accounts': [*startup.failed_accounts]} if startup.failed_accounts else {})},
+    )
+
+
+@GENERAL_ROUTER.get('/stats')
+async def get_stats(request: fastapi.Request) -> fastapi.responses.Response:
+    registered_stats: dict[str, typing.Callable[[], dict[str, typing.Any]]] = request.app.extra.get(
+        agent.utils.consts.AGENT_STATS_FIELD, {}
+    )
+    return fastapi.responses.JSONResponse(
+        content={name: collect_stats() for name, collect_stats in registered_stats.items()},
+    )
+
+
+@GENERAL_ROUTER.get('/metrics')
+async def get_metrics(request: fastapi.Request) -> fastapi.responses.Response:
+    registered_stats: dict[str, typing.Callable[[], dict[str, typing.Any]]] = request.app.extra.get(
+        agent.utils.consts.AGENT_STATS_FIELD, {}
+    )
+    return fastapi.responses.PlainTextResponse(
+        content=agent.utils.metrics.REGISTRY.render(registered_stats),
+        media_type='text/plain; version=0.0.4',
+    )
@@ -1,20 +1,37 @@
+import asyncio
 import contextlib
 import dataclasses
+import functools
 import logging
+import math
 import re
+import time
 import typing
-import sys
 
 import fastapi
-import requests
+import fastapi.concurrency
+import fastapi.responses
 
 import agent.routers.general
 import agent.routers.energa
 
+import agent.utils.aggregation
+import agent.utils.assets
+import agent.utils.broadcast
+import agent.utils.cache
+import agent.utils.client
+import agent.utils.coalescing
 import agent.utils.config
 import agent.utils.consts
+import agent.utils.interprocess
 import agent.utils.logger
+import agent.utils.ratelimit
+import agent.utils.readings
 import agent.utils.retry
+import agent.utils.scheduler
+import agent.utils.session
+import agent.utils.startup
+import agent.utils.storage
 
 IMPLEMENTED_ROUTERS = [
     agent.routers.general.GENERAL_ROUTER,
@@ -22,8 +39,19 @@ IMPLEMENTED_ROUTERS = [
 ]
 
 
+async def handle_upstream_unavailable(
+    _: fastapi.Request,
+    upstream_error: agent.utils.retry.UpstreamUnavailableError
+) -> fastapi.responses.Response:
+    return fastapi.responses.JSONResponse(
+        content={'status': 'error', 'message': str(upstream_error)},
+        status_code=upstream_error.status_code,
+        headers={'Retry-After': str(max(1, math.ceil(upstream_error.retry_after)))}
+    )
+
+
 @dataclasses.dataclass
-class PPEAgentService:
+class PPEAgentService:  # pylint: disable=too-many-instance-attributes
     config: dict[str, typing.Any]
     logger: logging.Logger = dataclasses.field(init=False)
     _config: agent.utils.config.PPEAgentConfig = dataclasses.field(
@@ -34,79 +62,286 @@ class PPEAgentService:
         init=False,
         default_factory=dict
     )
-    _credentials: agent.utils.config.PPECredentials = dataclasses.field(
+    _accounts: dict[str, agent.utils.config.PPECredentials] = dataclasses.field(
         init=False,
-        repr=False
+        repr=False,
+        default_factory=dict
     )
     _app: fastapi.FastAPI = dataclasses.field(
         init=False,
         default_factory=fastapi.FastAPI
     )
-    _energa_session: requests.Session = dataclasses.field(
+    _session_pool: agent.utils.session.EnergaSessionPool = dataclasses.field(
+        init=False,
+        default_factory=agent.utils.session.EnergaSessionPool
+    )
+    _retry_policy: agent.utils.retry.RetryPolicy = dataclasses.field(
+        init=False,
+    )
+    _session_versions: dict[str, float] = dataclasses.field(
+        init=False,
+        repr=False,
+        default_factory=dict
+    )
+    _startup: agent.utils.startup.StartupState = dataclasses.field(
         init=False,
-        default_factory=requests.Session
+        default_factory=agent.utils.startup.StartupState
     )
 
     def __post_init__(self) -> None:
-        self._credentials = agent.utils.config.PPECredentials(
-            **self.config.pop('credentials')
-        )
+        self._config.apply_overrides(self.config.pop('overrides', {}))
+        default_credentials = self.config.pop('credentials', None) or {}
+        if default_credentials.get('email'):
+            self._accounts[agent.utils.consts.DEFAULT_ACCOUNT_NAME] = agent.utils.config.PPECredentials(**default_credentials)
+        for account_name, account_credentials in (self._config.accounts | self.config.pop('accounts', {})).items():
+            self._accounts[account_name] = agent.utils.config.PPECredentials(**account_credentials)
+        if not self._accounts:
+            raise ValueError('At least one Energa account must be configured')
         self._log_config = agent.utils.logger.initialize_loggers(
             self._config.log_level,
-            self._config.logging_format
+            self._config.logging_format,
+            queued=self._config.logging_queue,
+            json_format=self._config.logging_json,
+            access_sample_rate=self._config.access_log_sample_rate,
+            access_rate_limit=self._config.access_log_rate_limit
         )
         self.logger = logging.getLogger('uvicorn')
+        self._retry_policy = agent.utils.retry.RetryPolicy(
+            max_retries=self._config.max_retries
+        )
 
         @contextlib.asynccontextmanager
         async def application_bootstrap(app: fastapi.FastAPI):
-            self.login()
+            for account_name in self._accounts:
+                self._session_pool.sessions[account_name] = agent.utils.session.EnergaSessionManager(
+                    client=agent.utils.client.EnergaClient(
+                        base_url=self._config.energa_base_url,
+                        timeout=self._config.timeout,
+                        max_connections=self._config.max_connections
+                    ),
+                    authenticate=functools.partial(self.login, account_name),
+                    keepalive_interval=self._config.keepalive_interval
+                )
+            asset_cache = agent.utils.assets.AssetCache(self._config.assets_path)
+            asset_cache.load()
+            app.extra[agent.utils.consts.AGENT_ASSETS_FIELD] = asset_cache
+            store = agent.utils.storage.MeasurementStore(self._config.storage_path)
+            app.extra[agent.utils.consts.AGENT_STORE_FIELD] = store
+            aggregation_engine = agent.utils.aggregation.AggregationEngine(store)
+            app.extra[agent.utils.consts.AGENT_AGGREGATION_FIELD] = aggregation_engine
+            worker_locks = agent.utils.interprocess.WorkerLocks(f'{self._config.storage_path}.lock', shared=self._config.workers > 1)
+            worker_locks.acquire_leadership()
+            app.extra[agent.utils.consts.AGENT_WORKER_LOCKS_FIELD] = worker_locks
+            single_flight = agent.utils.coalescing.SingleFlight()
+            warm_cache = agent.utils.cache.WarmCache(
+                max_age=2 * self._config.prefetch_interval + self._config.prefetch_jitter
+            )
+            rate_limiter = agent.utils.ratelimit.OutboundRateLimiter(
+                # Every worker process has its own bucket, so the configured rate is split between them
+                rate=self._config.upstream_rate_limit / self._config.workers,
+                burst=max(1, self._config.upstream_burst // self._config.workers),
+                max_queue_depth=self._config.upstream_queue_size,
+                max_queue_time=self._config.upstream_queue_timeout
+            )
+            app.extra[agent.utils.consts.AGENT_RATE_LIMITER_FIELD] = rate_limiter
+            broadcaster = agent.utils.broadcast.MeasurementBroadcaster(
+                poll=self._poll_new_measurements,
+                interval=self._config.prefetch_interval or agent.utils.consts.STREAM_POLL_INTERVAL
+            )
+            app.extra[agent.utils.consts.AGENT_BROADCASTER_FIELD] = broadcaster
+            recent_readings = agent.utils.readings.RecentReadings(self._config.recent_readings_days)
+            prefetch_scheduler = agent.utils.scheduler.PrefetchScheduler(
+                refresh=self._prefetch_current_window,
+                interval=self._config.prefetch_interval,
+                jitter=self._config.prefetch_jitter
+            )
+            app.extra.update({
+                agent.utils.consts.AGENT_SINGLE_FLIGHT_FIELD: single_flight,
+                agent.utils.consts.AGENT_RETRY_POLICY_FIELD: self._retry_policy,
+                agent.utils.consts.AGENT_WARM_CACHE_FIELD: warm_cache,
+                agent.utils.consts.AGENT_RECENT_READINGS_FIELD: recent_readings,
+                agent.utils.consts.AGENT_STARTUP_FIELD: self._startup,
+                agent.utils.consts.AGENT_ENERGA_SESSION_FIELD: self._session_pool,
+                agent.utils.consts.AGENT_CONFIG_FIELD: self._config,
+            })
+            app.extra[agent.utils.consts.AGENT_STATS_FIELD] = {
+                'startup': self._startup.stats,
+                'upstream_queries': single_flight.stats,
+                'warm_cache': warm_cache.stats,
+                'aggregation': aggregation_engine.stats,
+                'stream': broadcaster.stats,
+                'recent_readings': recent_readings.stats,
+                'rate_limiter': rate_limiter.stats,
+                'prefetch': prefetch_scheduler.stats,
+                'sessions': self._session_pool.stats,
+                'retries': self._retry_policy.stats,
+                'assets': asset_cache.stats,
+                'workers': worker_locks.stats,
+                'logging': agent.utils.logger.LOGGING_STATS.stats,
+            }
             for router in IMPLEMENTED_ROUTERS:
                 app.include_router(router)
+            if self._config.assets_reload:
+                asset_cache.start_watching()
+            # Logging into Energa may take long (or fail for a while), so it does not hold up binding the socket
+            background_login = asyncio.create_task(self._login_in_background(prefetch_scheduler, worker_locks))
+            # The other workers keep contesting the leadership, so the background jobs are taken over, once the leader is gone
+            leadership_contest = asyncio.create_task(self._contest_leadership(prefetch_scheduler, worker_locks))
+            self.logger.info(f'Started serving in {self._startup.mark("bootstrap")} s, logging into Energa in the background')
             yield
-            self.logout()
+            background_login.cancel()
+            leadership_contest.cancel()
+            await asyncio.gather(background_login, leadership_contest, return_exceptions=True)
+            await asset_cache.stop_watching()
+            await broadcaster.stop()
+            await rate_limiter.stop()
+            await self._session_pool.stop_keepalive()
+            await prefetch_scheduler.stop()
+            await self.logout()
+            store.close()
+            worker_locks.close()
 
         self._app = fastapi.FastAPI(
             lifespan=application_bootstrap,
             root_path=self._config.root_path,
         )
+        self._app.add_exception_handler(
+            agent.utils.retry.UpstreamUnavailableError,
+            handle_upstream_unavailable  # type: ignore
+        )
 
-    def login(self) -> None:
-        self.logger.info('Logging into Energa service')
-        with agent.utils.retry.retry_procedure(
-            max_retries=self._config.max_retries
-        ):
-            current_page_content = self._energa_session.get(
-                agent.utils.consts.PPE_LOGIN_URL
-            ).text
-            fetched_csrf_token_matches = re.search(
-                r'name="_antixsrf" value="(.+?)"',
-                current_page_content
-            )
-            if fetched_csrf_token_matches is None:
-                raise ValueError('Could not fetch CSRF token')
-            fetched_csrf_token = fetched_csrf_token_matches[1]
-            response = self._energa_session.post(
-                url=agent.utils.consts.PPE_LOGIN_URL,
-                data={
-                    '_antixsrf': fetched_csrf_token,
-                } | self._credentials.get_form_data()
+    async def _login_in_background(
+        self,
+        prefetch_scheduler: agent.utils.scheduler.PrefetchScheduler,
+        worker_locks: agent.utils.interprocess.WorkerLocks
+    ) -> None:
+        """
+            Logs into the Energa accounts, retrying the failed ones with an increasing delay until all of them succeed.
+            The agent gets ready (and starts the background jobs) as soon as any account is logged in, so one failing account
+            does not keep the meters of the others from being served.
+        """
+        pending_accounts = [*self._accounts]
+        retry_delay = agent.utils.consts.STARTUP_LOGIN_RETRY_DELAY
+        while True:
+            self._startup.login_attempts += 1
+            login_results = await asyncio.gather(*(
+                self.login(account_name) for account_name in pending_accounts
+            ), return_exceptions=True)
+            for account_name, login_result in zip(pending_accounts, login_results):
+                if isinstance(login_result, BaseException):
+                    self._startup.set_login_failed(str(login_result) or type(login_result).__name__, account_name)
+                    self.logger.warning(
+                        f'Failed to log into Energa service ({account_name} account), retrying in {retry_delay} s: '
+                        f'{self._startup.failed_accounts[account_name]}'
+                    )
+                    continue
+                self._startup.set_logged_in(account_name)
+                if worker_locks.is_leader:  # Other workers share the sessions kept alive by the leader
+                    self._session_pool.sessions[account_name].start_keepalive()
+            pending_accounts = [*self._startup.failed_accounts]
+            if not self._startup.is_ready and len(pending_accounts) < len(self._accounts):
+                self.logger.info(f'Ready to serve measurements in {self._startup.set_ready()} s')
+                if worker_locks.is_leader:  # Other workers share the windows prefetched by the leader
+                    prefetch_scheduler.start()
+            if not pending_accounts:
+                return
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(2 * retry_delay, agent.utils.consts.STARTUP_LOGIN_MAX_RETRY_DELAY)
+
+    async def _contest_leadership(
+        self,
+        prefetch_scheduler: agent.utils.scheduler.PrefetchScheduler,
+        worker_locks: agent.utils.interprocess.WorkerLocks
+    ) -> None:
+        """
+            Retries taking the leadership of the workers periodically, until it is released by the leader (the lock is freed, when its process exits).
+            The new leader starts the background jobs of the logged in accounts, while the rest of them are started by the background login.
+        """
+        while not worker_locks.is_leader:
+            await asyncio.sleep(agent.utils.consts.WORKER_LEADERSHIP_RETRY_INTERVAL)
+            if not worker_locks.acquire_leadership():
+                continue
+            self.logger.info('Took over the leadership of the workers, starting the background jobs')
+            for account_name, session in self._session_pool.sessions.items():
+                if self._accounts[account_name].id is not None:
+                    session.start_keepalive()
+            if self._startup.is_ready:
+                prefetch_scheduler.start()
+
+    async def _prefetch_current_window(self, period: str) -> None:
+        agent.utils.ratelimit.REQUEST_PRIORITY.set(agent.utils.ratelimit.Priority.BACKGROUND)
+        await asyncio.gather(*(
+            agent.routers.energa.refresh_measurement_data(
+                self._app,
+                meter_id,
+                int(time.time() * 1000),
+                period
             )
-            response.raise_for_status()
-            self._credentials.id = self.get_meter_id()
-            self._app.extra[
-                agent.utils.consts.AGENT_METER_ID_FIELD
-            ] = self._credentials.id
-            self._app.extra[
-                agent.utils.consts.AGENT_ENERGA_SESSION_FIELD
-            ] = self._energa_session
-            self._app.extra[
-                agent.utils.consts.AGENT_CONFIG_FIELD
-            ] = self._config
-            self.logger.info('Successfully logged into Energa service')
-
-    def get_meter_id(self) -> int:
+            for meter_id in self._session_pool.meters
+        ))
+
+    async def _poll_new_measurements(self, meter_id: int, cursor: int) -> list[typing.Any] | None:
+        agent.utils.ratelimit.REQUEST_PRIORITY.set(agent.utils.ratelimit.Priority.BACKGROUND)
+        return await agent.routers.energa.collect_measurements_since(self._app, meter_id, cursor)
+
+    async def login(self, account_name: str) -> None:
+        """
+            Logs into the given Energa account and discovers the meters registered in it.
+        """
+        store: agent.utils.storage.MeasurementStore = self._app.extra[agent.utils.consts.AGENT_STORE_FIELD]
+        worker_locks: agent.utils.interprocess.WorkerLocks = self._app.extra[agent.utils.consts.AGENT_WORKER_LOCKS_FIELD]
+        energa_session = self._session_pool.sessions[account_name].client
+        async with worker_locks.hold(('login', account_name)):
+            shared_session = await fastapi.concurrency.run_in_threadpool(store.load_session, account_name)
+            if shared_session is not None and shared_session.saved_at > self._session_versions.get(
+                account_name,
+                time.time() - agent.utils.consts.SHARED_SESSION_MAX_AGE
+            ):
+                # Another worker has logged in since this one did (or the session of a recent run is still fresh), so it is reused
+                self.logger.info(f'Reusing the shared Energa session ({account_name} account)')
+                energa_session.import_cookies(shared_session.cookies)
+                meter_ids = shared_session.meter_ids
+                self._session_versions[account_name] = shared_session.saved_at
+            else:
+                self.logger.info(f'Logging into Energa service ({account_name} account)')
+                await self._retry_policy.acall(
+                    functools.partial(self._submit_login_form, account_name),
+                    retryable=(ValueError,)
+                )
+                meter_ids = await self.get_meter_ids(account_name)
+                self._session_versions[account_name] = await fastapi.concurrency.run_in_threadpool(
+                    store.save_session, account_name, energa_session.export_cookies(), meter_ids
+                )
+        self._accounts[account_name].id = meter_ids[0]
+        self._session_pool.assign_meters(account_name, meter_ids)
+        self._app.extra[
+            agent.utils.consts.AGENT_METER_ID_FIELD
+        ] = self._session_pool.default_meter_id
+        self.logger.info(f'Successfully logged into Energa service ({account_name} account, meters: {meter_ids})')
+
+    async def _submit_login_form(self, account_name: str) -> None:
+        energa_session = self._session_pool.sessions[account_name].client
+        current_page_content = (await energa_session.get(
+            agent.utils.consts.PPE_LOGIN_PATH
+        )).text
+        fetched_csrf_token_matches = re.search(
+            r'name="_antixsrf" value="(.+?)"',
+            current_page_content
+        )
+        if fetched_csrf_token_matches is None:
+            raise ValueError('Could not fetch CSRF token')
+        fetched_csrf_token = fetched_csrf_token_matches[1]
+        response = await energa_session.post(
+            url=agent.utils.consts.PPE_LOGIN_PATH,
+            data={
+                '_antixsrf': fetched_csrf_token,
+            } | self._accounts[account_name].get_form_data()
+        )
+        response.raise_for_status()
+
+    async def get_meter_ids(self, account_name: str) -> list[int]:
         '''
-        UIses a regex to fetch the meter ID from the basic_data_script (scraped page source), which is located under the following part of fetched HTML content:
+        Uses a regex to fetch the meter IDs from the basic_data_script (scraped page source), in which every meter is registered under the following part of fetched HTML content:
         <script type="text/javascript">
             meters.list.push({
                 id: 12345678,
@@ -116,31 +351,58 @@ class PPEAgentService:
                 name: '****',
             })
         </script>
-        The regex should return the ID of the meter, which is 12345678 in this case
+        The regex should return the IDs of all of the meters, which is [12345678] in this case
         '''
-        with agent.utils.retry.retry_procedure(
-            max_retries=self._config.max_retries
-        ):
-            basic_data_script_fetch_response = self._energa_session.get(
-                agent.utils.consts.PPE_DATA_SCRIPT_BASE_URL
+        energa_session = self._session_pool.sessions[account_name].client
+
+        async def fetch_meter_ids() -> list[int]:
+            basic_data_script_fetch_response = await energa_session.get(
+                agent.utils.consts.PPE_DATA_SCRIPT_PATH
             )
             basic_data_script_fetch_response.raise_for_status()
-            basic_data_script_matches = re.search(
+            basic_data_script_matches = re.findall(
                 r'meters\.list\.push\({\s+id: (\d+),',
                 basic_data_script_fetch_response.text
             )
-            if basic_data_script_matches is None:
+            if not basic_data_script_matches:
                 raise ValueError('Could not fetch meter ID')
-            return int(basic_data_script_matches[1])
+            return [int(meter_id) for meter_id in dict.fromkeys(basic_data_script_matches)]
 
-    def logout(self, *args, **kwargs) -> None:  # pylint: disable=unused-argument
+        return await self._retry_policy.acall(
+            fetch_meter_ids,
+            retryable=(ValueError,)
+        )
+
+    async def logout(self, *args, **kwargs) -> None:  # pylint: disable=unused-argument
+        """
+            Logs out of the Energa accounts, if this is the leader worker - the others only close their connections,
+            so they do not end the session shared with the workers that are still running.
+        """
+        worker_locks: agent.utils.interprocess.WorkerLocks = self._app.extra[agent.utils.consts.AGENT_WORKER_LOCKS_FIELD]
+        logged_in_accounts = [
+            account_name for account_name in self._session_pool.sessions if self._accounts[account_name].id is not None
+        ]
+        if not worker_locks.is_leader or not logged_in_accounts:
+            await asyncio.gather(*(
+                session.client.close() for session in self._session_pool.sessions.values()
+            ))
+            return
         self.logger.info('Logging out from Energa service')
-        # To ensure that the logout procedure is executed when Ctrl+C is being pressed continuously, we need to ignore KeyboardInterrupt
-        with agent.utils.retry.retry_procedure(
-            max_retries=self._config.max_retries,
-            ignored=[KeyboardInterrupt]  # type: ignore
-        ):
-            self._energa_session.get(agent.utils.consts.PPE_LOGOUT_URL)
+        store: agent.utils.storage.MeasurementStore = self._app.extra[agent.utils.consts.AGENT_STORE_FIELD]
+        for account_name in logged_in_accounts:
+            await fastapi.concurrency.run_in_threadpool(store.discard_session, account_name)
+        await asyncio.gather(*(
+            self._logout_session(session.client) if account_name in logged_in_accounts else session.client.close()
+            for account_name, session in self._session_pool.sessions.items()
+        ))
+
+    async def _logout_session(self, energa_session: agent.utils.client.EnergaClient) -> None:
+        try:
+            await self._retry_policy.acall(
+                lambda: energa_session.get(agent.utils.consts.PPE_LOGOUT_PATH)
+            )
             self.logger.info('Successfully logged out from Energa service')
-            self._energa_session.close()
-            sys.exit(0)
+        except agent.utils.retry.UpstreamUnavailableError as logout_error:
+            self.logger.warning(f'Could not log out from Energa service: {logout_error}')
+        finally:
+            await energa_session.close()
@@ -0,0 +1,190 @@
+"""
+    This module provides the local aggregation engine, which derives the coarse (week, month and year) windows from the finer data
+    already fetched from Energa, instead of asking Energa for every period separately.
+
+    Every fetched window is rolled up into buckets of the resolution of the coarser charts: daily buckets (the datapoints of the WEEK
+    and MONTH charts) and monthly buckets (the datapoints of the YEAR chart). The buckets are bounded the same way the MojLicznik app
+    bounds them - in local time, with weeks starting on Monday - and updated incrementally, as only the buckets touched by a fetched
+    window (and the months containing them) are recomputed.
+"""
+import dataclasses
+import time
+import typing
+
+import agent.utils.consts
+import agent.utils.periods
+import agent.utils.storage
+
+ROLLUP_RESOLUTIONS = {  # window period -> resolution of the buckets its datapoints are rolled up into
+    'DAY': 'DAY',
+    'WEEK': 'DAY',
+    'MONTH': 'DAY',
+    'YEAR': 'MONTH',
+}
+AGGREGATED_PERIODS = ('WEEK', 'MONTH', 'YEAR')
+ZONES_COUNT = 3
+
+
+class RollupBucket(typing.NamedTuple):
+    tm: int  # bucket start, in epoch milliseconds
+    zones: tuple[float | None, ...]
+    est: bool
+    cplt: bool
+    final: bool  # is the bucket closed i.e. its data will not change anymore?
+    fetched_at: float
+
+    def to_datapoint(self) -> dict[str, typing.Any]:
+        """
+            Represents the bucket the way Energa represents the datapoints of its charts.
+        """
+        return {'tm': str(self.tm), 'tarAvg': None, 'zones': list(self.zones), 'est': self.est, 'cplt': self.cplt}
+
+
+class AggregatedWindow(typing.NamedTuple):
+    data: list[dict[str, typing.Any]]
+    fetched_at: float
+    missing: list[int]  # start epochs of the buckets that are neither final nor fresh
+    modified_at: float  # the latest time any of the buckets may have changed i.e. when the newest one was fetched
+
+
+def rollup(
+    datapoints: list[typing.Any],
+    resolution: str,
+    fetched_at: float,
+    now: float | None = None
+) -> list[RollupBucket]:
+    """
+        Sums the zones of the datapoints falling into the same bucket. A zone is None only if it is missing from all the datapoints.
+    """
+    grouped_datapoints: dict[int, list[typing.Any]] = {}
+    for datapoint in datapoints:
+        if 'tm' not in datapoint or 'zones' not in datapoint:
+            continue
+        bucket_start, _ = agent.utils.periods.window_bounds(int(datapoint['tm']), resolution)
+        grouped_datapoints.setdefault(bucket_start, []).append(datapoint)
+    return [
+        _sum_buckets(bucket_start, [
+            RollupBucket(
+                bucket_start,
+                tuple([*datapoint['zones'], None, None, None][:ZONES_COUNT]),
+                bool(datapoint.get('est')),
+                bool(datapoint.get('cplt', True)),
+                agent.utils.periods.is_window_closed(bucket_start, resolution, now),
+                fetched_at
+            )
+            for datapoint in bucket_datapoints
+        ])
+        for bucket_start, bucket_datapoints in sorted(grouped_datapoints.items())
+    ]
+
+
+def _sum_buckets(bucket_start: int, buckets: list[RollupBucket]) -> RollupBucket:
+    zones = tuple(
+        None if all(zone is None for zone in zone_values) else sum(zone or 0.0 for zone in zone_values)
+        for zone_values in zip(*(bucket.zones for bucket in buckets))
+    )
+    return RollupBucket(
+        bucket_start,
+        zones,
+        any(bucket.est for bucket in buckets),
+        all(bucket.cplt for bucket in buckets),
+        all(bucket.final for bucket in buckets),
+        _oldest_fetch(buckets)
+    )
+
+
+def _oldest_fetch(buckets: list[RollupBucket]) -> float:
+    """
+        Returns the time the buckets were fetched at, as far as their freshness is concerned - final buckets never change,
+        so an open bucket (or window) is as fresh as the oldest of its open parts, no matter how long ago its closed parts were fetched.
+    """
+    open_buckets = [bucket for bucket in buckets if not bucket.final]
+    return min(bucket.fetched_at for bucket in open_buckets or buckets)
+
+
+@dataclasses.dataclass
+class AggregationEngine:
+    """
+        Keeps the daily and monthly rollups of the fetched windows in the store, and assembles the coarse windows out of them.
+    """
+    store: agent.utils.storage.MeasurementStore
+    max_missing_windows: int = dataclasses.field(default=agent.utils.consts.AGGREGATION_MAX_MISSING_WINDOWS)
+    recorded: int = dataclasses.field(default=0)
+    aggregated: int = dataclasses.field(default=0)
+    filled: int = dataclasses.field(default=0)
+    fallbacks: int = dataclasses.field(default=0)
+
+    def record(self, meter_id: int, period: str, datapoints: list[typing.Any], fetched_at: float) -> None:
+        """
+            Rolls up the datapoints of a fetched window and recomputes the monthly buckets of the months it touches.
+
+            Buckets updated after fetched_at are kept, so recording a window fetched earlier (e.g. loaded from the store) never makes them staler.
+        """
+        resolution = ROLLUP_RESOLUTIONS[period]
+        buckets = rollup(datapoints, resolution, fetched_at)
+        if not buckets:
+            return
+        self.store.save_rollups(meter_id, resolution, [_bucket_to_row(bucket) for bucket in buckets], keep_newer=True)
+        if resolution == 'DAY':
+            for month_start in sorted({agent.utils.periods.window_bounds(bucket.tm, 'MONTH')[0] for bucket in buckets}):
+                self._refresh_month(meter_id, month_start)
+        self.recorded += 1
+
+    def _refresh_month(self, meter_id: int, month_start: int) -> None:
+        """
+            Sums the daily buckets of the month into its monthly bucket, once all of its (past) days are known.
+        """
+        month_bounds = agent.utils.periods.window_bounds(month_start, 'MONTH')
+        day_buckets = [
+            _bucket_from_row(row)
+            for row in self.store.load_rollups(meter_id, 'DAY', month_bounds)
+        ]
+        expected_days = agent.utils.periods.split_range(month_bounds[0], min(month_bounds[1], int(time.time() * 1000)), 'DAY')
+        if not expected_days or not set(expected_days) <= {bucket.tm for bucket in day_buckets}:
+            return
+        # The days yet to come (charted by Energa with no zones measured) would make the month as stale as the window they were fetched with
+        day_buckets = [bucket for bucket in day_buckets if bucket.tm <= expected_days[-1]]
+        month_bucket = _sum_buckets(month_start, day_buckets)
+        if not agent.utils.periods.is_window_closed(month_start, 'MONTH'):
+            month_bucket = month_bucket._replace(final=False)
+        self.store.save_rollups(meter_id, 'MONTH', [_bucket_to_row(month_bucket)])
+
+    def load(self, meter_id: int, period: str, epoch: int, fresh_since: float) -> AggregatedWindow:
+        """
+            Assembles the window out of the final buckets and the ones updated after fresh_since, listing the buckets still missing.
+
+            Buckets starting in the future are not expected - an open window contains the datapoints up to now.
+        """
+        resolution = ROLLUP_RESOLUTIONS[period]
+        window_bounds = agent.utils.periods.window_bounds(epoch, period)
+        buckets = {
+            bucket.tm: bucket
+            for bucket in map(_bucket_from_row, self.store.load_rollups(meter_id, resolution, window_bounds, fresh_since))
+        }
+        expected_buckets = agent.utils.periods.split_range(
+            window_bounds[0], min(window_bounds[1], int(time.time() * 1000)), resolution
+        )
+        present_buckets = [buckets[bucket_start] for bucket_start in expected_buckets if bucket_start in buckets]
+        return AggregatedWindow(
+            [bucket.to_datapoint() for bucket in present_buckets],
+            _oldest_fetch(present_buckets) if present_buckets else time.time(),
+            [bucket_start for bucket_start in expected_buckets if bucket_start not in buckets],
+            max((bucket.fetched_at for bucket in present_buckets), default=time.time())
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'recorded': self.recorded,
+            'aggregated': self.aggregated,
+            'filled': self.filled,
+            'fallbacks': self.fallbacks,
+        }
+
+
+def _bucket_to_row(bucket: RollupBucket) -> tuple[typing.Any, ...]:
+    return (bucket.tm, *bucket.zones, bucket.est, bucket.cplt, bucket.final, bucket.fetched_at)
+
+
+def _bucket_from_row(row: tuple[typing.Any, ...]) -> RollupBucket:
+    bucket_start, round_the_clock, daily, nightly, est, cplt, final, fetched_at = row
+    return RollupBucket(bucket_start, (round_the_clock, daily, nightly), bool(est), bool(cplt), bool(final), fetched_at)
@@ -0,0 +1,133 @@
+"""
+    This module provides an in-memory cache of the static assets (HTML pages) served by the agent.
+
+    Assets are read once at startup, along with their precomputed compressed variants and strong ETags, so serving them
+    costs neither disk I/O nor compression. Optionally, the assets directory is watched and the cache is reloaded on changes.
+"""
+import asyncio
+import dataclasses
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import typing
+
+import fastapi
+import fastapi.responses
+
+import agent.utils.consts
+import agent.utils.http_cache
+import agent.utils.negotiation
+
+logger = logging.getLogger('uvicorn')
+
+
+@dataclasses.dataclass(frozen=True)
+class StaticAsset:
+    media_type: str
+    variants: dict[str, tuple[bytes, str]]  # content encoding (identity, gzip or br) -> encoded content and its ETag
+
+
+@dataclasses.dataclass
+class AssetCache:
+    """
+        Serves the files of the assets directory from memory, with conditional GET (If-None-Match) and Accept-Encoding support.
+    """
+    assets_path: str
+    max_age: int = dataclasses.field(default=agent.utils.consts.ASSETS_CACHE_MAX_AGE)
+    served: int = dataclasses.field(default=0)
+    not_modified: int = dataclasses.field(default=0)
+    reloads: int = dataclasses.field(default=0)
+    _assets: dict[str, StaticAsset] = dataclasses.field(init=False, repr=False, default_factory=dict)
+    _watcher: asyncio.Task | None = dataclasses.field(init=False, repr=False, default=None)
+
+    def load(self) -> None:
+        assets: dict[str, StaticAsset] = {}
+        for file_name in sorted(os.listdir(self.assets_path)):
+            file_path = os.path.join(self.assets_path, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            with open(file_path, 'rb') as asset_file:
+                assets[file_name] = _build_asset(file_name, asset_file.read())
+        self._assets = assets
+
+    def start_watching(self) -> None:
+        """
+            Reloads the assets whenever the assets directory changes - requires the optional watchfiles package.
+        """
+        try:
+            import watchfiles  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            logger.warning('Assets reloading requires the watchfiles package to be installed')
+            return
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(watchfiles.awatch(self.assets_path)))
+
+    async def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    async def _watch(self, changes: typing.AsyncIterator[typing.Any]) -> None:
+        async for _ in changes:
+            try:
+                self.load()
+            except OSError as reload_error:
+                logger.warning(f'Failed to reload assets: {reload_error}')
+                continue
+            self.reloads += 1
+            logger.info(f'Reloaded assets from {self.assets_path}')
+
+    def response(self, file_name: str, request: fastapi.Request) -> fastapi.responses.Response:
+        asset = self._assets[file_name]
+        content_encoding = _negotiate_encoding(request.headers.get('accept-encoding'), asset.variants)
+        content, etag = asset.variants[content_encoding]
+        headers = {
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={self.max_age}',
+            'Vary': 'Accept-Encoding',
+        }
+        if agent.utils.http_cache.matches_etag(request.headers.get('if-none-match'), etag):
+            self.not_modified += 1
+            return fastapi.responses.Response(status_code=304, headers=headers)
+        if content_encoding != 'identity':
+            headers['Content-Encoding'] = content_encoding
+        self.served += 1
+        return fastapi.responses.Response(content=content, media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'assets': len(self._assets),
+            'served': self.served,
+            'not_modified': self.not_modified,
+            'reloads': self.reloads,
+        }
+
+
+def _build_asset(file_name: str, content: bytes) -> StaticAsset:
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    variants = {'identity': (content, f'"{digest}"')}
+    compressed_variants = {'gzip': gzip.compress(content, compresslevel=9, mtime=0)}
+    try:
+        import brotli  # type: ignore # pylint: disable=import-outside-toplevel,import-error
+        compressed_variants['br'] = brotli.compress(content)
+    except ImportError:
+        pass
+    for content_encoding, compressed_content in compressed_variants.items():
+        if len(compressed_content) < len(content):
+            variants[content_encoding] = (compressed_content, f'"{digest}-{content_encoding}"')
+    media_type, _ = mimetypes.guess_type(file_name)
+    return StaticAsset(media_type or 'application/octet-stream', variants)
+
+
+def _negotiate_encoding(accept_encoding: str | None, variants: dict[str, typing.Any]) -> str:
+    """
+        Picks the best of the available encodings (brotli, then gzip) accepted by the client, falling back to the uncompressed content.
+    """
+    accepted_encodings = agent.utils.negotiation.parse_accept(accept_encoding)
+    for content_encoding in ('br', 'gzip'):
+        if content_encoding in variants and agent.utils.negotiation.quality_of(accepted_encodings, content_encoding) > 0:
+            return content_encoding
+    return 'identity'
@@ -0,0 +1,112 @@
+"""
+    This module provides the broadcaster, which pushes the newly arrived measurements of a meter to all of its subscribers.
+
+    A single poll loop (running only while anyone is subscribed) looks for datapoints newer than the last one seen for every
+    subscribed meter, and fans them out to the subscribers' queues - so the number of subscribers does not multiply the polling.
+"""
+import asyncio
+import contextlib
+import dataclasses
+import logging
+import time
+import typing
+
+import agent.utils.consts
+import agent.utils.periods
+
+logger = logging.getLogger('uvicorn')
+
+
+@dataclasses.dataclass
+class MeasurementBroadcaster:  # pylint: disable=too-many-instance-attributes
+    """
+        Publishes the datapoints newer than the per-meter cursor to the subscribers of the meter.
+
+        Subscribers, which do not keep up (their queue is full), are disconnected - they are expected to reconnect with their cursor.
+    """
+    poll: typing.Callable[[int, int], typing.Awaitable[list[typing.Any] | None]]  # (meter ID, cursor) -> datapoints newer than cursor
+    interval: float
+    queue_size: int = dataclasses.field(default=agent.utils.consts.STREAM_QUEUE_SIZE)
+    published: int = dataclasses.field(default=0)
+    disconnected: int = dataclasses.field(default=0)
+    _subscribers: dict[int, set[asyncio.Queue]] = dataclasses.field(init=False, repr=False, default_factory=dict)
+    _cursors: dict[int, int] = dataclasses.field(init=False, repr=False, default_factory=dict)
+    _task: asyncio.Task | None = dataclasses.field(init=False, repr=False, default=None)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, meter_id: int) -> typing.AsyncIterator[asyncio.Queue]:
+        """
+            Yields the queue, to which the lists of new datapoints of the meter are put - None marks the end of the subscription.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        if meter_id not in self._cursors:  # Datapoints of the current day are published once, subscribers skip the ones they have seen
+            self._cursors[meter_id] = agent.utils.periods.window_bounds(int(time.time() * 1000), 'DAY')[0] - 1
+        self._subscribers.setdefault(meter_id, set()).add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            yield queue
+        finally:
+            meter_subscribers = self._subscribers.get(meter_id, set())
+            meter_subscribers.discard(queue)
+            if not meter_subscribers:
+                self._subscribers.pop(meter_id, None)
+                self._cursors.pop(meter_id, None)
+            if not self._subscribers:
+                await self.stop()
+
+    def publish(self, meter_id: int, datapoints: list[typing.Any]) -> None:
+        """
+            Fans the datapoints (with at least one zone measured) newer than the cursor of the meter out to its subscribers.
+        """
+        if meter_id not in self._subscribers:
+            return
+        new_datapoints = [
+            datapoint
+            for datapoint in datapoints
+            if 'tm' in datapoint and int(datapoint['tm']) > self._cursors[meter_id]
+            and any(zone is not None for zone in datapoint.get('zones') or [])
+        ]
+        if not new_datapoints:
+            return
+        self._cursors[meter_id] = max(int(datapoint['tm']) for datapoint in new_datapoints)
+        for queue in list(self._subscribers[meter_id]):
+            try:
+                queue.put_nowait(new_datapoints)
+            except asyncio.QueueFull:
+                self._disconnect(meter_id, queue)
+        self.published += len(new_datapoints)
+
+    def _disconnect(self, meter_id: int, queue: asyncio.Queue) -> None:
+        self._subscribers[meter_id].discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+        self.disconnected += 1
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            for meter_id in list(self._subscribers):
+                if meter_id not in self._cursors:  # Unsubscribed while other meters were polled
+                    continue
+                try:
+                    datapoints = await self.poll(meter_id, self._cursors[meter_id])
+                except Exception as poll_error:  # pylint: disable=broad-except
+                    logger.warning(f'Failed to poll measurements of meter {meter_id}: {poll_error}')
+                    continue
+                if datapoints and meter_id in self._cursors:
+                    self.publish(meter_id, datapoints)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'subscribers': sum(len(meter_subscribers) for meter_subscribers in self._subscribers.values()),
+            'published': self.published,
+            'disconnected': self.disconnected,
+        }
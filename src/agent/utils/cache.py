@@ -0,0 +1,55 @@
+"""
+    This module provides an in-memory cache of the recently fetched (warm) windows of measurements.
+"""
+import dataclasses
+import time
+import typing
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedWindow:
+    data: list[typing.Any]
+    fetched_at: float
+    digest: str  # of the data, see agent.utils.http_cache.digest_data
+    modified_at: float  # when the digest last changed
+
+
+@dataclasses.dataclass
+class WarmCache:
+    """
+        Holds the last fetched data of open windows, which are refreshed in the background by the prefetch scheduler.
+
+        Entries older than max_age are not served, so a stalled scheduler degrades to regular upstream fetches instead of stale answers.
+    """
+    max_age: float
+    hits: int = dataclasses.field(default=0)
+    misses: int = dataclasses.field(default=0)
+    _entries: dict[typing.Hashable, CachedWindow] = dataclasses.field(init=False, repr=False, default_factory=dict)
+
+    def get(self, key: typing.Hashable) -> CachedWindow | None:
+        cached_window = self._entries.get(key)
+        if cached_window is None or time.time() - cached_window.fetched_at > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached_window
+
+    def differs(self, key: typing.Hashable, digest: str) -> bool:
+        """
+            Returns whether the data of the given digest differs from the cached data (or no data is cached).
+        """
+        cached_window = self._entries.get(key)
+        return cached_window is None or cached_window.digest != digest
+
+    def put(self, key: typing.Hashable, data: list[typing.Any], fetched_at: float, digest: str, modified_at: float) -> None:  # pylint: disable=too-many-arguments
+        self._entries[key] = CachedWindow(data, fetched_at, digest, modified_at)
+
+    def discard(self, key: typing.Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
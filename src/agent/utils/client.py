@@ -0,0 +1,58 @@
+"""
+    This module provides the asynchronous HTTP client that is used for all of the communication with the Energa MojLicznik app.
+"""
+import dataclasses
+import typing
+
+import httpx
+
+import agent.utils.consts
+
+
+@dataclasses.dataclass
+class EnergaClient:
+    """
+        A thin wrapper around httpx.AsyncClient that keeps the login cookies of the Energa session.
+
+        The connection pool is bounded by max_connections, so concurrent queries are multiplexed over a fixed set of
+        keep-alive connections, and every request is bound by a timeout, so a single slow upstream call cannot stall the rest.
+    """
+    base_url: str = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_ENERGA_BASE_URL)
+    timeout: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_TIMEOUT)
+    max_connections: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_MAX_CONNECTIONS)
+    _client: httpx.AsyncClient = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            follow_redirects=True,
+        )
+
+    @property
+    def cookies(self) -> httpx.Cookies:
+        return self._client.cookies
+
+    def export_cookies(self) -> list[dict[str, str]]:
+        return [
+            {'name': cookie.name, 'value': cookie.value or '', 'domain': cookie.domain, 'path': cookie.path}
+            for cookie in self._client.cookies.jar
+        ]
+
+    def import_cookies(self, cookies: list[dict[str, str]]) -> None:
+        self._client.cookies.clear()
+        for cookie in cookies:
+            self._client.cookies.set(**cookie)
+
+    async def get(self, url: str, **kwargs: typing.Any) -> httpx.Response:
+        return await self._client.get(url, **kwargs)
+
+    async def post(self, url: str, **kwargs: typing.Any) -> httpx.Response:
+        return await self._client.post(url, **kwargs)
+
+    async def close(self) -> None:
+        await self._client.aclose()
@@ -0,0 +1,68 @@
+"""
+    This module provides a single-flight helper, that coalesces identical concurrent calls into a single in-flight operation.
+"""
+import asyncio
+import dataclasses
+import typing
+
+import agent.utils.ratelimit
+
+ResultT = typing.TypeVar('ResultT')
+
+
+@dataclasses.dataclass
+class SingleFlight:
+    """
+        Concurrent calls of run() with the same key share one in-flight task and its result (or exception).
+
+        The shared task is shielded from cancellation, so a caller that goes away (e.g. a disconnected client)
+        does not cancel the operation for the remaining callers. Its upstream requests are sent at the highest priority
+        of its callers - an interactive query joining a background refresh raises the priority of the refresh.
+    """
+    calls: int = dataclasses.field(default=0)
+    coalesced: int = dataclasses.field(default=0)
+    boosted: int = dataclasses.field(default=0)
+    _in_flight: dict[typing.Hashable, tuple[asyncio.Future, agent.utils.ratelimit.SharedPriority]] = dataclasses.field(
+        init=False,
+        repr=False,
+        default_factory=dict
+    )
+
+    async def run(
+        self,
+        key: typing.Hashable,
+        procedure: typing.Callable[[], typing.Awaitable[ResultT]]
+    ) -> ResultT:
+        priority = agent.utils.ratelimit.current_priority()
+        if (in_flight := self._in_flight.get(key)) is not None:
+            in_flight_task, shared_priority = in_flight
+            self.coalesced += 1
+            if shared_priority.raise_to(priority):
+                self.boosted += 1
+            return await asyncio.shield(in_flight_task)
+        self.calls += 1
+        shared_priority = agent.utils.ratelimit.SharedPriority(priority)
+
+        async def run_at_shared_priority() -> ResultT:
+            agent.utils.ratelimit.SHARED_PRIORITY.set(shared_priority)  # The task runs in a copy of the context, so this does not leak out
+            return await procedure()
+
+        in_flight_task = asyncio.ensure_future(run_at_shared_priority())
+        self._in_flight[key] = (in_flight_task, shared_priority)
+        in_flight_task.add_done_callback(
+            lambda finished_task: self._forget(key, finished_task)
+        )
+        return await asyncio.shield(in_flight_task)
+
+    def _forget(self, key: typing.Hashable, finished_task: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        if not finished_task.cancelled():
+            finished_task.exception()  # Marks the exception as retrieved, even if every caller has gone away
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'boosted': self.boosted,
+            'in_flight': len(self._in_flight),
+        }
@@ -0,0 +1,65 @@
+"""
+    This module provides the compression of response bodies, negotiated from the Accept-Encoding header of the request.
+
+    Gzip is always available, while Brotli and Zstandard require the brotli and zstandard packages (pinned in requirements.txt) to be installed.
+    Bodies smaller than the configured threshold are sent as they are, since compressing them saves less than it costs.
+"""
+import functools
+import gzip
+import importlib
+import typing
+
+import agent.utils.consts
+import agent.utils.negotiation
+
+CONTENT_CODINGS = ('zstd', 'br', 'gzip')  # in order of preference, if the client accepts several of them equally
+
+
+def negotiate_coding(accept_encoding: str | None) -> str | None:
+    """
+        Picks the content coding (out of the available ones) with the highest quality in the Accept-Encoding header.
+
+        Returns None, if the body should be sent as it is (identity coding).
+    """
+    if not accept_encoding:
+        return None
+    qualities = agent.utils.negotiation.parse_accept(accept_encoding)
+    quality, _, coding = max(
+        (agent.utils.negotiation.quality_of(qualities, coding), -preference, coding)
+        for preference, coding in enumerate(available_codings())
+    )
+    return coding if quality > 0 else None
+
+
+def compress(body: bytes, coding: str | None, min_size: int) -> tuple[bytes, str | None]:
+    """
+        Compresses the body with the negotiated coding, if it is at least min_size bytes long.
+
+        Returns the (possibly compressed) body and the coding actually applied to it.
+    """
+    if coding is None or len(body) < min_size:
+        return body, None
+    level = agent.utils.consts.COMPRESSION_LEVELS[coding]
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=level, mtime=0), coding
+    if coding == 'br':
+        return _import_codec('brotli').compress(body, quality=level), coding
+    return _import_codec('zstandard').ZstdCompressor(level=level).compress(body), coding
+
+
+@functools.cache
+def available_codings() -> tuple[str, ...]:
+    codec_modules = {'zstd': 'zstandard', 'br': 'brotli'}
+    return tuple(
+        coding
+        for coding in CONTENT_CODINGS
+        if coding not in codec_modules or _import_codec(codec_modules[coding]) is not None
+    )
+
+
+@functools.cache
+def _import_codec(module_name: str) -> typing.Any:
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        return None
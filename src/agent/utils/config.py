@@ -33,26 +33,81 @@ class PPECredentials:
 
 
 @dataclasses.dataclass
-class PPEAgentConfig:
+class PPEAgentConfig:  # pylint: disable=too-many-instance-attributes
     logging_format: str = dataclasses.field(default=agent.utils.consts.DEFAULT_GENERAL_LOGGING_FORMAT)
     assets_path: str = dataclasses.field(default=agent.utils.consts.DEFAULT_GENERAL_ASSETS_PATH)
+    assets_reload: bool = dataclasses.field(default=agent.utils.consts.DEFAULT_GENERAL_ASSETS_RELOAD)
     max_retries: int = dataclasses.field(default=agent.utils.consts.DEFAULT_GENERAL_MAX_RETRIES)
     timeout: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_TIMEOUT)
+    max_connections: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_MAX_CONNECTIONS)
+    range_concurrency: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_RANGE_CONCURRENCY)
+    prefetch_interval: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_PREFETCH_INTERVAL)
+    prefetch_jitter: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_PREFETCH_JITTER)
+    keepalive_interval: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_KEEPALIVE_INTERVAL)
     root_path: str = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_ROOT_PATH)
+    energa_base_url: str = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_ENERGA_BASE_URL)
+    storage_path: str = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_STORAGE_PATH)
+    workers: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_WORKERS)
+    upstream_rate_limit: float = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_UPSTREAM_RATE_LIMIT)
+    upstream_burst: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_UPSTREAM_BURST)
+    upstream_queue_size: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_UPSTREAM_QUEUE_SIZE)
+    upstream_queue_timeout: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_UPSTREAM_QUEUE_TIMEOUT)
+    compression_min_size: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_COMPRESSION_MIN_SIZE)
+    recent_readings_days: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_RECENT_READINGS_DAYS)
+    logging_queue: bool = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_LOGGING_QUEUE)
+    logging_json: bool = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_LOGGING_JSON)
+    access_log_sample_rate: float = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_ACCESS_LOG_SAMPLE_RATE)
+    access_log_rate_limit: float = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_ACCESS_LOG_RATE_LIMIT)
     log_level: str = dataclasses.field(default='info')
+    accounts: dict[str, dict[str, str]] = dataclasses.field(default_factory=dict)
 
-    def __post_init__(self) -> None:
+    def __post_init__(self) -> None:  # pylint: disable=too-many-branches
         if config_path := os.environ.get('PPE_AGENT_CONFIG'):
             self.load_config(config_path)
         self.logging_format = self.logging_format.strip()
         self.assets_path = self.assets_path.strip()
+        self.storage_path = self.storage_path.strip()
         if not self.root_path.startswith('/'):
             raise ValueError('Root path must start with a forward slash')
         self.root_path = self.root_path.strip().removesuffix('/')
+        self.energa_base_url = self.energa_base_url.strip().removesuffix('/')
+        if not self.energa_base_url.startswith(('http://', 'https://')):
+            raise ValueError('Energa base URL must be an HTTP(S) URL')
         if self.max_retries < 0:
             raise ValueError('Max retries must be a non-negative integer')
         if self.timeout < 0:
             raise ValueError('Timeout must be a non-negative integer')
+        if self.max_connections < 1:
+            raise ValueError('Max connections must be a positive integer')
+        if self.range_concurrency < 1:
+            raise ValueError('Range concurrency must be a positive integer')
+        if self.prefetch_interval < 0 or self.prefetch_jitter < 0:
+            raise ValueError('Prefetch interval and jitter must be non-negative integers')
+        if self.keepalive_interval < 0:
+            raise ValueError('Keepalive interval must be a non-negative integer')
+        if self.workers < 1:
+            raise ValueError('Number of workers must be a positive integer')
+        if self.upstream_rate_limit < 0:
+            raise ValueError('Upstream rate limit must be a non-negative number')
+        if self.upstream_burst < 1 or self.upstream_queue_size < 1 or self.upstream_queue_timeout < 1:
+            raise ValueError('Upstream burst, queue size and queue timeout must be positive integers')
+        if self.compression_min_size < 0:
+            raise ValueError('Compression min size must be a non-negative integer')
+        if self.recent_readings_days < 0:
+            raise ValueError('Recent readings days must be a non-negative integer')
+        if not 0 <= self.access_log_sample_rate <= 1:
+            raise ValueError('Access log sample rate must be a number between 0 and 1')
+        if self.access_log_rate_limit < 0:
+            raise ValueError('Access log rate limit must be a non-negative number')
+
+    def apply_overrides(self, overrides: dict[str, typing.Any]) -> None:
+        """
+            Overrides the loaded options with the given values, e.g. with the settings of a one-off (CLI) run.
+        """
+        for option_name, option_value in overrides.items():
+            if option_name not in {field.name for field in dataclasses.fields(self)}:
+                raise ValueError(f'Unknown configuration option: {option_name}')
+            setattr(self, option_name, option_value)
 
     def load_config(self, config_path: str) -> None:
         if not os.path.exists(config_path):
@@ -63,7 +118,34 @@ class PPEAgentConfig:
             raise ValueError('Config file must contain an [AGENT] section')
         self.logging_format = config['AGENT'].get('logging_format', self.logging_format)
         self.assets_path = config['AGENT'].get('assets_path', self.assets_path)
+        self.assets_reload = config['AGENT'].getboolean('assets_reload', self.assets_reload)
         self.max_retries = config['AGENT'].getint('max_retries', self.max_retries)
         self.timeout = config['AGENT'].getint('timeout', self.timeout)
+        self.max_connections = config['AGENT'].getint('max_connections', self.max_connections)
+        self.range_concurrency = config['AGENT'].getint('range_concurrency', self.range_concurrency)
+        self.prefetch_interval = config['AGENT'].getint('prefetch_interval', self.prefetch_interval)
+        self.prefetch_jitter = config['AGENT'].getint('prefetch_jitter', self.prefetch_jitter)
+        self.keepalive_interval = config['AGENT'].getint('keepalive_interval', self.keepalive_interval)
         self.root_path = config['AGENT'].get('root_path', self.root_path)
+        self.energa_base_url = config['AGENT'].get('energa_base_url', self.energa_base_url)
+        self.storage_path = config['AGENT'].get('storage_path', self.storage_path)
+        self.workers = config['AGENT'].getint('workers', self.workers)
+        self.upstream_rate_limit = config['AGENT'].getfloat('upstream_rate_limit', self.upstream_rate_limit)
+        self.upstream_burst = config['AGENT'].getint('upstream_burst', self.upstream_burst)
+        self.upstream_queue_size = config['AGENT'].getint('upstream_queue_size', self.upstream_queue_size)
+        self.upstream_queue_timeout = config['AGENT'].getint('upstream_queue_timeout', self.upstream_queue_timeout)
+        self.compression_min_size = config['AGENT'].getint('compression_min_size', self.compression_min_size)
+        self.recent_readings_days = config['AGENT'].getint('recent_readings_days', self.recent_readings_days)
+        self.logging_queue = config['AGENT'].getboolean('logging_queue', self.logging_queue)
+        self.logging_json = config['AGENT'].getboolean('logging_json', self.logging_json)
+        self.access_log_sample_rate = config['AGENT'].getfloat('access_log_sample_rate', self.access_log_sample_rate)
+        self.access_log_rate_limit = config['AGENT'].getfloat('access_log_rate_limit', self.access_log_rate_limit)
         self.log_level = os.getenv('PPE_AGENT_LOG_LEVEL', self.log_level).upper()
+        self.accounts = {
+            section.removeprefix(agent.utils.consts.ACCOUNT_SECTION_PREFIX).strip(): {
+                'email': config[section]['email'],
+                'password': config[section].get('password') or os.getenv(config[section].get('password_env', ''), ''),
+            }
+            for section in config.sections()
+            if section.startswith(agent.utils.consts.ACCOUNT_SECTION_PREFIX)
+        }
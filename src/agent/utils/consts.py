@@ -5,19 +5,99 @@ import os
 DEFAULT_GENERAL_LOGGING_LEVEL = 'INFO'
 DEFAULT_GENERAL_LOGGING_FORMAT = '{asctime} [{processName}] {levelname}: {message}'
 DEFAULT_GENERAL_ASSETS_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'assets')
+DEFAULT_GENERAL_ASSETS_RELOAD = False
 DEFAULT_GENERAL_MAX_RETRIES = 3
 DEFAULT_AGENT_TIMEOUT = 10
+DEFAULT_AGENT_MAX_CONNECTIONS = 10
 DEFAULT_AGENT_ROOT_PATH = '/'
+DEFAULT_AGENT_ENERGA_BASE_URL = 'https://mojlicznik.energa-operator.pl'
+DEFAULT_AGENT_RANGE_CONCURRENCY = 4
+DEFAULT_AGENT_PREFETCH_INTERVAL = 300
+DEFAULT_AGENT_PREFETCH_JITTER = 30
+DEFAULT_AGENT_KEEPALIVE_INTERVAL = 0
+DEFAULT_AGENT_WORKERS = 1
+DEFAULT_AGENT_UPSTREAM_RATE_LIMIT = 5.0
+DEFAULT_AGENT_UPSTREAM_BURST = 10
+DEFAULT_AGENT_UPSTREAM_QUEUE_SIZE = 100
+DEFAULT_AGENT_UPSTREAM_QUEUE_TIMEOUT = 10
+DEFAULT_AGENT_COMPRESSION_MIN_SIZE = 1024
+DEFAULT_AGENT_RECENT_READINGS_DAYS = 31
+DEFAULT_AGENT_LOGGING_QUEUE = True
+DEFAULT_AGENT_LOGGING_JSON = False
+DEFAULT_AGENT_ACCESS_LOG_SAMPLE_RATE = 1.0
+DEFAULT_AGENT_ACCESS_LOG_RATE_LIMIT = 0.0
+DEFAULT_AGENT_STORAGE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'measurements.sqlite3')
 
 # Implementation details - non-configurable
 
+ACCOUNT_SECTION_PREFIX = 'ACCOUNT:'
+DEFAULT_ACCOUNT_NAME = 'default'
+
 AGENT_CONFIG_FIELD = 'config'
 AGENT_METER_ID_FIELD = 'meterId'
 AGENT_ENERGA_SESSION_FIELD = 'session'
 AGENT_ASSETS_PATH_FIELD = 'assetsPath'
+AGENT_ASSETS_FIELD = 'assets'
+AGENT_STORE_FIELD = 'store'
+AGENT_SINGLE_FLIGHT_FIELD = 'singleFlight'
+AGENT_STATS_FIELD = 'stats'
+AGENT_WARM_CACHE_FIELD = 'warmCache'
+AGENT_RETRY_POLICY_FIELD = 'retryPolicy'
+AGENT_WORKER_LOCKS_FIELD = 'workerLocks'
+AGENT_AGGREGATION_FIELD = 'aggregation'
+AGENT_BROADCASTER_FIELD = 'broadcaster'
+AGENT_RATE_LIMITER_FIELD = 'rateLimiter'
+AGENT_STARTUP_FIELD = 'startup'
+AGENT_RECENT_READINGS_FIELD = 'recentReadings'
+
+AGENT_FETCHED_AT_HEADER = 'X-Fetched-At'
+
+HTTP_CLOSED_WINDOW_MAX_AGE = 365 * 24 * 60 * 60  # seconds, for which responses with data of closed windows may be cached
+HTTP_OPEN_WINDOW_MAX_AGE = 60  # seconds, for which responses with data of open (still refreshed) windows may be cached
+
+COMPRESSION_LEVELS = {'gzip': 1, 'br': 4, 'zstd': 3}  # favouring the compression speed, as the responses are compressed per request
+
+AGGREGATION_MAX_MISSING_WINDOWS = 2  # finer windows fetched to complete a coarse one, before the coarse window is fetched as a whole
+
+ASSETS_CACHE_MAX_AGE = 300  # seconds, for which clients may reuse the static assets without revalidating them
+
+LOGGING_QUEUE_SIZE = 10000  # records waiting for the writer thread, the ones over it are dropped
+LOGGING_STOP_TIMEOUT = 5.0  # seconds, for which the queued records are written out on shutdown
+
+READINGS_ZONES = 3  # round the clock, daily and nightly
+READINGS_MAX_PER_DAY = 25  # hourly readings, including the extra hour of the day when the clocks go back
 
-PPE_LOGIN_URL = 'https://mojlicznik.energa-operator.pl/dp/UserLogin.do'
-PPE_LOGOUT_URL = 'https://mojlicznik.energa-operator.pl/dp/UserLogout.do'
+FORMATS_CHUNK_SIZE = 4096  # number of measurements encoded per streamed chunk
+
+RETRY_BASE_DELAY = 0.5  # seconds, doubled with every consecutive retry
+RETRY_MAX_DELAY = 10.0  # seconds
+RETRY_BUDGET_DEPOSIT_RATIO = 0.2  # retries allowed per successful call
+RETRY_BUDGET_MAX_TOKENS = 10.0
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5  # consecutive failures
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30.0  # seconds
+
+SINCE_MAX_SPAN = 31 * 24 * 60 * 60  # seconds, how far back the cursor of delta queries (and streams) may reach
+STREAM_POLL_INTERVAL = 60  # seconds between polls for new measurements of the streamed meters, if prefetching is disabled
+STREAM_HEARTBEAT_INTERVAL = 15  # seconds of silence, after which a keepalive comment is sent to the stream subscribers
+STREAM_QUEUE_SIZE = 16  # batches of new measurements queued for a subscriber, before it is disconnected as too slow
+STREAM_RECONNECT_DELAY = 1.0  # seconds, after which a subscriber disconnected as too slow should reconnect
+
+STARTUP_QUERY_WAIT = 5.0  # seconds, for which queries received before the agent has logged into Energa wait for the login
+STARTUP_LOGIN_RETRY_DELAY = 5.0  # seconds before the first retry of a failed background login, doubled with every next one
+STARTUP_LOGIN_MAX_RETRY_DELAY = 60.0  # seconds
+
+BACKFILL_LOGIN_TIMEOUT = 60.0  # seconds, for which the backfill command waits for the login, unless it fails sooner
+BACKFILL_RATE_SHARE = 0.5  # share of the upstream rate limit, at which the backfill command sends its requests by default
+
+STORAGE_CLOSED_WINDOW_GRACE_PERIOD = 24 * 60 * 60  # seconds after the end of a window, during which late measurements may still arrive
+
+WORKER_LOCK_SLOTS = 4096  # number of keyed locks shared by the worker processes (keys are hashed onto them)
+WORKER_LEADERSHIP_RETRY_INTERVAL = 30.0  # seconds between the attempts of the other workers to take over the leadership
+SHARED_SESSION_MAX_AGE = 15 * 60  # seconds, for which a session saved by another worker (or a previous run) is reused at startup
+SESSION_EXPIRED_RETRY_AFTER = 5.0  # seconds, after which a query may be retried, once Energa has rejected the renewed session as well
+
+PPE_LOGIN_PATH = '/dp/UserLogin.do'  # paths are relative to the configured energa_base_url
+PPE_LOGOUT_PATH = '/dp/UserLogout.do'
 
 PPE_LOGIN_FORM_USERNAME_ID = 'j_username'
 PPE_LOGIN_FORM_PASSWORD_ID = 'j_password'
@@ -27,5 +107,11 @@ PPE_LOGIN_FORM_ADDITIONAL_DATA = {
     'loginNow': 'zaloguj się',
     'clientOS': 'web'
 }
-PPE_DATA_SCRIPT_BASE_URL = 'https://mojlicznik.energa-operator.pl/dp/UserData.do'
-PPE_DATA_CHARTS_BASE_URL = 'https://mojlicznik.energa-operator.pl/dp/resources/chart'
+PPE_DATA_SCRIPT_PATH = '/dp/UserData.do'
+PPE_DATA_CHARTS_PATH = '/dp/resources/chart'
+PPE_DATA_PERIODS = ('DAY', 'WEEK', 'MONTH', 'YEAR')
+PPE_DATA_RESOLUTION_PERIODS = {  # chart period, which returns datapoints of a given resolution
+    'HOUR': 'DAY',
+    'DAY': 'MONTH',
+    'MONTH': 'YEAR',
+}
@@ -0,0 +1,151 @@
+"""
+    This module provides the alternative (columnar and binary) encodings of measurement series and the content negotiation between them.
+
+    Every encoder takes the series as named columns (timestamp, round_the_clock, daily, nightly) and yields the encoded body in chunks,
+    so large series can be streamed to the client without building a Python object for every measurement.
+"""
+import csv
+import functools
+import io
+import json
+import typing
+
+import agent.utils.consts
+import agent.utils.negotiation
+
+Columns = dict[str, list[typing.Any]]
+
+FORMAT_MEDIA_TYPES = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.ppeagent.columnar+json',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class UnsupportedFormatError(ValueError):
+    pass
+
+
+def negotiate_format(requested_format: str | None, accept_header: str | None) -> str:
+    """
+        Picks the output format from the format= query parameter (which takes precedence) or from the Accept header.
+
+        Raises UnsupportedFormatError only for an unsupported format= parameter - the Accept header is a preference, so the default
+        (row-oriented) JSON format is returned, if none of the accepted media types is supported (e.g. text/html sent by a browser).
+    """
+    if requested_format:
+        if requested_format.lower() not in FORMAT_MEDIA_TYPES:
+            raise UnsupportedFormatError(f'Unsupported format: {requested_format}')
+        return requested_format.lower()
+    media_types_by_format = {media_type: name for name, media_type in FORMAT_MEDIA_TYPES.items()}
+    for media_type in agent.utils.negotiation.accepted_by_preference(accept_header):
+        if media_type in ('*/*', 'application/*'):
+            return 'json'
+        if media_type in media_types_by_format:
+            try:
+                ensure_format_available(media_types_by_format[media_type])
+            except UnsupportedFormatError:
+                continue
+            return media_types_by_format[media_type]
+    return 'json'
+
+
+def encode_json(content: typing.Any) -> bytes:
+    """
+        Encodes the content into compact JSON - with orjson, if it is installed, and with the standard library otherwise.
+
+        Named tuples (i.e. measurements) are encoded as arrays by both encoders, so the decoded output does not depend on the one used.
+    """
+    orjson = _import_orjson()
+    if orjson is None:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+    # Tuple subclasses are not encoded by orjson natively, so they are handed back to it as plain tuples
+    return orjson.dumps(content, default=tuple)  # pylint: disable=no-member
+
+
+def encode_columnar_json(columns: Columns) -> typing.Iterator[bytes]:
+    yield b'{"status": "success", "data": {'
+    for index, (name, values) in enumerate(columns.items()):
+        yield f'{", " if index else ""}{json.dumps(name)}: {json.dumps(values)}'.encode()
+    yield b'}}'
+
+
+def encode_csv(columns: Columns, chunk_size: int = agent.utils.consts.FORMATS_CHUNK_SIZE) -> typing.Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns.keys())
+    rows = zip(*columns.values())
+    while True:
+        chunk = [row for _, row in zip(range(chunk_size), rows)]
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        if len(chunk) < chunk_size:
+            return
+
+
+def encode_arrow(columns: Columns, chunk_size: int = agent.utils.consts.FORMATS_CHUNK_SIZE) -> typing.Iterator[bytes]:
+    pyarrow = _import_pyarrow()
+    table = pyarrow.table(columns)
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        for record_batch in table.to_batches(max_chunksize=chunk_size):
+            writer.write_batch(record_batch)
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+def encode_parquet(columns: Columns, chunk_size: int = agent.utils.consts.FORMATS_CHUNK_SIZE) -> typing.Iterator[bytes]:
+    pyarrow = _import_pyarrow()
+    table = pyarrow.table(columns)
+    sink = io.BytesIO()
+    with pyarrow.parquet.ParquetWriter(sink, table.schema) as writer:
+        for record_batch in table.to_batches(max_chunksize=chunk_size):
+            writer.write_batch(record_batch)
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+ENCODERS: dict[str, typing.Callable[[Columns], typing.Iterator[bytes]]] = {
+    'columnar': encode_columnar_json,
+    'csv': encode_csv,
+    'arrow': encode_arrow,
+    'parquet': encode_parquet,
+}
+
+
+def ensure_format_available(output_format: str) -> None:
+    """
+        Arrow and Parquet encodings require the optional pyarrow package - raises UnsupportedFormatError, if it is not installed.
+    """
+    if output_format in ('arrow', 'parquet'):
+        _import_pyarrow()
+
+
+def _import_pyarrow() -> typing.Any:
+    try:
+        import pyarrow  # type: ignore # pylint: disable=import-outside-toplevel,import-error
+        import pyarrow.ipc  # type: ignore # pylint: disable=import-outside-toplevel,import-error
+        import pyarrow.parquet  # type: ignore # pylint: disable=import-outside-toplevel,import-error
+    except ImportError as missing_dependency:
+        raise UnsupportedFormatError('Arrow and Parquet formats require the pyarrow package to be installed') from missing_dependency
+    return pyarrow
+
+
+@functools.cache
+def _import_orjson() -> typing.Any:
+    try:
+        import orjson  # type: ignore # pylint: disable=import-outside-toplevel,import-error
+    except ImportError:
+        return None
+    return orjson
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    drained_bytes = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return drained_bytes
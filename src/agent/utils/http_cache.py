@@ -0,0 +1,61 @@
+"""
+    This module provides the helpers for HTTP caching of the responses - validators (ETag, Last-Modified) and conditional requests.
+"""
+import email.utils
+import hashlib
+import json
+import typing
+
+import agent.utils.consts
+
+
+def digest_data(data: typing.Any) -> str:
+    """
+        Returns the digest of the content of the (JSON-serializable) data, independent of the order of keys.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def build_etag(*parts: typing.Any) -> str:
+    """
+        Returns a strong ETag identifying the representation built out of the given parts (e.g. the data digest and the query options).
+    """
+    return f'"{hashlib.sha256(chr(31).join(map(str, parts)).encode()).hexdigest()[:32]}"'
+
+
+def format_http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def cache_control(closed: bool) -> str:
+    """
+        Data of closed windows never changes, so it may be cached for good - open windows are refreshed, so they are cached briefly.
+    """
+    if closed:
+        return f'public, max-age={agent.utils.consts.HTTP_CLOSED_WINDOW_MAX_AGE}, immutable'
+    return f'public, max-age={agent.utils.consts.HTTP_OPEN_WINDOW_MAX_AGE}'
+
+
+def matches_etag(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag in (candidate.strip().removeprefix('W/') for candidate in if_none_match.split(','))
+
+
+def is_not_modified(headers: typing.Mapping[str, str], etag: str, last_modified: float) -> bool:
+    """
+        Evaluates the conditional request headers - If-Modified-Since is only considered in the absence of If-None-Match (RFC 9110).
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return matches_etag(if_none_match, etag)
+    if_modified_since = headers.get('if-modified-since')
+    if not if_modified_since:
+        return False
+    try:
+        modified_since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(last_modified) <= modified_since
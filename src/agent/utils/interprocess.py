@@ -0,0 +1,81 @@
+"""
+    This module provides the file locks, that coordinate the worker processes of the agent (see the workers setting).
+"""
+import asyncio
+import contextlib
+import dataclasses
+import fcntl
+import os
+import typing
+import zlib
+
+import fastapi.concurrency
+
+import agent.utils.consts
+
+
+@dataclasses.dataclass
+class WorkerLocks:
+    """
+        POSIX record locks (fcntl.lockf) on the bytes of a single lock file, which is kept next to the measurement store.
+
+        The first byte is the leader lock - it is held for the whole lifetime of the worker that runs the background jobs
+        (prefetching and keepalive). The remaining bytes are short-lived locks, onto which keys are hashed, so the workers
+        perform identical operations (e.g. logging into an account or fetching a window) one at a time.
+
+        Record locks are owned by processes, so they only exclude other workers - concurrent calls within a single worker
+        have to be coalesced separately (e.g. with a SingleFlight). With a single worker there is no one to exclude,
+        so the keyed locks are disabled (shared=False) and cost nothing.
+    """
+    path: str
+    shared: bool = dataclasses.field(default=True)  # are there other workers sharing the store?
+    slots: int = dataclasses.field(default=agent.utils.consts.WORKER_LOCK_SLOTS)
+    is_leader: bool = dataclasses.field(default=False)
+    _file: typing.BinaryIO = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'ab')  # pylint: disable=consider-using-with
+
+    def acquire_leadership(self) -> bool:
+        """
+            Returns whether this worker became the leader, without waiting for the current leader (if any) to exit.
+        """
+        try:
+            fcntl.lockf(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 0)
+        except OSError:
+            return False
+        self.is_leader = True
+        return True
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: typing.Hashable) -> typing.AsyncIterator[None]:
+        if not self.shared:
+            yield
+            return
+        offset = 1 + zlib.crc32(repr(key).encode()) % self.slots
+        acquisition = asyncio.ensure_future(fastapi.concurrency.run_in_threadpool(
+            fcntl.lockf, self._file, fcntl.LOCK_EX, 1, offset
+        ))
+        try:
+            await asyncio.shield(acquisition)
+        except asyncio.CancelledError:
+            # The blocked thread cannot be interrupted, so the lock is released as soon as it is eventually acquired
+            acquisition.add_done_callback(lambda _: self._release(offset))
+            raise
+        try:
+            yield
+        finally:
+            self._release(offset)
+
+    def _release(self, offset: int) -> None:
+        fcntl.lockf(self._file, fcntl.LOCK_UN, 1, offset)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'pid': os.getpid(),
+            'leader': int(self.is_leader),
+        }
@@ -1,19 +1,151 @@
+"""
+    This module configures the loggers of Uvicorn (and of the agent, which logs through the uvicorn logger).
+
+    In the queued mode, handlers only put the records into a bounded queue, while formatting and writing them is left to a listener thread -
+    so logging costs the request path a queue insertion, and a slow stdout never blocks it (records over the queue size are dropped instead).
+"""
+import dataclasses
+import json
 import logging
 import logging.config
+import queue
+import random
+import threading
+import time
 import typing
 
 import agent.utils.consts
 
 
-def initialize_loggers(
+@dataclasses.dataclass
+class LoggingStats:
+    dropped: int = dataclasses.field(default=0)  # records discarded, because the queue was full
+    sampled_out: int = dataclasses.field(default=0)  # access records discarded by the sampling or the rate limit
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+        }
+
+
+LOGGING_STATS = LoggingStats()
+
+
+class QueuedStreamHandler(logging.StreamHandler):
+    """
+        Hands the records over to a bounded queue, from which a writer thread formats them and writes them to the stream.
+
+        The writer never holds the lock of the handler, so neither logging nor reconfiguring the loggers waits for a stalled stream.
+    """
+    def __init__(self, stream: typing.TextIO | None = None, queue_size: int = agent.utils.consts.LOGGING_QUEUE_SIZE) -> None:
+        super().__init__(stream)
+        self.queue: queue.Queue[logging.LogRecord | None] = queue.Queue(maxsize=queue_size)
+        self.writer = threading.Thread(target=self._write_queued_records, name='log-writer', daemon=True)
+        self.writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGGING_STATS.dropped += 1
+
+    def flush(self) -> None:
+        pass  # The stream is flushed by the writer thread, after every record
+
+    def close(self) -> None:
+        """
+            Waits (for a limited time) for the queued records to be written - giving up on them, if the stream is stalled.
+
+            Called on shutdown and whenever the loggers are reconfigured (e.g. by Uvicorn).
+        """
+        if self.writer.is_alive():
+            try:
+                self.queue.put(None, timeout=agent.utils.consts.LOGGING_STOP_TIMEOUT)
+                self.writer.join(agent.utils.consts.LOGGING_STOP_TIMEOUT)
+            except queue.Full:
+                pass
+        super().close()
+
+    def _write_queued_records(self) -> None:
+        while (record := self.queue.get()) is not None:
+            try:
+                self.stream.write(self.format(record) + self.terminator)
+                self.stream.flush()
+            except Exception:  # pylint: disable=broad-except
+                self.handleError(record)
+
+
+class AccessLogSampler(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+        Keeps sample_rate of the access records of successful requests (and all of the failed ones), at most rate_limit records per second.
+    """
+    def __init__(
+        self,
+        sample_rate: float = agent.utils.consts.DEFAULT_AGENT_ACCESS_LOG_SAMPLE_RATE,
+        rate_limit: float = agent.utils.consts.DEFAULT_AGENT_ACCESS_LOG_RATE_LIMIT
+    ) -> None:
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit  # records per second, 0 disables the limit
+        self._tokens = rate_limit
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate < 1 and not _is_failed_request(record) and random.random() >= self.sample_rate:
+            LOGGING_STATS.sampled_out += 1
+            return False
+        if self.rate_limit > 0:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._updated_at) * self.rate_limit)
+                self._updated_at = now
+                if self._tokens < 1:
+                    LOGGING_STATS.sampled_out += 1
+                    return False
+                self._tokens -= 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+        Formats the records as single-line JSON objects - access records carry the client, method, path and status code as separate fields.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, typing.Any] = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'message': record.getMessage(),
+        }
+        if record.name == 'uvicorn.access' and isinstance(record.args, tuple) and len(record.args) == 5:
+            entry |= dict(zip(('client', 'method', 'path', 'http_version', 'status_code'), record.args))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _is_failed_request(record: logging.LogRecord) -> bool:
+    return isinstance(record.args, tuple) and len(record.args) == 5 and int(record.args[4]) >= 400  # type: ignore
+
+
+def initialize_loggers(  # pylint: disable=too-many-arguments
     level: str = agent.utils.consts.DEFAULT_GENERAL_LOGGING_LEVEL,
-    formatting: str = agent.utils.consts.DEFAULT_GENERAL_LOGGING_FORMAT
+    formatting: str = agent.utils.consts.DEFAULT_GENERAL_LOGGING_FORMAT,
+    queued: bool = agent.utils.consts.DEFAULT_AGENT_LOGGING_QUEUE,
+    json_format: bool = agent.utils.consts.DEFAULT_AGENT_LOGGING_JSON,
+    access_sample_rate: float = agent.utils.consts.DEFAULT_AGENT_ACCESS_LOG_SAMPLE_RATE,
+    access_rate_limit: float = agent.utils.consts.DEFAULT_AGENT_ACCESS_LOG_RATE_LIMIT
 ) -> dict[str, typing.Any]:
     logging_level = logging._nameToLevel[level.upper()]  # pylint: disable=protected-access
     current_config: dict[str, typing.Any] = {
         'version': 1,
         'formatters': {
             name: {
+                '()': 'agent.utils.logger.JsonFormatter',
+            } if json_format else {
                 '()': f'uvicorn.logging.{name.title()}Formatter',
                 'format': formatting,
                 'style': '{',
@@ -21,8 +153,18 @@ def initialize_loggers(
             }
             for name in ['default', 'access']
         },
+        'filters': {
+            'access_sampler': {
+                '()': 'agent.utils.logger.AccessLogSampler',
+                'sample_rate': access_sample_rate,
+                'rate_limit': access_rate_limit,
+            },
+        },
         'handlers': {
             name: {
+                '()': 'agent.utils.logger.QueuedStreamHandler',
+                'formatter': name,
+            } if queued else {
                 'class': 'logging.StreamHandler',
                 'formatter': name,
             }
@@ -41,6 +183,7 @@ def initialize_loggers(
             },
             'uvicorn.access': {
                 'handlers': ['access'],
+                'filters': ['access_sampler'],
                 'level': logging_level,
                 'propagate': False
             },
@@ -0,0 +1,220 @@
+"""
+    This module provides lightweight Prometheus metrics (counters, gauges and histograms) and their text exposition format.
+
+    Recording a value is a dictionary lookup and a few additions (plus a bisection for histograms), so the instrumentation
+    is cheap enough to stay enabled in production. The metrics are process-wide, as are the hot paths they instrument.
+"""
+import bisect
+import contextlib
+import dataclasses
+import time
+import typing
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = tuple[str, ...]
+
+
+@dataclasses.dataclass
+class Metric:
+    name: str
+    documentation: str
+    label_names: tuple[str, ...] = dataclasses.field(default=())
+
+    metric_type: typing.ClassVar[str] = 'untyped'
+
+    def __post_init__(self) -> None:
+        REGISTRY.metrics.append(self)
+
+    def _label_values(self, labels: dict[str, typing.Any]) -> LabelValues:
+        return tuple(str(labels.get(label_name, '')) for label_name in self.label_names)
+
+    def _format_labels(self, label_values: LabelValues, **extra_labels: str) -> str:
+        labels = [*zip(self.label_names, label_values), *extra_labels.items()]
+        if not labels:
+            return ''
+        escaped_labels = (
+            f'{label_name}="{str(label_value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+            for label_name, label_value in labels
+        )
+        return '{' + ','.join(escaped_labels) + '}'
+
+    def render(self) -> list[str]:
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}',
+            *self._render_samples(),
+        ]
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+@dataclasses.dataclass
+class Counter(Metric):
+    metric_type: typing.ClassVar[str] = 'counter'
+    _values: dict[LabelValues, float] = dataclasses.field(init=False, repr=False, default_factory=dict)
+
+    def inc(self, amount: float = 1.0, **labels: typing.Any) -> None:
+        label_values = self._label_values(labels)
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, **labels: typing.Any) -> float:
+        return self._values.get(self._label_values(labels), 0.0)
+
+    def _render_samples(self) -> list[str]:
+        return [
+            f'{self.name}{self._format_labels(label_values)} {value}'
+            for label_values, value in self._values.items()
+        ]
+
+
+@dataclasses.dataclass
+class Gauge(Counter):
+    metric_type: typing.ClassVar[str] = 'gauge'
+
+    def dec(self, amount: float = 1.0, **labels: typing.Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: typing.Any) -> None:
+        self._values[self._label_values(labels)] = value
+
+    @contextlib.contextmanager
+    def track_in_progress(self, **labels: typing.Any) -> typing.Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+@dataclasses.dataclass
+class Histogram(Metric):
+    buckets: tuple[float, ...] = dataclasses.field(default=DEFAULT_BUCKETS)
+    metric_type: typing.ClassVar[str] = 'histogram'
+    _counts: dict[LabelValues, list[int]] = dataclasses.field(init=False, repr=False, default_factory=dict)
+    _sums: dict[LabelValues, float] = dataclasses.field(init=False, repr=False, default_factory=dict)
+
+    def observe(self, value: float, **labels: typing.Any) -> None:
+        label_values = self._label_values(labels)
+        if label_values not in self._counts:
+            self._counts[label_values] = [0] * (len(self.buckets) + 1)
+            self._sums[label_values] = 0.0
+        self._counts[label_values][bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[label_values] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: typing.Any) -> typing.Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def time_iterator(self, iterator: typing.Iterable[typing.Any], **labels: typing.Any) -> typing.Iterator[typing.Any]:
+        """
+            Wraps a (lazily evaluated) iterator, observing the total time spent on producing all of its items.
+        """
+        elapsed = 0.0
+        iterator = iter(iterator)
+        try:
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started_at
+                yield item
+        finally:
+            self.observe(elapsed, **labels)
+
+    def _render_samples(self) -> list[str]:
+        samples: list[str] = []
+        for label_values, counts in self._counts.items():
+            cumulative_count = 0
+            for upper_bound, count in zip([*self.buckets, float('inf')], counts):
+                cumulative_count += count
+                bucket_bound = '+Inf' if upper_bound == float('inf') else str(upper_bound)
+                samples.append(f'{self.name}_bucket{self._format_labels(label_values, le=bucket_bound)} {cumulative_count}')
+            samples.append(f'{self.name}_sum{self._format_labels(label_values)} {self._sums[label_values]}')
+            samples.append(f'{self.name}_count{self._format_labels(label_values)} {cumulative_count}')
+        return samples
+
+
+@dataclasses.dataclass
+class MetricsRegistry:
+    metrics: list[Metric] = dataclasses.field(default_factory=list)
+
+    def render(self, stats: dict[str, typing.Callable[[], dict[str, typing.Any]]] | None = None) -> str:
+        """
+            Renders all of the registered metrics, followed by gauges built from the counters reported by the /stats collectors.
+        """
+        lines = [line for metric in self.metrics for line in metric.render()]
+        for component_name, collect_stats in (stats or {}).items():
+            lines.extend(_render_stats(f'ppeagent_{component_name}', collect_stats()))
+        return '\n'.join(lines) + '\n'
+
+
+def _render_stats(prefix: str, component_stats: dict[str, typing.Any], labels: str = '') -> list[str]:
+    lines: list[str] = []
+    for stat_name, stat_value in component_stats.items():
+        if isinstance(stat_value, dict):  # Stats of a single component, reported separately for each of its instances (e.g. accounts)
+            lines.extend(_render_stats(prefix, stat_value, f'{{account="{stat_name}"}}'))
+        elif isinstance(stat_value, bool | int | float):
+            lines.append(f'{prefix}_{stat_name}{labels} {float(stat_value)}')
+        else:
+            state_labels = labels[:-1] + f',state="{stat_value}"}}' if labels else f'{{state="{stat_value}"}}'
+            lines.append(f'{prefix}_{stat_name}{state_labels} 1.0')
+    return lines
+
+
+REGISTRY = MetricsRegistry()
+
+UPSTREAM_FETCH_SECONDS = Histogram(
+    'ppeagent_upstream_fetch_seconds',
+    'Time spent on fetching a chart from Energa (including retries)',
+    ('period', 'meter'),
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'ppeagent_upstream_in_flight_requests',
+    'Number of chart requests to Energa currently in flight',
+    ('period', 'meter'),
+)
+JSON_DECODE_SECONDS = Histogram(
+    'ppeagent_json_decode_seconds',
+    'Time spent on decoding the JSON payloads of charts fetched from Energa',
+    ('period', 'meter'),
+)
+EXTRACTION_SECONDS = Histogram(
+    'ppeagent_extraction_seconds',
+    'Time spent on converting Energa datapoints into measurements',
+    ('period', 'meter'),
+)
+SERIALIZATION_SECONDS = Histogram(
+    'ppeagent_serialization_seconds',
+    'Time spent on encoding the measurements into the response body',
+    ('period', 'meter', 'format'),
+)
+CACHE_REQUESTS = Counter(
+    'ppeagent_cache_requests_total',
+    'Lookups of measurement windows in the local caches, by cache and result (hit or miss)',
+    ('cache', 'result'),
+)
+CACHE_HIT_RATIO = Gauge(
+    'ppeagent_cache_hit_ratio',
+    'Ratio of lookups of measurement windows answered by the local caches',
+    ('cache',),
+)
+ERRORS = Counter(
+    'ppeagent_errors_total',
+    'Errors encountered while serving measurements, by type',
+    ('type',),
+)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+    hits = CACHE_REQUESTS.value(cache=cache, result='hit')
+    CACHE_HIT_RATIO.set(hits / (hits + CACHE_REQUESTS.value(cache=cache, result='miss')), cache=cache)
@@ -0,0 +1,41 @@
+"""
+    This module provides the parsing of the content negotiation headers (Accept, Accept-Encoding), shared by the formats, compression and assets.
+"""
+
+
+def parse_accept(header: str | None) -> dict[str, float]:
+    """
+        Returns the quality of every value (lowercased) listed in the header, in the order of the header.
+
+        A value without the q parameter has the quality of 1, while a malformed one makes the value unacceptable (quality of 0).
+    """
+    qualities: dict[str, float] = {}
+    for accepted_entry in (header or '').split(','):
+        value, *parameters = [part.strip() for part in accepted_entry.split(';')]
+        if not value:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, parameter_value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(parameter_value.strip())
+                except ValueError:
+                    quality = 0.0
+        qualities[value.lower()] = quality
+    return qualities
+
+
+def accepted_by_preference(header: str | None) -> list[str]:
+    """
+        Returns the acceptable values (quality above 0) listed in the header, from the highest quality - in the order of the header, if equal.
+    """
+    qualities = parse_accept(header)
+    return sorted((value for value, quality in qualities.items() if quality > 0), key=lambda value: -qualities[value])
+
+
+def quality_of(qualities: dict[str, float], value: str) -> float:
+    """
+        Returns the quality of the value parsed from the header, falling back to the quality of the * wildcard.
+    """
+    return qualities.get(value, qualities.get('*', 0.0))
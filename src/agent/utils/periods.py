@@ -0,0 +1,58 @@
+"""
+    This module provides helpers for reasoning about the aggregation periods (windows) used by the Energa MojLicznik app.
+"""
+import datetime
+import time
+
+import agent.utils.consts
+
+
+def validate_period(period: str) -> str:
+    period = period.upper()
+    if period not in agent.utils.consts.PPE_DATA_PERIODS:
+        raise ValueError(f'Unsupported period: {period}')
+    return period
+
+
+def window_bounds(epoch: int, period: str) -> tuple[int, int]:
+    """
+        Returns the [start, end) bounds (in epoch milliseconds) of the window of the given period type that contains the given timestamp.
+
+        Weeks start on Monday, as they do in the MojLicznik app. Bounds are computed in local time, so DST changes are respected.
+    """
+    day_start = datetime.datetime.fromtimestamp(epoch / 1000).replace(hour=0, minute=0, second=0, microsecond=0)
+    match validate_period(period):
+        case 'DAY':
+            window_start = day_start
+            window_end = window_start + datetime.timedelta(days=1)
+        case 'WEEK':
+            window_start = day_start - datetime.timedelta(days=day_start.weekday())
+            window_end = window_start + datetime.timedelta(days=7)
+        case 'MONTH':
+            window_start = day_start.replace(day=1)
+            window_end = (window_start + datetime.timedelta(days=32)).replace(day=1)
+        case _:
+            window_start = day_start.replace(month=1, day=1)
+            window_end = window_start.replace(year=window_start.year + 1)
+    return int(window_start.timestamp() * 1000), int(window_end.timestamp() * 1000)
+
+
+def is_window_closed(epoch: int, period: str, now: float | None = None) -> bool:
+    """
+        A window is considered closed (and its data immutable) once it has ended and the grace period for late measurements has passed.
+    """
+    _, window_end = window_bounds(epoch, period)
+    now = time.time() if now is None else now
+    return window_end + agent.utils.consts.STORAGE_CLOSED_WINDOW_GRACE_PERIOD * 1000 <= now * 1000
+
+
+def split_range(start_epoch: int, end_epoch: int, period: str) -> list[int]:
+    """
+        Returns the start epochs of consecutive windows of the given period type, which together cover the [start, end) range.
+    """
+    window_epochs: list[int] = []
+    window_start, window_end = window_bounds(start_epoch, period)
+    while window_start < end_epoch:
+        window_epochs.append(window_start)
+        window_start, window_end = window_bounds(window_end, period)
+    return window_epochs
@@ -0,0 +1,200 @@
+"""
+    This module provides the outbound rate limiter, which bounds the rate of requests sent to Energa and admits the waiting ones by priority.
+"""
+import asyncio
+import contextvars
+import dataclasses
+import enum
+import heapq
+import itertools
+import time
+
+import agent.utils.consts
+import agent.utils.retry
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0  # queries of the API clients
+    BACKGROUND = 1  # prefetching and polling of the current windows
+    BACKFILL = 2  # bulk fetching of past windows
+
+
+# Priority of the upstream requests sent on behalf of the current task (inherited by the tasks it spawns)
+REQUEST_PRIORITY: contextvars.ContextVar[Priority] = contextvars.ContextVar('request_priority', default=Priority.INTERACTIVE)
+# Priority shared by the callers of the operation run by the current task (e.g. a coalesced fetch), which overrides the one above
+SHARED_PRIORITY: contextvars.ContextVar['SharedPriority | None'] = contextvars.ContextVar('shared_priority', default=None)
+
+
+def current_priority() -> Priority:
+    shared_priority = SHARED_PRIORITY.get()
+    return REQUEST_PRIORITY.get() if shared_priority is None else shared_priority.priority
+
+
+class AdmissionRejectedError(agent.utils.retry.UpstreamUnavailableError):
+    def __init__(self, message: str, retry_after: float, status_code: int) -> None:
+        super().__init__(message, retry_after)
+        self.status_code = status_code
+
+
+@dataclasses.dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    admitted: asyncio.Future = dataclasses.field(compare=False)
+
+
+@dataclasses.dataclass
+class SharedPriority:
+    """
+        The priority of an operation run on behalf of several callers - the highest one of theirs, so a caller joining the operation
+        is never held up by the lower priority of the caller that has started it. Raising it reorders the requests of the operation,
+        which are already waiting for their turn.
+    """
+    priority: Priority
+    _waiting: list[tuple['OutboundRateLimiter', _Waiter]] = dataclasses.field(init=False, repr=False, default_factory=list)
+
+    def raise_to(self, priority: Priority) -> bool:
+        """
+            Returns whether the priority has been raised i.e. the given one is higher than the current one.
+        """
+        if priority >= self.priority:
+            return False
+        self.priority = priority
+        for rate_limiter, waiter in self._waiting:
+            rate_limiter.reprioritize(waiter, priority)
+        return True
+
+    def track(self, rate_limiter: 'OutboundRateLimiter', waiter: _Waiter) -> None:
+        self._waiting.append((rate_limiter, waiter))
+
+    def untrack(self, waiter: _Waiter) -> None:
+        self._waiting = [(rate_limiter, tracked_waiter) for rate_limiter, tracked_waiter in self._waiting if tracked_waiter is not waiter]
+
+
+@dataclasses.dataclass
+class OutboundRateLimiter:  # pylint: disable=too-many-instance-attributes
+    """
+        A token bucket (refilled at rate tokens per second, holding at most burst tokens), in front of which requests wait
+        in a priority queue - interactive requests are admitted before background and backfill ones.
+
+        The load is shed instead of queued without bound: a request is rejected (429), if the queue is full of requests
+        of the same or higher priority (lower priority ones are preempted), and once it has waited for max_queue_time seconds (503).
+    """
+    rate: float  # requests per second, 0 disables the limiter
+    burst: int
+    max_queue_depth: int = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_UPSTREAM_QUEUE_SIZE)
+    max_queue_time: float = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_UPSTREAM_QUEUE_TIMEOUT)
+    admitted: int = dataclasses.field(default=0)
+    shed: int = dataclasses.field(default=0)  # queued requests preempted by the ones of a higher priority
+    rejected: int = dataclasses.field(default=0)  # requests turned away by the queue full of the ones of the same or higher priority
+    expired: int = dataclasses.field(default=0)
+    _tokens: float = dataclasses.field(init=False, repr=False)
+    _updated_at: float = dataclasses.field(init=False, repr=False, default_factory=time.monotonic)
+    _waiters: list[_Waiter] = dataclasses.field(init=False, repr=False, default_factory=list)
+    _sequence: itertools.count = dataclasses.field(init=False, repr=False, default_factory=itertools.count)
+    _dispatcher: asyncio.Task | None = dataclasses.field(init=False, repr=False, default=None)
+
+    def __post_init__(self) -> None:
+        self._tokens = float(self.burst)
+
+    async def acquire(self, priority: Priority | None = None) -> None:
+        """
+            Waits for the turn of a request of the given priority (by default, the one of the current task) to be sent upstream.
+        """
+        if self.rate <= 0:
+            return
+        shared_priority = SHARED_PRIORITY.get() if priority is None else None
+        priority = current_priority() if priority is None else priority
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue_depth:
+            self._preempt(priority)
+        waiter = _Waiter(priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        if shared_priority is not None:
+            shared_priority.track(self, waiter)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await asyncio.wait_for(waiter.admitted, self.max_queue_time)
+        except asyncio.TimeoutError:
+            self.expired += 1
+            raise AdmissionRejectedError(
+                'Energa requests are queued for too long, try again later',
+                retry_after=self._drain_time(),
+                status_code=503
+            ) from None
+        finally:
+            if shared_priority is not None:
+                shared_priority.untrack(waiter)
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+
+    def reprioritize(self, waiter: _Waiter, priority: Priority) -> None:
+        if waiter in self._waiters:
+            waiter.priority = priority
+            heapq.heapify(self._waiters)
+
+    def _preempt(self, priority: Priority) -> None:
+        """
+            Makes room in the full queue by rejecting its newest request of the lowest priority, if that is lower than the given one.
+
+            Requests, which have already timed out or been cancelled (but have not left the queue yet), are dropped first.
+        """
+        self._waiters = [waiter for waiter in self._waiters if not waiter.admitted.done()]
+        heapq.heapify(self._waiters)
+        if len(self._waiters) < self.max_queue_depth:
+            return
+        preempted_waiter = max(self._waiters)
+        if preempted_waiter.priority <= priority:
+            self.rejected += 1
+            raise AdmissionRejectedError('Too many Energa requests queued, try again later', self._drain_time(), status_code=429)
+        self.shed += 1
+        self._waiters.remove(preempted_waiter)
+        heapq.heapify(self._waiters)
+        preempted_waiter.admitted.set_exception(AdmissionRejectedError(
+            'Too many Energa requests queued, preempted by requests of a higher priority',
+            self._drain_time(),
+            status_code=429
+        ))
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            waiter = heapq.heappop(self._waiters)
+            if waiter.admitted.done():  # Timed out or cancelled in the meantime
+                continue
+            self._tokens -= 1
+            self.admitted += 1
+            waiter.admitted.set_result(None)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _drain_time(self) -> float:
+        return (len(self._waiters) + 1) / self.rate
+
+    async def stop(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'queued': len(self._waiters),
+            'tokens': round(self._tokens, 2),
+        }
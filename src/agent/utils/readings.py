@@ -0,0 +1,156 @@
+"""
+    This module provides the compact in-memory window of the recent hourly readings of every meter.
+
+    Readings are kept in typed arrays - epoch milliseconds as int64 and the three zones as float64, i.e. 32 bytes per reading,
+    instead of the hundreds taken by a datapoint dictionary or a measurement named tuple. The arrays are sorted by time,
+    so time ranges are sliced with a binary search, and they are converted into measurements only when a response is built.
+"""
+import array
+import bisect
+import dataclasses
+import time
+import typing
+
+import agent.utils.consts
+import agent.utils.periods
+
+
+class ReadingsSlice(typing.NamedTuple):
+    timestamps: array.array  # epoch milliseconds
+    zones: tuple[array.array, array.array, array.array]  # round the clock, daily, nightly
+
+    @classmethod
+    def from_datapoints(cls, datapoints: list[typing.Any]) -> 'ReadingsSlice':
+        """
+            Converts the datapoints returned by Energa (the ones with at least one zone measured) into readings, sorted by time.
+        """
+        measured_datapoints = sorted(
+            (int(datapoint['tm']), [*datapoint['zones'], None, None, None])
+            for datapoint in datapoints
+            if 'tm' in datapoint and any(zone is not None for zone in datapoint.get('zones') or [])
+        )
+        return cls(
+            array.array('q', [timestamp for timestamp, _ in measured_datapoints]),
+            tuple(  # type: ignore
+                array.array('d', [zones[index] or 0.0 for _, zones in measured_datapoints])
+                for index in range(agent.utils.consts.READINGS_ZONES)
+            )
+        )
+
+
+@dataclasses.dataclass
+class ReadingsRing:
+    """
+        Holds at most capacity readings, sorted by time - the oldest readings are evicted, once newer ones do not fit.
+
+        Evicted readings are only skipped (by moving the start of the ring), and the arrays are compacted once the skipped part
+        outgrows the capacity, so evicting costs O(1) amortized.
+    """
+    capacity: int
+    timestamps: array.array = dataclasses.field(init=False, repr=False, default_factory=lambda: array.array('q'))
+    zones: tuple[array.array, ...] = dataclasses.field(
+        init=False,
+        repr=False,
+        default_factory=lambda: tuple(array.array('d') for _ in range(agent.utils.consts.READINGS_ZONES))
+    )
+    _start: int = dataclasses.field(init=False, repr=False, default=0)
+
+    def __len__(self) -> int:
+        return len(self.timestamps) - self._start
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(column) * column.itemsize for column in (self.timestamps, *self.zones))
+
+    def replace(self, range_start: int, range_end: int, readings: ReadingsSlice) -> None:
+        """
+            Replaces the readings within the [range_start, range_end) range with the given ones (all of them within the range).
+        """
+        replaced_start = bisect.bisect_left(self.timestamps, range_start, self._start)
+        replaced_end = bisect.bisect_left(self.timestamps, range_end, replaced_start)
+        self.timestamps[replaced_start:replaced_end] = readings.timestamps
+        for column, zone_values in zip(self.zones, readings.zones):
+            column[replaced_start:replaced_end] = zone_values
+        if len(self) > self.capacity:
+            self._evict(self._start + len(self) - self.capacity)
+
+    def evict_before(self, timestamp: int) -> None:
+        self._evict(bisect.bisect_left(self.timestamps, timestamp, self._start))
+
+    def slice(self, range_start: int, range_end: int) -> ReadingsSlice:
+        """
+            Returns the readings within the [range_start, range_end) range, found in O(log n).
+        """
+        slice_start = bisect.bisect_left(self.timestamps, range_start, self._start)
+        slice_end = bisect.bisect_left(self.timestamps, range_end, slice_start)
+        return ReadingsSlice(
+            self.timestamps[slice_start:slice_end],
+            tuple(column[slice_start:slice_end] for column in self.zones)  # type: ignore
+        )
+
+    def _evict(self, new_start: int) -> None:
+        self._start = new_start
+        if self._start > self.capacity:
+            for column in (self.timestamps, *self.zones):
+                del column[:self._start]
+            self._start = 0
+
+
+@dataclasses.dataclass
+class RecentReadings:
+    """
+        Keeps the hourly readings of the last days of every meter, recorded from the DAY windows the agent fetches,
+        along with the time every day was fetched - so the readings are served only as long as the day would be served from the store.
+    """
+    days: int  # 0 disables keeping the readings
+    hits: int = dataclasses.field(default=0)
+    misses: int = dataclasses.field(default=0)
+    _rings: dict[int, ReadingsRing] = dataclasses.field(init=False, repr=False, default_factory=dict)
+    _recorded_days: dict[int, dict[int, float]] = dataclasses.field(init=False, repr=False, default_factory=dict)
+
+    def record(self, meter_id: int, day_start: int, datapoints: list[typing.Any], fetched_at: float) -> None:
+        """
+            Replaces the readings of the day with the datapoints (with at least one zone measured) of its DAY window.
+        """
+        if not self.days or day_start < (horizon := self._horizon()):
+            return
+        recorded_days = self._recorded_days.setdefault(meter_id, {})
+        if recorded_days.get(day_start, float('-inf')) >= fetched_at:  # Already recorded, e.g. served from the warm cache again
+            return
+        _, day_end = agent.utils.periods.window_bounds(day_start, 'DAY')
+        ring = self._rings.setdefault(meter_id, ReadingsRing(self.days * agent.utils.consts.READINGS_MAX_PER_DAY))
+        ring.replace(day_start, day_end, ReadingsSlice.from_datapoints([
+            datapoint
+            for datapoint in datapoints
+            if 'tm' in datapoint and day_start <= int(datapoint['tm']) < day_end
+        ]))
+        ring.evict_before(horizon)
+        recorded_days[day_start] = fetched_at
+        for recorded_day in [recorded_day for recorded_day in recorded_days if recorded_day < horizon]:
+            del recorded_days[recorded_day]
+
+    def since(self, meter_id: int, cursor: int, fresh_since: float) -> ReadingsSlice | None:
+        """
+            Returns the readings newer than the cursor, or None, if any of the days between the cursor and now is not recorded
+            (or has been recorded before it was closed, and not since fresh_since) - so it has to be fetched instead.
+        """
+        now = int(time.time() * 1000)
+        recorded_days = self._recorded_days.get(meter_id, {})
+        for day_start in agent.utils.periods.split_range(cursor + 1, now, 'DAY'):
+            fetched_at = recorded_days.get(day_start)
+            if fetched_at is None or not (fetched_at >= fresh_since or agent.utils.periods.is_window_closed(day_start, 'DAY', fetched_at)):
+                self.misses += 1
+                return None
+        self.hits += 1
+        return self._rings.get(meter_id, ReadingsRing(0)).slice(cursor + 1, agent.utils.periods.window_bounds(now, 'DAY')[1])
+
+    def _horizon(self) -> int:
+        return agent.utils.periods.window_bounds(int((time.time() - (self.days - 1) * 24 * 60 * 60) * 1000), 'DAY')[0]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'readings': sum(len(ring) for ring in self._rings.values()),
+            'bytes': sum(ring.nbytes for ring in self._rings.values()),
+        }
@@ -1,41 +1,161 @@
-import contextlib
+"""
+    This module provides the retry engine used for the requests sent to the Energa MojLicznik app.
 
+    Failed calls are retried with an exponential backoff (with full jitter), but only if the error is classified as retryable
+    (connection errors, timeouts, 5xx and 429 responses). All retries in the process draw from a shared retry budget, and consecutive
+    failures trip a circuit breaker, which fails calls fast while Energa is down instead of stacking timeouts.
+"""
+import asyncio
+import dataclasses
+import random
+import time
+import typing
 
-@contextlib.contextmanager
-def retry_procedure(
-    max_retries: int,
-    expected: list[type[Exception]] | None = None,
-    ignored: list[type[Exception]] | None = None,
-):
+import httpx
+
+import agent.utils.consts
+
+ResultT = typing.TypeVar('ResultT')
+
+
+class UpstreamUnavailableError(RuntimeError):
+    status_code: int = 502  # of the response to the query, which could not be answered
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    status_code = 503
+
+
+class RetriesExhaustedError(UpstreamUnavailableError):
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+
+@dataclasses.dataclass
+class RetryBudget:
     """
-    A context manager that allows for retrying a procedure in case of specified exceptions.
+        A token bucket shared by all of the retried calls: every retry withdraws a token and every successful call deposits a fraction of one,
+        so retries can never make up more than (roughly) deposit_ratio of the upstream traffic - except for the initial reserve of tokens.
+    """
+    deposit_ratio: float = dataclasses.field(default=agent.utils.consts.RETRY_BUDGET_DEPOSIT_RATIO)
+    max_tokens: float = dataclasses.field(default=agent.utils.consts.RETRY_BUDGET_MAX_TOKENS)
+    tokens: float = dataclasses.field(init=False)
+
+    def __post_init__(self) -> None:
+        self.tokens = self.max_tokens
 
-    Args:
-        expected (list[type[Exception]] | None): A list of exception types that are expected to be raised during the procedure. Defaults to [Exception].
-        ignored (list[type[Exception]] | None): A list of exception types that are ignored and do not trigger a retry. Defaults to an empty list.
-        max_retries (int): The maximum number of retries. Defaults to the value of DEFAULT_GENERAL_MAX_RETRIES from agent.utils.consts.
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.deposit_ratio)
 
-    Yields:
-        None: The context manager does not return any value.
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
-    Raises:
-        RuntimeError: If the procedure fails after reaching the maximum number of retries.
 
-    Example:
-        with retry_procedure(expected=[ConnectionError, TimeoutError], max_retries=3):
-            # Code block to be retried in case of ConnectionError or TimeoutError
+@dataclasses.dataclass
+class CircuitBreaker:
     """
-    expected = expected or [Exception]  # Retry on ANY Exceptions
-    ignored = ignored or []
-    retry_counter = 0
-    while True:
-        try:
-            yield
-            break
-        except tuple(expected) as failed_request:
-            retry_counter += 1
-            if retry_counter >= max_retries:
-                raise RuntimeError(f'Failed after {retry_counter} retries') from failed_request
-        except tuple(ignored):
-            yield
-            break
+        Opens after failure_threshold consecutive failures and rejects calls for reset_timeout seconds.
+        After that, calls are let through again (half-open state) - the first success closes the circuit, a failure opens it again.
+    """
+    failure_threshold: int = dataclasses.field(default=agent.utils.consts.CIRCUIT_BREAKER_FAILURE_THRESHOLD)
+    reset_timeout: float = dataclasses.field(default=agent.utils.consts.CIRCUIT_BREAKER_RESET_TIMEOUT)
+    consecutive_failures: int = dataclasses.field(default=0)
+    opened_at: float | None = dataclasses.field(default=None)
+    opened: int = dataclasses.field(default=0)
+    rejected: int = dataclasses.field(default=0)
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() < self.opened_at + self.reset_timeout else 'half-open'
+
+    def before_call(self) -> None:
+        if self.state == 'open':
+            self.rejected += 1
+            raise CircuitOpenError(
+                'Energa service is unavailable, not sending requests until it recovers',
+                retry_after=self.opened_at + self.reset_timeout - time.monotonic()  # type: ignore
+            )
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == 'half-open' or self.consecutive_failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.opened += 1
+            self.opened_at = time.monotonic()
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    max_retries: int = dataclasses.field(default=agent.utils.consts.DEFAULT_GENERAL_MAX_RETRIES)
+    base_delay: float = dataclasses.field(default=agent.utils.consts.RETRY_BASE_DELAY)
+    max_delay: float = dataclasses.field(default=agent.utils.consts.RETRY_MAX_DELAY)
+    budget: RetryBudget = dataclasses.field(default_factory=RetryBudget)
+    breaker: CircuitBreaker = dataclasses.field(default_factory=CircuitBreaker)
+    retries: int = dataclasses.field(default=0)
+    budget_exhausted: int = dataclasses.field(default=0)
+
+    async def acall(
+        self,
+        procedure: typing.Callable[[], typing.Awaitable[ResultT]],
+        retryable: tuple[type[Exception], ...] = ()
+    ) -> ResultT:
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await procedure()
+            except Exception as failed_call:  # pylint: disable=broad-except
+                attempt += 1
+                await asyncio.sleep(self._handle_failure(failed_call, attempt, retryable))
+            else:
+                self._handle_success()
+                return result
+
+    def _handle_success(self) -> None:
+        self.breaker.record_success()
+        self.budget.deposit()
+
+    def _handle_failure(self, failed_call: Exception, attempt: int, retryable: tuple[type[Exception], ...]) -> float:
+        """
+            Re-raises the failure, if it should not be retried, or returns the delay before the next attempt otherwise.
+        """
+        if not (is_retryable(failed_call) or isinstance(failed_call, retryable)):
+            raise failed_call
+        self.breaker.record_failure()
+        if attempt > self.max_retries:
+            raise RetriesExhaustedError(f'Failed after {attempt - 1} retries', retry_after=self.max_delay) from failed_call
+        if not self.budget.withdraw():
+            self.budget_exhausted += 1
+            raise RetriesExhaustedError('Retry budget exhausted', retry_after=self.max_delay) from failed_call
+        self.retries += 1
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def stats(self) -> dict[str, int | float | str]:
+        return {
+            'retries': self.retries,
+            'budget_exhausted': self.budget_exhausted,
+            'budget_tokens': self.budget.tokens,
+            'circuit_state': self.breaker.state,
+            'circuit_opened': self.breaker.opened,
+            'circuit_rejected': self.breaker.rejected,
+        }
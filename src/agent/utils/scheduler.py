@@ -0,0 +1,55 @@
+"""
+    This module provides the background scheduler, that keeps the most often queried (current) windows of measurements warm.
+"""
+import asyncio
+import dataclasses
+import logging
+import random
+import typing
+
+import agent.utils.consts
+
+logger = logging.getLogger('uvicorn')
+
+
+@dataclasses.dataclass
+class PrefetchScheduler:
+    """
+        Periodically calls refresh() for each of the given periods, waiting interval seconds (plus a random jitter) between rounds.
+
+        Failures of a single refresh are logged and do not stop the scheduler.
+    """
+    refresh: typing.Callable[[str], typing.Awaitable[typing.Any]]
+    interval: float
+    jitter: float
+    periods: tuple[str, ...] = dataclasses.field(default=agent.utils.consts.PPE_DATA_PERIODS)
+    rounds: int = dataclasses.field(default=0)
+    failures: int = dataclasses.field(default=0)
+    _task: asyncio.Task | None = dataclasses.field(init=False, repr=False, default=None)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            for period in self.periods:
+                try:
+                    await self.refresh(period)
+                except Exception as refresh_error:  # pylint: disable=broad-except
+                    self.failures += 1
+                    logger.warning(f'Failed to prefetch {period} measurements: {refresh_error}')
+            self.rounds += 1
+            await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'rounds': self.rounds,
+            'failures': self.failures,
+        }
@@ -0,0 +1,159 @@
+"""
+    This module provides the lifecycle manager of the authenticated Energa MojLicznik session.
+"""
+import asyncio
+import dataclasses
+import logging
+import time
+import typing
+
+import httpx
+
+import agent.utils.client
+import agent.utils.consts
+import agent.utils.retry
+
+logger = logging.getLogger('uvicorn')
+
+
+def is_session_expired(response: httpx.Response, expect_json: bool = False) -> bool:
+    """
+        An expired session is detected by Energa either rejecting the request or redirecting it to the login page.
+        For endpoints that serve JSON data, an HTML page (i.e. the login form) served instead is treated as an expiry as well.
+    """
+    if response.status_code in (401, 403):
+        return True
+    if response.history and response.url.path.endswith(agent.utils.consts.PPE_LOGIN_PATH):
+        return True
+    return expect_json and response.status_code == 200 and 'text/html' in response.headers.get('content-type', '')
+
+
+class SessionExpiredError(agent.utils.retry.UpstreamUnavailableError):
+    pass
+
+
+@dataclasses.dataclass
+class EnergaSessionManager:  # pylint: disable=too-many-instance-attributes
+    """
+        Wraps the Energa client and transparently renews the session, once an upstream response shows that it has expired.
+
+        Renewal happens behind a lock and is tagged with a generation number, so when many in-flight queries notice the expiry at once,
+        only the first one logs in again - the rest wait for it and then replay their requests with the renewed session.
+        A request is replayed once - if the renewed session is rejected as well, the request fails with SessionExpiredError.
+    """
+    client: agent.utils.client.EnergaClient
+    authenticate: typing.Callable[[], typing.Awaitable[None]]
+    keepalive_interval: float = dataclasses.field(default=0)
+    relogins: int = dataclasses.field(default=0)
+    relogin_failures: int = dataclasses.field(default=0)
+    relogin_seconds_total: float = dataclasses.field(default=0.0)
+    last_relogin_seconds: float = dataclasses.field(default=0.0)
+    keepalive_pings: int = dataclasses.field(default=0)
+    _generation: int = dataclasses.field(init=False, repr=False, default=0)
+    _lock: asyncio.Lock = dataclasses.field(init=False, repr=False, default_factory=asyncio.Lock)
+    _keepalive_task: asyncio.Task | None = dataclasses.field(init=False, repr=False, default=None)
+
+    async def get(self, url: str, expect_json: bool = False, **kwargs: typing.Any) -> httpx.Response:
+        observed_generation = self._generation
+        response = await self.client.get(url, **kwargs)
+        if is_session_expired(response, expect_json):
+            await self.renew(observed_generation)
+            response = await self.client.get(url, **kwargs)
+            if is_session_expired(response, expect_json):
+                raise SessionExpiredError(
+                    'Energa session has expired again right after it was renewed',
+                    retry_after=agent.utils.consts.SESSION_EXPIRED_RETRY_AFTER
+                )
+        return response
+
+    async def renew(self, observed_generation: int) -> None:
+        async with self._lock:
+            if self._generation != observed_generation:
+                return  # The session has already been renewed by another request, while this one was waiting for the lock
+            logger.info('Energa session has expired, logging in again')
+            renewal_start = time.perf_counter()
+            self.client.cookies.clear()
+            try:
+                await self.authenticate()
+            except Exception:
+                self.relogin_failures += 1
+                raise
+            self.last_relogin_seconds = time.perf_counter() - renewal_start
+            self.relogin_seconds_total += self.last_relogin_seconds
+            self.relogins += 1
+            self._generation += 1
+
+    def start_keepalive(self) -> None:
+        if self._keepalive_task is None and self.keepalive_interval > 0:
+            self._keepalive_task = asyncio.create_task(self._keep_alive())
+
+    async def stop_keepalive(self) -> None:
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            await asyncio.gather(self._keepalive_task, return_exceptions=True)
+            self._keepalive_task = None
+
+    async def _keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            try:
+                await self.get(agent.utils.consts.PPE_DATA_SCRIPT_PATH)
+                self.keepalive_pings += 1
+            except Exception as keepalive_error:  # pylint: disable=broad-except
+                logger.warning(f'Energa session keepalive failed: {keepalive_error}')
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'relogins': self.relogins,
+            'relogin_failures': self.relogin_failures,
+            'relogin_seconds_total': self.relogin_seconds_total,
+            'last_relogin_seconds': self.last_relogin_seconds,
+            'keepalive_pings': self.keepalive_pings,
+        }
+
+
+@dataclasses.dataclass
+class EnergaSessionPool:
+    """
+        Keeps a separate authenticated session for every Energa account, and routes the queries for each meter to the session of its account.
+    """
+    sessions: dict[str, EnergaSessionManager] = dataclasses.field(default_factory=dict)
+    meters: dict[int, str] = dataclasses.field(default_factory=dict)
+
+    @property
+    def default_meter_id(self) -> int | None:
+        """
+            The first meter of the first (logged in) account, in the order in which the accounts were configured.
+        """
+        for account_name in self.sessions:
+            for meter_id, meter_account in self.meters.items():
+                if meter_account == account_name:
+                    return meter_id
+        return None
+
+    def assign_meters(self, account_name: str, meter_ids: list[int]) -> None:
+        self.meters = {
+            meter_id: meter_account
+            for meter_id, meter_account in self.meters.items()
+            if meter_account != account_name
+        } | dict.fromkeys(meter_ids, account_name)
+
+    def session_for(self, meter_id: int) -> EnergaSessionManager:
+        if meter_id not in self.meters:
+            raise KeyError(f'Unknown meter: {meter_id}')
+        return self.sessions[self.meters[meter_id]]
+
+    def start_keepalive(self) -> None:
+        for session in self.sessions.values():
+            session.start_keepalive()
+
+    async def stop_keepalive(self) -> None:
+        await asyncio.gather(*(
+            session.stop_keepalive() for session in self.sessions.values()
+        ))
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        return {
+            account_name: session.stats()
+            for account_name, session in self.sessions.items()
+        }
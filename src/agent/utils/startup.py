@@ -0,0 +1,82 @@
+"""
+    This module tracks the startup of the agent - the timing of its phases and whether it is ready to serve measurements.
+
+    The agent starts serving as soon as its local components are set up, while logging into Energa continues in the background,
+    so a slow (or unavailable) Energa service does not keep the server from binding its socket and answering probes.
+    The agent is ready once any of its accounts is logged in - the meters of the other accounts are served once their login succeeds.
+"""
+import asyncio
+import dataclasses
+import time
+
+import agent.utils.consts
+import agent.utils.retry
+
+
+class ServiceNotReadyError(agent.utils.retry.UpstreamUnavailableError):
+    status_code = 503
+
+
+@dataclasses.dataclass
+class StartupState:
+    """
+        Records the time (in seconds since the agent was created) at which every startup phase was completed.
+    """
+    started_at: float = dataclasses.field(default_factory=time.monotonic)
+    phases: dict[str, float] = dataclasses.field(default_factory=dict)
+    login_attempts: int = dataclasses.field(default=0)
+    login_error: str | None = dataclasses.field(default=None)
+    failed_accounts: dict[str, str] = dataclasses.field(default_factory=dict)  # account name -> error of its last login attempt
+    _ready: asyncio.Event = dataclasses.field(init=False, repr=False, default_factory=asyncio.Event)
+    _login_failed: asyncio.Event = dataclasses.field(init=False, repr=False, default_factory=asyncio.Event)
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def mark(self, phase: str) -> float:
+        self.phases[phase] = round(time.monotonic() - self.started_at, 3)
+        return self.phases[phase]
+
+    def set_login_failed(self, login_error: str, account_name: str | None = None) -> None:
+        if account_name is not None:
+            self.failed_accounts[account_name] = login_error
+        if self.is_ready:
+            return
+        self.login_error = login_error
+        self._login_failed.set()  # Wakes up the waiting queries, which fail fast from now on
+        self._login_failed = asyncio.Event()
+
+    def set_logged_in(self, account_name: str) -> None:
+        self.failed_accounts.pop(account_name, None)
+
+    def set_ready(self) -> float:
+        self.login_error = None
+        self._ready.set()
+        return self.mark('ready')
+
+    async def wait_until_ready(self, timeout: float = agent.utils.consts.STARTUP_QUERY_WAIT) -> None:
+        """
+            Waits (briefly) for the login to complete - failing right away, once a login attempt has failed.
+        """
+        if not self.is_ready and self.login_error is None:
+            waiters = {asyncio.ensure_future(self._ready.wait()), asyncio.ensure_future(self._login_failed.wait())}
+            try:
+                await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+        if self.is_ready:
+            return
+        raise ServiceNotReadyError(
+            'Not logged into Energa service yet' + (f' ({self.login_error})' if self.login_error else ''),
+            retry_after=agent.utils.consts.STARTUP_LOGIN_RETRY_DELAY
+        )
+
+    def stats(self) -> dict[str, bool | int | float]:
+        return {
+            'ready': self.is_ready,
+            'login_attempts': self.login_attempts,
+            'failed_accounts': len(self.failed_accounts),
+            **{f'{phase}_seconds': phase_time for phase, phase_time in self.phases.items()},
+        }
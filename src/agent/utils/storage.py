@@ -0,0 +1,282 @@
+"""
+    This module provides a persistent, SQLite-backed store for the measurements fetched from the Energa MojLicznik app.
+
+    Measurements are keyed by meter ID, period type and timestamp. Every fetched window is recorded alongside its rows,
+    so closed windows (which can never change) are answered locally, and only the currently open window is refetched.
+
+    The store is shared by all of the worker processes of the agent, so it also keeps the authenticated Energa sessions,
+    which lets the workers reuse a single login. Session cookies grant access to the account just like its credentials do,
+    so the database file is readable by its owner only.
+"""
+import dataclasses
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+import agent.utils.consts
+import agent.utils.http_cache
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS measurements (
+        meter_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        tm INTEGER NOT NULL,
+        tar_avg REAL,
+        zone_round_the_clock REAL,
+        zone_daily REAL,
+        zone_nightly REAL,
+        est INTEGER,
+        cplt INTEGER,
+        PRIMARY KEY (meter_id, period, tm)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS windows (
+        meter_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        epoch INTEGER NOT NULL,
+        first_tm INTEGER NOT NULL,
+        last_tm INTEGER NOT NULL,
+        closed INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        digest TEXT,
+        modified_at REAL,
+        PRIMARY KEY (meter_id, period, epoch)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS rollups (
+        meter_id INTEGER NOT NULL,
+        resolution TEXT NOT NULL,
+        tm INTEGER NOT NULL,
+        zone_round_the_clock REAL,
+        zone_daily REAL,
+        zone_nightly REAL,
+        est INTEGER,
+        cplt INTEGER,
+        final INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (meter_id, resolution, tm)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS sessions (
+        account TEXT NOT NULL PRIMARY KEY,
+        cookies TEXT NOT NULL,
+        meter_ids TEXT NOT NULL,
+        saved_at REAL NOT NULL
+    );
+'''
+
+
+class SharedSession(typing.NamedTuple):
+    cookies: list[dict[str, str]]
+    meter_ids: list[int]
+    saved_at: float
+
+
+@dataclasses.dataclass
+class MeasurementStore:
+    """
+        A thread-safe wrapper around a single SQLite connection. All methods are blocking, so they should be called
+        from a worker thread (e.g. fastapi.concurrency.run_in_threadpool) when used inside of request handlers.
+    """
+    path: str = dataclasses.field(default=agent.utils.consts.DEFAULT_AGENT_STORAGE_PATH)
+    _connection: sqlite3.Connection = dataclasses.field(init=False, repr=False)
+    _lock: threading.Lock = dataclasses.field(init=False, repr=False, default_factory=threading.Lock)
+
+    def __post_init__(self) -> None:
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))  # Created with the restricted mode, before SQLite does
+            os.chmod(self.path, 0o600)  # Databases created by the previous versions were readable by everyone
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(SCHEMA)
+            window_columns = {column[1] for column in self._connection.execute('PRAGMA table_info(windows)')}
+            for column, column_type in (('digest', 'TEXT'), ('modified_at', 'REAL')):  # Stores created by the previous versions
+                if column not in window_columns:
+                    self._connection.execute(f'ALTER TABLE windows ADD COLUMN {column} {column_type}')
+
+    def load_window(
+        self,
+        meter_id: int,
+        period: str,
+        epoch: int,
+        fresh_since: float | None = None
+    ) -> tuple[list[dict[str, typing.Any]], float, str, float] | None:
+        """
+            Returns the stored rows of a closed window (along with the time they were fetched, the digest of their data
+            and the time the digest last changed) or None, if the window has to be (re)fetched from upstream.
+
+            If fresh_since is given, open windows fetched (or confirmed unchanged) after that time are returned as well.
+        """
+        with self._lock:
+            window = self._connection.execute(
+                '''
+                    SELECT first_tm, last_tm, fetched_at, digest, COALESCE(modified_at, fetched_at)
+                    FROM windows WHERE meter_id = ? AND period = ? AND epoch = ? AND (closed = 1 OR fetched_at >= ?)
+                ''',
+                (meter_id, period, epoch, float('inf') if fresh_since is None else fresh_since)
+            ).fetchone()
+            if window is None:
+                return None
+            first_tm, last_tm, fetched_at, digest, modified_at = window
+            rows = self._connection.execute(
+                '''
+                    SELECT tm, tar_avg, zone_round_the_clock, zone_daily, zone_nightly, est, cplt
+                    FROM measurements WHERE meter_id = ? AND period = ? AND tm BETWEEN ? AND ? ORDER BY tm
+                ''',
+                (meter_id, period, first_tm, last_tm)
+            ).fetchall()
+        data = [
+            {
+                'tm': str(tm),
+                'tarAvg': tar_avg,
+                'zones': [round_the_clock, daily, nightly],
+                'est': bool(est),
+                'cplt': bool(cplt),
+            }
+            for tm, tar_avg, round_the_clock, daily, nightly, est, cplt in rows
+        ]
+        if digest is None:  # Windows stored by the previous versions are digested once
+            digest = agent.utils.http_cache.digest_data(data)
+            with self._lock, self._connection:
+                self._connection.execute(
+                    'UPDATE windows SET digest = ? WHERE meter_id = ? AND period = ? AND epoch = ?',
+                    (digest, meter_id, period, epoch)
+                )
+        return data, fetched_at, digest, modified_at
+
+    def save_window(  # pylint: disable=too-many-arguments
+        self,
+        meter_id: int,
+        period: str,
+        epoch: int,
+        rows: list[dict[str, typing.Any]],
+        closed: bool,
+        fetched_at: float | None = None,
+        digest: str | None = None
+    ) -> float:
+        """
+            Stores the rows of a fetched window, along with the digest of the fetched data (computed from the rows, if not given).
+
+            Returns the time the data last changed - kept from the stored window, if its digest is the same.
+        """
+        digest = digest or agent.utils.http_cache.digest_data(rows)
+        fetched_at = fetched_at or time.time()
+        rows = [row for row in rows if 'tm' in row and 'zones' in row]
+        timestamps = [int(row['tm']) for row in rows]
+        if not timestamps:
+            return fetched_at
+        with self._lock, self._connection:
+            stored_window = self._connection.execute(
+                'SELECT digest, COALESCE(modified_at, fetched_at) FROM windows WHERE meter_id = ? AND period = ? AND epoch = ?',
+                (meter_id, period, epoch)
+            ).fetchone()
+            modified_at = stored_window[1] if stored_window is not None and stored_window[0] == digest else fetched_at
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (meter_id, period, int(row['tm']), row.get('tarAvg'), *_pad_zones(row.get('zones')), int(bool(row.get('est'))), int(bool(row.get('cplt'))))
+                    for row in rows
+                )
+            )
+            self._connection.execute(
+                'INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (meter_id, period, epoch, min(timestamps), max(timestamps), int(closed), fetched_at, digest, modified_at)
+            )
+        return modified_at
+
+    def touch_window(self, meter_id: int, period: str, epoch: int, fetched_at: float) -> float:
+        """
+            Marks the stored rows of a window as fresh, once they were fetched again and turned out to be unchanged.
+
+            Returns the time the data last changed (fetched_at, if the window is not stored).
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE windows SET fetched_at = ? WHERE meter_id = ? AND period = ? AND epoch = ?',
+                (fetched_at, meter_id, period, epoch)
+            )
+            stored_window = self._connection.execute(
+                'SELECT COALESCE(modified_at, fetched_at) FROM windows WHERE meter_id = ? AND period = ? AND epoch = ?',
+                (meter_id, period, epoch)
+            ).fetchone()
+        return fetched_at if stored_window is None else stored_window[0]
+
+    def save_rollups(
+        self,
+        meter_id: int,
+        resolution: str,
+        buckets: list[tuple[typing.Any, ...]],
+        keep_newer: bool = False
+    ) -> None:
+        """
+            Stores the (tm, round_the_clock, daily, nightly, est, cplt, final, fetched_at) buckets of the given resolution (DAY or MONTH).
+
+            If keep_newer is set, the stored buckets fetched after the given ones are left as they are.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                '''
+                    INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (meter_id, resolution, tm) DO UPDATE SET
+                        zone_round_the_clock = excluded.zone_round_the_clock, zone_daily = excluded.zone_daily, zone_nightly = excluded.zone_nightly,
+                        est = excluded.est, cplt = excluded.cplt, final = excluded.final, fetched_at = excluded.fetched_at
+                    WHERE excluded.fetched_at >= rollups.fetched_at OR NOT ?
+                ''',
+                ((meter_id, resolution, *bucket, keep_newer) for bucket in buckets)
+            )
+
+    def load_rollups(
+        self,
+        meter_id: int,
+        resolution: str,
+        bounds: tuple[int, int],
+        fresh_since: float | None = None
+    ) -> list[tuple[typing.Any, ...]]:
+        """
+            Returns the buckets starting within the [start, end) bounds, which are final or (if fresh_since is given) were updated after that time.
+        """
+        with self._lock:
+            return self._connection.execute(
+                '''
+                    SELECT tm, zone_round_the_clock, zone_daily, zone_nightly, est, cplt, final, fetched_at
+                    FROM rollups WHERE meter_id = ? AND resolution = ? AND tm >= ? AND tm < ? AND (final = 1 OR fetched_at >= ?)
+                    ORDER BY tm
+                ''',
+                (meter_id, resolution, *bounds, float('-inf') if fresh_since is None else fresh_since)
+            ).fetchall()
+
+    def load_session(self, account: str) -> SharedSession | None:
+        with self._lock:
+            session = self._connection.execute(
+                'SELECT cookies, meter_ids, saved_at FROM sessions WHERE account = ?',
+                (account,)
+            ).fetchone()
+        if session is None:
+            return None
+        cookies, meter_ids, saved_at = session
+        return SharedSession(json.loads(cookies), json.loads(meter_ids), saved_at)
+
+    def save_session(self, account: str, cookies: list[dict[str, str]], meter_ids: list[int]) -> float:
+        saved_at = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)',
+                (account, json.dumps(cookies), json.dumps(meter_ids), saved_at)
+            )
+        return saved_at
+
+    def discard_session(self, account: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM sessions WHERE account = ?', (account,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def _pad_zones(zones: list[float | None] | None) -> tuple[float | None, float | None, float | None]:
+    padded = [*(zones or []), None, None, None]
+    return padded[0], padded[1], padded[2]
@@ -0,0 +1,165 @@
+"""
+    Backfills the local measurement store with the hourly history of the meters, optionally exporting it to CSV or Parquet files.
+
+    The days of the range are fetched by a bounded number of concurrent workers, through the same path the API uses - so the days
+    already kept in the store are not fetched again, and an interrupted run picks up where it stopped once it is started again.
+    Exported files hold a single month of a single meter (<output>/<meter ID>/<YYYY-MM>.<format>) and are only written once the
+    whole month has been fetched, so the files of closed months serve as checkpoints and are skipped by the subsequent runs.
+
+    Usage (from the src directory, with the same environment as serve.py):
+        python backfill.py --from 01-01-2022 --to 31-12-2024 [--meter 12345678 ...] [--concurrency 4] [--rate 2.5] [--output exports --format csv]
+
+    The upstream rate limit is not shared with a running agent - the backfill has a bucket of its own, filled at --rate requests per second
+    (by default, a half of the configured upstream_rate_limit), so the rate of both of them adds up.
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import logging
+import os
+import sys
+import typing
+
+import agent.routers.energa
+import agent.utils.config
+import agent.utils.consts
+import agent.utils.formats
+import agent.utils.periods
+import agent.utils.ratelimit
+import agent.utils.retry
+import agent.utils.session
+import agent.utils.startup
+
+import serve
+
+EXPORT_FORMATS = ('csv', 'parquet')
+
+logger = logging.getLogger('uvicorn')
+
+
+@dataclasses.dataclass
+class BackfillProgress:
+    days: int = dataclasses.field(default=0)
+    fetched_days: int = dataclasses.field(default=0)  # the rest of the days was already in the store
+    failed_days: int = dataclasses.field(default=0)
+    exported_months: int = dataclasses.field(default=0)
+    skipped_months: int = dataclasses.field(default=0)
+
+
+async def backfill_meter(  # pylint: disable=too-many-arguments
+    app: typing.Any,
+    meter_id: int,
+    backfill_range: tuple[int, int],
+    concurrency: asyncio.Semaphore,
+    arguments: argparse.Namespace,
+    progress: BackfillProgress
+) -> None:
+    for month_start in agent.utils.periods.split_range(*backfill_range, 'MONTH'):
+        month_end = agent.utils.periods.window_bounds(month_start, 'MONTH')[1]
+        export_path = os.path.join(
+            arguments.output, str(meter_id), f'{datetime.datetime.fromtimestamp(month_start / 1000):%Y-%m}.{arguments.format}'
+        ) if arguments.output else None
+        if export_path and os.path.exists(export_path) and agent.utils.periods.is_window_closed(month_start, 'MONTH'):
+            progress.skipped_months += 1
+            continue
+
+        async def fetch_day(day_start: int) -> agent.routers.energa.MeasurementWindow | None:
+            async with concurrency:
+                try:
+                    return await agent.routers.energa.fetch_measurement_data(app, meter_id, day_start, 'DAY')
+                except agent.utils.retry.UpstreamUnavailableError as upstream_error:
+                    logger.warning(f'Failed to fetch {datetime.datetime.fromtimestamp(day_start / 1000):%d-%m-%Y}: {upstream_error}')
+                    return None
+
+        day_windows = await asyncio.gather(*(
+            fetch_day(day_start)
+            for day_start in agent.utils.periods.split_range(max(month_start, backfill_range[0]), min(month_end, backfill_range[1]), 'DAY')
+        ))
+        progress.days += len(day_windows)
+        progress.failed_days += sum(day_window is None for day_window in day_windows)
+        logger.info(f'Meter {meter_id}: {datetime.datetime.fromtimestamp(month_start / 1000):%Y-%m} backfilled ({progress.days} days so far)')
+        if export_path is None or any(day_window is None for day_window in day_windows):
+            continue  # Months with missing days are not exported, so the next run retries them
+        await asyncio.to_thread(export_month, export_path, arguments.format, day_windows)  # type: ignore
+        progress.exported_months += 1
+
+
+def export_month(export_path: str, export_format: str, day_windows: list[agent.routers.energa.MeasurementWindow]) -> None:
+    """
+        Writes the measurements of a month into a temporary file, which replaces the export file only once it is complete.
+    """
+    measurement_columns = agent.routers.energa._extract_measurement_columns_from_fetched_data(  # pylint: disable=protected-access
+        [measurement_data for day_window in day_windows for measurement_data in day_window.data],
+        1.0
+    )
+    os.makedirs(os.path.dirname(export_path), exist_ok=True)
+    temporary_path = f'{export_path}.tmp'
+    with open(temporary_path, 'wb') as export_file:
+        for chunk in agent.utils.formats.ENCODERS[export_format](measurement_columns._asdict()):
+            export_file.write(chunk)
+    os.replace(temporary_path, export_path)
+
+
+async def run_backfill(arguments: argparse.Namespace) -> BackfillProgress:
+    backfill_range = (
+        agent.routers.energa.date_to_epoch(arguments.date_from),
+        agent.utils.periods.window_bounds(agent.routers.energa.date_to_epoch(arguments.date_to), 'DAY')[1]
+    )
+    # The priority orders the requests of the backfill itself only - the rate limiter of a running agent is not shared with it
+    agent.utils.ratelimit.REQUEST_PRIORITY.set(agent.utils.ratelimit.Priority.BACKFILL)
+    config = agent.utils.config.PPEAgentConfig()
+    rate = config.upstream_rate_limit * agent.utils.consts.BACKFILL_RATE_SHARE if arguments.rate is None else arguments.rate
+    service = serve.create_service({
+        'prefetch_interval': 0,
+        'keepalive_interval': 0,
+        'upstream_rate_limit': rate * config.workers,  # The limit is split between the workers, while the backfill runs in a single process
+    })
+    app = service._app  # pylint: disable=protected-access
+    progress = BackfillProgress()
+    async with app.router.lifespan_context(app):
+        startup: agent.utils.startup.StartupState = app.extra[agent.utils.consts.AGENT_STARTUP_FIELD]
+        await startup.wait_until_ready(timeout=agent.utils.consts.BACKFILL_LOGIN_TIMEOUT)
+        session_pool: agent.utils.session.EnergaSessionPool = app.extra[agent.utils.consts.AGENT_ENERGA_SESSION_FIELD]
+        concurrency = asyncio.Semaphore(arguments.concurrency)
+        for meter_id in arguments.meter or [*session_pool.meters]:
+            if meter_id not in session_pool.meters:
+                raise ValueError(f'Unknown meter: {meter_id}')
+            await backfill_meter(app, meter_id, backfill_range, concurrency, arguments, progress)
+        progress.fetched_days = app.extra[agent.utils.consts.AGENT_STATS_FIELD]['upstream_queries']()['calls']
+    return progress
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Backfills the local measurement store (and exports) with the history of the meters')
+    parser.add_argument('--from', dest='date_from', required=True, help='first day of the range, in DD-MM-YYYY format')
+    parser.add_argument('--to', dest='date_to', required=True, help='last day of the range (inclusive), in DD-MM-YYYY format')
+    parser.add_argument('--meter', type=int, nargs='+', help='IDs of the meters to backfill (default: all of the meters)')
+    parser.add_argument('--concurrency', type=int, default=agent.utils.consts.DEFAULT_AGENT_RANGE_CONCURRENCY, help='days fetched concurrently')
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='requests sent to Energa per second, on top of the ones of a running agent (default: a half of upstream_rate_limit, 0 disables the limit)'
+    )
+    parser.add_argument('--output', help='directory, to which the measurements are exported (one file per meter and month)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='format of the exported files')
+    arguments = parser.parse_args()
+    if arguments.concurrency < 1:
+        parser.error('--concurrency must be a positive integer')
+    if arguments.rate is not None and arguments.rate < 0:
+        parser.error('--rate must not be negative')
+    try:
+        agent.utils.formats.ensure_format_available(arguments.format)
+        progress = asyncio.run(run_backfill(arguments))
+    except (ValueError, agent.utils.startup.ServiceNotReadyError) as backfill_error:
+        sys.exit(f'Backfill failed: {backfill_error}')
+    logger.info(
+        f'Backfilled {progress.days} days ({progress.fetched_days} fetched from Energa, {progress.failed_days} failed), exported {progress.exported_months} months '
+        f'({progress.skipped_months} already exported)'
+    )
+    if progress.failed_days:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,77 +1,140 @@
-import contextlib
 import dataclasses
+import logging
 import os
-import sys
-import time
 import threading
 import typing
 
 import uvicorn
 import uvicorn.logging
 
-import agent.service
+import agent.utils.config
 import agent.utils.logger
 import agent.utils.consts
 
+if typing.TYPE_CHECKING:
+    import fastapi
+    import uvicorn.supervisors
+
+    import agent.service
+
+# The application stack (FastAPI, HTTPX and the routers) is imported lazily, only by the processes that serve the application -
+# the supervisor of the worker processes never loads it.
+
 
 @dataclasses.dataclass
 class ThreadedPPEServer:
     config: dict[str, typing.Any]
     server: uvicorn.Server = dataclasses.field(init=False)
     thread: threading.Thread = dataclasses.field(init=False)
-    should_exit: bool = dataclasses.field(default=False)
+    stopped: threading.Event = dataclasses.field(default_factory=threading.Event)
 
     def __post_init__(self):
         self.server = uvicorn.Server(
             config=uvicorn.Config(**self.config)
         )
         self.thread = threading.Thread(
-            target=self.server.run
+            target=self._serve
         )
 
-    @contextlib.contextmanager
-    def run_in_thread(self):
-        if self.should_exit:
-            self.should_exit = False
+    def _serve(self):
+        try:
+            self.server.run()
+        finally:
+            self.stopped.set()
+
+    def start(self):
         self.thread.start()
         try:
-            while not self.server.started:
-                time.sleep(0.1)
-            yield
-        except KeyboardInterrupt:
-            sys.exit(1)
+            self.stopped.wait()
         finally:
-            self.should_exit = True
+            self.stop()
             self.thread.join()
 
+    def stop(self):
+        self.server.should_exit = True
+        self.stopped.set()
+
+
+@dataclasses.dataclass
+class MultiprocessPPEServer:
+    """
+        Runs the given number of worker processes, each serving its own instance of the agent (built by the create_app factory) on a shared socket.
+    """
+    config: dict[str, typing.Any]
+    workers: int
+    supervisor: 'uvicorn.supervisors.Multiprocess' = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        import uvicorn.supervisors  # pylint: disable=import-outside-toplevel,redefined-outer-name
+        server_config = uvicorn.Config(
+            'serve:create_app',
+            factory=True,
+            workers=self.workers,
+            **self.config
+        )
+        self.supervisor = uvicorn.supervisors.Multiprocess(
+            server_config,
+            target=uvicorn.Server(config=server_config).run,
+            sockets=[server_config.bind_socket()]
+        )
+
     def start(self):
-        with self.run_in_thread():
-            while not self.should_exit:
-                time.sleep(0.001)
+        self.supervisor.run()
 
     def stop(self):
-        self.should_exit = True
+        self.supervisor.should_exit.set()
 
 
-def main():
-    ppe_agent = agent.service.PPEAgentService({
+def create_service(overrides: dict[str, typing.Any] | None = None) -> 'agent.service.PPEAgentService':
+    import agent.service  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    return agent.service.PPEAgentService({
         'credentials': {
             'email': os.getenv('PPE_AGENT_EMAIL'),
             'password': os.getenv('PPE_AGENT_PASSWORD')
-        }
+        },
+        'overrides': overrides or {},
     })
-    server = ThreadedPPEServer({
-        'app': ppe_agent._app,  # pylint: disable=protected-access
+
+
+def create_app() -> 'fastapi.FastAPI':
+    return create_service()._app  # pylint: disable=protected-access
+
+
+def main():
+    agent_config = agent.utils.config.PPEAgentConfig()
+    server_config = {
         'port': int(os.getenv('PPE_AGENT_PORT', '8000')),
         'host': '0.0.0.0' if os.getenv('PPE_AGENT_IS_DOCKERIZED') else os.getenv('PPE_AGENT_HOST', '127.0.0.1'),
-        'log_config': ppe_agent._log_config  # pylint: disable=protected-access
-    })
+    }
+    server: ThreadedPPEServer | MultiprocessPPEServer
+    if agent_config.workers > 1:
+        server = MultiprocessPPEServer(
+            server_config | {
+                'log_config': agent.utils.logger.initialize_loggers(
+                    agent_config.log_level,
+                    agent_config.logging_format,
+                    queued=agent_config.logging_queue,
+                    json_format=agent_config.logging_json,
+                    access_sample_rate=agent_config.access_log_sample_rate,
+                    access_rate_limit=agent_config.access_log_rate_limit
+                )
+            },
+            workers=agent_config.workers
+        )
+        logger = logging.getLogger('uvicorn')
+    else:
+        ppe_agent = create_service()
+        server = ThreadedPPEServer(server_config | {
+            'app': ppe_agent._app,  # pylint: disable=protected-access
+            'log_config': ppe_agent._log_config  # pylint: disable=protected-access
+        })
+        logger = ppe_agent.logger
     try:
+        logger.info('Started PPE service server')
         server.start()
-        ppe_agent.logger.info('Started PPE service server')
     except KeyboardInterrupt:
-        ppe_agent.logger.info('Shutting down PPE service server')
-        ppe_agent.logout()
+        # Logging out of Energa is handled by the lifespan hook of the application, once the server shuts down
+        logger.info('Shutting down PPE service server')
         server.stop()
 
 
@@ -0,0 +1,143 @@
+"""
+    Fixtures shared by the tests - an application wired with the same components as the agent service, but talking to a fake Energa session.
+"""
+import datetime
+import time
+import typing
+import urllib.parse
+
+import fastapi
+import httpx
+import pytest
+
+import agent.routers.energa
+import agent.routers.general
+import agent.service
+import agent.utils.aggregation
+import agent.utils.assets
+import agent.utils.broadcast
+import agent.utils.cache
+import agent.utils.coalescing
+import agent.utils.config
+import agent.utils.consts
+import agent.utils.interprocess
+import agent.utils.periods
+import agent.utils.ratelimit
+import agent.utils.readings
+import agent.utils.retry
+import agent.utils.session
+import agent.utils.startup
+import agent.utils.storage
+
+METER_ID = 12345678
+ACCOUNT_NAME = 'default'
+WARM_CACHE_MAX_AGE = 600.0
+
+
+def chart_datapoints(epoch: int, period: str, zones: tuple[float | None, ...] = (1.0, None, None)) -> list[dict[str, typing.Any]]:
+    """
+        Returns the datapoints of the window, the way Energa charts it - hourly for DAY, daily for WEEK and MONTH, monthly for YEAR.
+        Datapoints, which have not started yet, have no zone measured.
+    """
+    now = int(time.time() * 1000)
+    window_start, window_end = agent.utils.periods.window_bounds(epoch, period)
+    datapoints = []
+    datapoint_start = datetime.datetime.fromtimestamp(window_start / 1000)
+    while (timestamp := int(datapoint_start.timestamp() * 1000)) < window_end:
+        datapoints.append({
+            'tm': str(timestamp),
+            'tarAvg': None,
+            'zones': list(zones) if timestamp <= now else [None, None, None],
+            'est': False,
+            'cplt': True,
+        })
+        match period:
+            case 'DAY':
+                datapoint_start += datetime.timedelta(hours=1)
+            case 'WEEK' | 'MONTH':
+                datapoint_start += datetime.timedelta(days=1)
+            case _:
+                datapoint_start = (datapoint_start + datetime.timedelta(days=32)).replace(day=1)
+    return datapoints
+
+
+class FakeEnergaSession:  # pylint: disable=too-few-public-methods
+    """
+        Answers the chart requests with generated datapoints and records the (period, epoch) of every one of them.
+
+        Responses put into the queued list are returned first, in order - e.g. to serve the login page, as if the session had expired.
+        It stands in for both the (authorized) session and the client wrapped by it.
+    """
+    def __init__(self) -> None:
+        self.requests: list[tuple[str, int]] = []
+        self.queued: list[httpx.Response] = []
+        self.cookies = httpx.Cookies()
+
+    async def get(self, url: str, expect_json: bool = False, **_: typing.Any) -> httpx.Response:  # pylint: disable=unused-argument
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        period, epoch = query['type'], int(query['mainChartDate'])
+        self.requests.append((period, epoch))
+        request = httpx.Request('GET', f'{agent.utils.consts.DEFAULT_AGENT_ENERGA_BASE_URL}{url}')
+        if self.queued:
+            response = self.queued.pop(0)
+            response.request = request
+            return response
+        return httpx.Response(200, json={'response': {'mainChart': chart_datapoints(epoch, period)}}, request=request)
+
+
+def login_page() -> httpx.Response:
+    return httpx.Response(200, html='<form action="/dp/UserLogin.do"></form>')
+
+
+@pytest.fixture(name='anyio_backend')
+def fixture_anyio_backend() -> str:
+    return 'asyncio'
+
+
+@pytest.fixture(name='energa_session')
+def fixture_energa_session() -> FakeEnergaSession:
+    return FakeEnergaSession()
+
+
+@pytest.fixture(name='app')
+def fixture_app(tmp_path, monkeypatch, energa_session: FakeEnergaSession) -> typing.Iterator[fastapi.FastAPI]:
+    monkeypatch.delenv('PPE_AGENT_CONFIG', raising=False)
+    config = agent.utils.config.PPEAgentConfig(storage_path=str(tmp_path / 'measurements.sqlite3'))
+    store = agent.utils.storage.MeasurementStore(config.storage_path)
+    worker_locks = agent.utils.interprocess.WorkerLocks(f'{config.storage_path}.lock', shared=config.workers > 1)
+    startup = agent.utils.startup.StartupState()
+    startup.set_ready()
+    asset_cache = agent.utils.assets.AssetCache(config.assets_path)
+    asset_cache.load()
+    application = fastapi.FastAPI()
+    application.include_router(agent.routers.general.GENERAL_ROUTER)
+    application.include_router(agent.routers.energa.MEASUREMENTS_ROUTER)
+    application.add_exception_handler(agent.utils.retry.UpstreamUnavailableError, agent.service.handle_upstream_unavailable)  # type: ignore
+    application.extra.update({
+        agent.utils.consts.AGENT_CONFIG_FIELD: config,
+        agent.utils.consts.AGENT_ASSETS_FIELD: asset_cache,
+        agent.utils.consts.AGENT_METER_ID_FIELD: METER_ID,
+        agent.utils.consts.AGENT_ENERGA_SESSION_FIELD: agent.utils.session.EnergaSessionPool(
+            sessions={ACCOUNT_NAME: energa_session},  # type: ignore
+            meters={METER_ID: ACCOUNT_NAME}
+        ),
+        agent.utils.consts.AGENT_STORE_FIELD: store,
+        agent.utils.consts.AGENT_AGGREGATION_FIELD: agent.utils.aggregation.AggregationEngine(store),
+        agent.utils.consts.AGENT_WORKER_LOCKS_FIELD: worker_locks,
+        agent.utils.consts.AGENT_SINGLE_FLIGHT_FIELD: agent.utils.coalescing.SingleFlight(),
+        agent.utils.consts.AGENT_WARM_CACHE_FIELD: agent.utils.cache.WarmCache(max_age=WARM_CACHE_MAX_AGE),
+        agent.utils.consts.AGENT_RETRY_POLICY_FIELD: agent.utils.retry.RetryPolicy(max_retries=0),
+        agent.utils.consts.AGENT_RATE_LIMITER_FIELD: agent.utils.ratelimit.OutboundRateLimiter(rate=0, burst=1),
+        agent.utils.consts.AGENT_RECENT_READINGS_FIELD: agent.utils.readings.RecentReadings(config.recent_readings_days),
+        agent.utils.consts.AGENT_BROADCASTER_FIELD: agent.utils.broadcast.MeasurementBroadcaster(poll=None, interval=60),  # type: ignore
+        agent.utils.consts.AGENT_STARTUP_FIELD: startup,
+    })
+    yield application
+    store.close()
+    worker_locks.close()
+
+
+@pytest.fixture(name='client')
+async def fixture_client(app: fastapi.FastAPI) -> typing.AsyncIterator[httpx.AsyncClient]:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://agent') as agent_client:  # type: ignore
+        yield agent_client
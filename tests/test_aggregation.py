@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from conftest import METER_ID, WARM_CACHE_MAX_AGE, chart_datapoints
+
+import agent.routers.energa
+import agent.utils.aggregation
+import agent.utils.periods
+import agent.utils.storage
+
+
+@pytest.fixture(name='store')
+def fixture_store() -> agent.utils.storage.MeasurementStore:
+    return agent.utils.storage.MeasurementStore(':memory:')
+
+
+def open_days(month_epoch: int) -> list[int]:
+    """
+        Returns the start epochs of the days of the month (up to now), which may still change.
+    """
+    month_start, month_end = agent.utils.periods.window_bounds(month_epoch, 'MONTH')
+    return [
+        day_start
+        for day_start in agent.utils.periods.split_range(month_start, min(month_end, int(time.time() * 1000)), 'DAY')
+        if not agent.utils.periods.is_window_closed(day_start, 'DAY')
+    ]
+
+
+def test_rollup_sums_the_zones_of_every_bucket() -> None:
+    now = time.time()
+    day_start, _ = agent.utils.periods.window_bounds(int(now * 1000) - 3 * 24 * 60 * 60 * 1000, 'DAY')
+    datapoints = [
+        {'tm': str(day_start + hour * 60 * 60 * 1000), 'zones': [0.5, 0.25, None], 'est': hour == 3, 'cplt': True}
+        for hour in range(24)
+    ]
+
+    buckets = agent.utils.aggregation.rollup(datapoints, 'DAY', now)
+
+    assert len(buckets) == 1
+    assert buckets[0].tm == day_start
+    assert buckets[0].zones == (12.0, 6.0, None)
+    assert buckets[0].est
+    assert buckets[0].final
+
+
+def test_month_is_rolled_up_once_all_of_its_days_are_known(store: agent.utils.storage.MeasurementStore) -> None:
+    aggregation_engine = agent.utils.aggregation.AggregationEngine(store)
+    now = int(time.time() * 1000)
+    month_bounds = agent.utils.periods.window_bounds(now, 'MONTH')
+    days = agent.utils.periods.split_range(month_bounds[0], now, 'DAY')
+
+    for day_start in days[:-1]:
+        aggregation_engine.record(METER_ID, 'DAY', chart_datapoints(day_start, 'DAY'), time.time())
+    assert not store.load_rollups(METER_ID, 'MONTH', month_bounds)
+
+    aggregation_engine.record(METER_ID, 'DAY', chart_datapoints(days[-1], 'DAY'), time.time())
+    (month_bucket,) = map(agent.utils.aggregation._bucket_from_row, store.load_rollups(METER_ID, 'MONTH', month_bounds))  # pylint: disable=protected-access
+    day_buckets = map(agent.utils.aggregation._bucket_from_row, store.load_rollups(METER_ID, 'DAY', month_bounds))  # pylint: disable=protected-access
+    assert month_bucket.zones[0] == pytest.approx(sum(day_bucket.zones[0] for day_bucket in day_buckets))
+    assert not month_bucket.final
+
+
+def test_open_month_is_as_fresh_as_its_open_days(store: agent.utils.storage.MeasurementStore) -> None:
+    aggregation_engine = agent.utils.aggregation.AggregationEngine(store)
+    now = time.time()
+    month_bounds = agent.utils.periods.window_bounds(int(now * 1000), 'MONTH')
+    aggregation_engine.record(METER_ID, 'MONTH', chart_datapoints(month_bounds[0], 'MONTH'), now - 2 * WARM_CACHE_MAX_AGE)
+
+    for day_start in open_days(month_bounds[0]):
+        aggregation_engine.record(METER_ID, 'DAY', chart_datapoints(day_start, 'DAY'), now)
+
+    (month_bucket,) = map(agent.utils.aggregation._bucket_from_row, store.load_rollups(METER_ID, 'MONTH', month_bounds))  # pylint: disable=protected-access
+    assert month_bucket.fetched_at == now
+    assert store.load_rollups(METER_ID, 'MONTH', month_bounds, fresh_since=now - WARM_CACHE_MAX_AGE)
+
+
+def test_recording_an_older_window_keeps_the_fresher_buckets(store: agent.utils.storage.MeasurementStore) -> None:
+    aggregation_engine = agent.utils.aggregation.AggregationEngine(store)
+    now = time.time()
+    day_bounds = agent.utils.periods.window_bounds(int(now * 1000), 'DAY')
+    aggregation_engine.record(METER_ID, 'DAY', chart_datapoints(day_bounds[0], 'DAY'), now)
+
+    aggregation_engine.record(METER_ID, 'MONTH', chart_datapoints(day_bounds[0], 'MONTH'), now - 1000)
+
+    (day_bucket,) = map(agent.utils.aggregation._bucket_from_row, store.load_rollups(METER_ID, 'DAY', day_bounds))  # pylint: disable=protected-access
+    assert day_bucket.fetched_at == now
+
+
+@pytest.mark.anyio
+async def test_current_year_is_aggregated_from_rollups_after_filling_the_open_days(app, energa_session) -> None:
+    aggregation_engine: agent.utils.aggregation.AggregationEngine = app.extra['aggregation']
+    started_at = time.time()
+    now = int(started_at * 1000)
+    stale = started_at - 2 * WARM_CACHE_MAX_AGE
+    # Everything but the open days is known from earlier fetches - the open days have been fetched too long ago
+    aggregation_engine.record(METER_ID, 'YEAR', chart_datapoints(now, 'YEAR'), stale)
+    previous_month_start, _ = agent.utils.periods.window_bounds(agent.utils.periods.window_bounds(now, 'MONTH')[0] - 1, 'MONTH')
+    for month_epoch in (previous_month_start, now):
+        aggregation_engine.record(METER_ID, 'MONTH', chart_datapoints(month_epoch, 'MONTH'), stale)
+
+    year_window = await agent.routers.energa.fetch_measurement_data(app, METER_ID, now, 'YEAR')
+
+    expected_fills = sorted({*open_days(previous_month_start), *open_days(now)})
+    assert year_window is not None
+    assert sorted(energa_session.requests) == [('DAY', day_start) for day_start in expected_fills]
+    assert len(year_window.data) == len(agent.utils.periods.split_range(agent.utils.periods.window_bounds(now, 'YEAR')[0], now, 'MONTH'))
+    assert aggregation_engine.fallbacks == 0
+    today_bounds = agent.utils.periods.window_bounds(now, 'DAY')
+    (today_bucket,) = map(agent.utils.aggregation._bucket_from_row, app.extra['store'].load_rollups(METER_ID, 'DAY', today_bounds))  # pylint: disable=protected-access
+    assert today_bucket.fetched_at >= started_at
+
+    assert await agent.routers.energa.fetch_measurement_data(app, METER_ID, now, 'YEAR') is not None
+    assert len(energa_session.requests) == len(expected_fills)
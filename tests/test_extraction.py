@@ -0,0 +1,28 @@
+import csv
+import io
+import json
+
+import pytest
+
+QUERY = {'date': '01-01-2024', 'period': 'day'}
+
+
+def round_the_clock_values(output_format: str, body: bytes) -> list[float]:
+    match output_format:
+        case 'json':
+            return [zones[0] for _, zones in json.loads(body)['data']]
+        case 'columnar':
+            return json.loads(body)['data']['round_the_clock']
+        case _:
+            return [float(row['round_the_clock']) for row in csv.DictReader(io.StringIO(body.decode()))]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('output_format', ['json', 'columnar', 'csv'])
+async def test_cost_scales_the_queried_measurements(client, output_format: str) -> None:
+    response = await client.get('/energy/query', params={**QUERY, 'format': output_format})
+    scaled_response = await client.get('/energy/query', params={**QUERY, 'format': output_format, 'cost': '0.5'})
+
+    assert round_the_clock_values(output_format, response.content) == [1.0] * 24
+    assert round_the_clock_values(output_format, scaled_response.content) == [0.5] * 24
+    assert scaled_response.headers['ETag'] != response.headers['ETag']
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from conftest import METER_ID
+import agent.routers.energa
+import agent.utils.http_cache
+import agent.utils.periods
+
+
+@pytest.fixture(name='query')
+def fixture_query() -> dict[str, str]:
+    return {'date': time.strftime('%d-%m-%Y'), 'period': 'day'}
+
+
+@pytest.mark.anyio
+async def test_conditional_request_reuses_the_digest_of_the_fetched_data(client, query, monkeypatch) -> None:
+    etag = (await client.get('/energy/query', params=query)).headers['ETag']
+
+    def digest_data(_) -> str:
+        raise AssertionError('The data should not be digested again')
+
+    monkeypatch.setattr(agent.utils.http_cache, 'digest_data', digest_data)
+    response = await client.get('/energy/query', params=query, headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+@pytest.mark.anyio
+async def test_window_served_from_the_store_keeps_its_etag(app, client, query, energa_session) -> None:
+    etag = (await client.get('/energy/query', params=query)).headers['ETag']
+    app.extra['warmCache'].discard(next(iter(app.extra['warmCache']._entries)))  # pylint: disable=protected-access
+
+    response = await client.get('/energy/query', params=query, headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert len(energa_session.requests) == 1
+
+
+@pytest.mark.anyio
+async def test_refetching_unchanged_data_keeps_the_body_and_its_validators(app, client, query) -> None:
+    first_response = await client.get('/energy/query', params=query)
+    await asyncio.sleep(1)  # Lets the fetch time move on by a whole second
+    await agent.routers.energa.refresh_measurement_data(app, METER_ID, int(time.time() * 1000), 'DAY')
+    second_response = await client.get('/energy/query', params=query)
+
+    assert second_response.headers['X-Fetched-At'] != first_response.headers['X-Fetched-At']
+    assert second_response.content == first_response.content
+    assert second_response.headers['ETag'] == first_response.headers['ETag']
+    assert second_response.headers['Last-Modified'] == first_response.headers['Last-Modified']
+    conditional_response = await client.get('/energy/query', params=query, headers={'If-Modified-Since': first_response.headers['Last-Modified']})
+    assert conditional_response.status_code == 304
+
+
+@pytest.mark.anyio
+async def test_data_stored_again_unchanged_keeps_the_time_it_last_changed(app) -> None:
+    epoch, _ = agent.utils.periods.window_bounds(int(time.time() * 1000), 'DAY')
+    first_window = await agent.routers.energa.refresh_measurement_data(app, METER_ID, epoch, 'DAY')
+    app.extra['warmCache'].discard((METER_ID, epoch, 'DAY'))
+    second_window = await agent.routers.energa.refresh_measurement_data(app, METER_ID, epoch, 'DAY')
+
+    assert first_window is not None and second_window is not None
+    assert second_window.fetched_at > first_window.fetched_at
+    assert second_window.modified_at == first_window.modified_at == first_window.fetched_at
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('status_code', [202, 204])
+async def test_successful_response_without_the_chart_is_not_served(client, query, energa_session, status_code: int) -> None:
+    energa_session.queued.append(httpx.Response(status_code))
+
+    response = await client.get('/energy/query', params=query)
+
+    assert response.status_code == 502
+    assert 'Retry-After' in response.headers
+    assert (await client.get('/energy/query', params=query)).status_code == 200
@@ -0,0 +1,74 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+import agent.service
+import agent.utils.consts
+import agent.utils.interprocess
+
+LEADER_PROCESS = '''
+import fcntl, sys, time
+lock_file = open(sys.argv[1], 'a+b')
+fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 0)
+print('leader', flush=True)
+time.sleep(60)
+'''
+
+
+@pytest.mark.anyio
+async def test_keyed_locks_are_skipped_for_a_single_worker(tmp_path, monkeypatch) -> None:
+    worker_locks = agent.utils.interprocess.WorkerLocks(str(tmp_path / 'measurements.sqlite3.lock'), shared=False)
+    locked_offsets: list[int] = []
+    monkeypatch.setattr(agent.utils.interprocess.fcntl, 'lockf', lambda _, __, ___, offset: locked_offsets.append(offset))
+
+    async with worker_locks.hold(('login', 'default')):
+        pass
+
+    assert not locked_offsets
+    worker_locks.close()
+
+
+@pytest.mark.anyio
+async def test_keyed_locks_are_taken_and_released_for_several_workers(tmp_path, monkeypatch) -> None:
+    worker_locks = agent.utils.interprocess.WorkerLocks(str(tmp_path / 'measurements.sqlite3.lock'), shared=True)
+    lock_operations: list[tuple[int, int]] = []
+    monkeypatch.setattr(
+        agent.utils.interprocess.fcntl,
+        'lockf',
+        lambda _, operation, __, offset: lock_operations.append((operation, offset))
+    )
+
+    async with worker_locks.hold(('login', 'default')):
+        pass
+
+    assert [operation for operation, _ in lock_operations] == [agent.utils.interprocess.fcntl.LOCK_EX, agent.utils.interprocess.fcntl.LOCK_UN]
+    assert lock_operations[0][1] == lock_operations[1][1]
+    worker_locks.close()
+
+
+@pytest.mark.anyio
+async def test_leadership_is_taken_over_once_the_leader_exits(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(agent.utils.consts, 'WORKER_LEADERSHIP_RETRY_INTERVAL', 0.01)
+    lock_path = str(tmp_path / 'measurements.sqlite3.lock')
+    leader = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', LEADER_PROCESS, lock_path, stdout=asyncio.subprocess.PIPE
+    )
+    assert await leader.stdout.readline() == b'leader\n'  # type: ignore
+    service = agent.service.PPEAgentService({'credentials': {'email': 'user@example.com', 'password': 'secret'}})
+    service._startup.set_ready()  # pylint: disable=protected-access
+    worker_locks = agent.utils.interprocess.WorkerLocks(lock_path, shared=True)
+    assert not worker_locks.acquire_leadership()
+    started_jobs: list[str] = []
+    prefetch_scheduler = types.SimpleNamespace(start=lambda: started_jobs.append('prefetch'))
+
+    leadership_contest = asyncio.create_task(service._contest_leadership(prefetch_scheduler, worker_locks))  # type: ignore  # pylint: disable=protected-access
+    await asyncio.sleep(0.05)
+    assert not worker_locks.is_leader
+    leader.kill()
+    await leader.wait()
+    await asyncio.wait_for(leadership_contest, timeout=5)
+    assert worker_locks.is_leader
+    assert started_jobs == ['prefetch']
+    worker_locks.close()
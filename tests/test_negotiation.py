@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import agent.utils.assets
+import agent.utils.compression
+import agent.utils.formats
+import agent.utils.negotiation
+
+
+def test_accept_header_is_parsed_into_qualities() -> None:
+    assert agent.utils.negotiation.parse_accept(' GZIP ; Q=0.5 , br;level=1, zstd;q=oops ,, *;q=0') == {
+        'gzip': 0.5,
+        'br': 1.0,
+        'zstd': 0.0,
+        '*': 0.0,
+    }
+    assert not agent.utils.negotiation.parse_accept(None)
+
+
+def test_acceptable_values_are_ordered_by_quality_then_position() -> None:
+    assert agent.utils.negotiation.accepted_by_preference('text/csv;q=0.5, application/json, text/html;q=0, */*;q=0.5') == [
+        'application/json',
+        'text/csv',
+        '*/*',
+    ]
+
+
+@pytest.mark.parametrize('accept_encoding, expected_coding', [
+    (None, None),
+    ('gzip', 'gzip'),
+    ('gzip;q=0, identity', None),
+    ('*', agent.utils.compression.available_codings()[0]),
+    ('*;q=0.5, gzip;q=1', 'gzip'),
+])
+def test_response_coding_is_negotiated(accept_encoding: str | None, expected_coding: str | None) -> None:
+    assert agent.utils.compression.negotiate_coding(accept_encoding) == expected_coding
+
+
+@pytest.mark.parametrize('accept_encoding, expected_encoding', [
+    (None, 'identity'),
+    ('gzip, br;q=0', 'gzip'),
+    ('*;q=0.1', 'gzip'),
+    ('gzip ; q=0', 'identity'),
+])
+def test_asset_encoding_is_negotiated(accept_encoding: str | None, expected_encoding: str) -> None:
+    variants = {'identity': b'', 'gzip': b''}
+    assert agent.utils.assets._negotiate_encoding(accept_encoding, variants) == expected_encoding  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('accept_header, expected_format', [
+    ('text/csv;q=0.5, application/json;q=0.9', 'json'),
+    ('text/html, text/csv;q=0.1', 'csv'),
+    ('text/html, */*;q=0.1', 'json'),
+])
+def test_output_format_is_negotiated(accept_header: str, expected_format: str) -> None:
+    assert agent.utils.formats.negotiate_format(None, accept_header) == expected_format
+
+
+def test_output_format_falls_back_to_json_for_unsupported_media_types() -> None:
+    assert agent.utils.formats.negotiate_format(None, 'text/html,application/xhtml+xml;q=0.9') == 'json'
+    assert agent.utils.formats.negotiate_format(None, 'text/csv;q=0, text/html') == 'json'
+
+
+def test_unsupported_format_parameter_is_rejected() -> None:
+    with pytest.raises(agent.utils.formats.UnsupportedFormatError):
+        agent.utils.formats.negotiate_format('xml', 'text/csv')
+
+
+@pytest.mark.anyio
+async def test_browser_query_is_answered_with_json(client) -> None:
+    query = {'date': time.strftime('%d-%m-%Y'), 'period': 'day'}
+    response = await client.get('/energy/query', params=query, headers={'Accept': 'text/html'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/json'
+    assert (await client.get('/energy/query', params={**query, 'format': 'xml'})).status_code == 406
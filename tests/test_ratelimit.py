@@ -0,0 +1,103 @@
+import asyncio
+import typing
+
+import pytest
+
+import agent.utils.coalescing
+import agent.utils.ratelimit
+from agent.utils.ratelimit import Priority
+
+
+async def at_priority(priority: Priority, procedure: typing.Callable[[], typing.Awaitable[None]]) -> None:
+    agent.utils.ratelimit.REQUEST_PRIORITY.set(priority)
+    await procedure()
+
+
+async def acquire_in_turn(rate_limiter: agent.utils.ratelimit.OutboundRateLimiter, admitted: list[str], label: str, priority: Priority) -> asyncio.Task:
+    async def acquire() -> None:
+        await rate_limiter.acquire()
+        admitted.append(label)
+
+    task = asyncio.create_task(at_priority(priority, acquire))
+    await asyncio.sleep(0)  # Lets the request take its place in the queue
+    return task
+
+
+@pytest.mark.anyio
+async def test_waiting_requests_are_admitted_by_priority() -> None:
+    rate_limiter = agent.utils.ratelimit.OutboundRateLimiter(rate=100.0, burst=1)
+    await rate_limiter.acquire()
+    admitted: list[str] = []
+    tasks = [
+        await acquire_in_turn(rate_limiter, admitted, 'backfill', Priority.BACKFILL),
+        await acquire_in_turn(rate_limiter, admitted, 'background', Priority.BACKGROUND),
+        await acquire_in_turn(rate_limiter, admitted, 'interactive', Priority.INTERACTIVE),
+        await acquire_in_turn(rate_limiter, admitted, 'interactive later', Priority.INTERACTIVE),
+    ]
+    await asyncio.gather(*tasks)
+    assert admitted == ['interactive', 'interactive later', 'background', 'backfill']
+    await rate_limiter.stop()
+
+
+@pytest.mark.anyio
+async def test_full_queue_preempts_lower_priority_requests_only() -> None:
+    rate_limiter = agent.utils.ratelimit.OutboundRateLimiter(rate=1.0, burst=1, max_queue_depth=1)
+    await rate_limiter.acquire()
+    admitted: list[str] = []
+    backfill_task = await acquire_in_turn(rate_limiter, admitted, 'backfill', Priority.BACKFILL)
+    interactive_task = await acquire_in_turn(rate_limiter, admitted, 'interactive', Priority.INTERACTIVE)
+    with pytest.raises(agent.utils.ratelimit.AdmissionRejectedError) as rejected:
+        await backfill_task
+    assert rejected.value.status_code == 429
+    with pytest.raises(agent.utils.ratelimit.AdmissionRejectedError) as rejected:
+        await rate_limiter.acquire(Priority.INTERACTIVE)
+    assert rejected.value.status_code == 429
+    assert rate_limiter.stats()['shed'] == 1
+    assert rate_limiter.stats()['rejected'] == 1
+    interactive_task.cancel()
+    await rate_limiter.stop()
+
+
+@pytest.mark.anyio
+async def test_interactive_caller_raises_the_priority_of_a_joined_background_flight() -> None:
+    rate_limiter = agent.utils.ratelimit.OutboundRateLimiter(rate=100.0, burst=1)
+    single_flight = agent.utils.coalescing.SingleFlight()
+    await rate_limiter.acquire()
+    admitted: list[str] = []
+    tasks = [await acquire_in_turn(rate_limiter, admitted, f'background {index}', Priority.BACKGROUND) for index in range(3)]
+
+    async def fetch() -> str:
+        await rate_limiter.acquire()
+        admitted.append('flight')
+        return 'fetched'
+
+    async def refresh() -> None:
+        assert await single_flight.run('window', fetch) == 'fetched'
+
+    tasks.append(asyncio.create_task(at_priority(Priority.BACKGROUND, refresh)))
+    for _ in range(2):
+        await asyncio.sleep(0)  # Lets the flight start and queue its request
+    assert rate_limiter.stats()['queued'] == 4
+    tasks.append(asyncio.create_task(at_priority(Priority.INTERACTIVE, refresh)))
+    await asyncio.gather(*tasks)
+    assert admitted[0] == 'flight'
+    assert single_flight.stats()['boosted'] == 1
+    await rate_limiter.stop()
+
+
+@pytest.mark.anyio
+async def test_requests_gone_from_the_full_queue_make_room_without_preempting() -> None:
+    rate_limiter = agent.utils.ratelimit.OutboundRateLimiter(rate=1.0, burst=1, max_queue_depth=1)
+    await rate_limiter.acquire()
+    admitted: list[str] = []
+    cancelled_task = await acquire_in_turn(rate_limiter, admitted, 'cancelled', Priority.BACKFILL)
+    cancelled_task.cancel()
+    # The request is done (as a cancelled or timed out one is), before its task gets to leave the queue
+    rate_limiter._waiters[0].admitted.cancel()  # pylint: disable=protected-access
+    with pytest.raises(TimeoutError):  # The request is queued in place of the one gone, instead of failing
+        async with asyncio.timeout(0.05):
+            await rate_limiter.acquire(Priority.INTERACTIVE)
+    assert rate_limiter.stats()['shed'] == 0
+    assert rate_limiter.stats()['rejected'] == 0
+    await asyncio.gather(cancelled_task, return_exceptions=True)
+    await rate_limiter.stop()
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from conftest import METER_ID, FakeEnergaSession, login_page
+
+import agent.utils.consts
+import agent.utils.session
+
+
+@pytest.fixture(name='session_manager')
+def fixture_session_manager(energa_session: FakeEnergaSession) -> agent.utils.session.EnergaSessionManager:
+    async def authenticate() -> None:
+        await asyncio.sleep(0.01)  # Lets the other requests notice the expiry, while the first one is logging in
+
+    return agent.utils.session.EnergaSessionManager(client=energa_session, authenticate=authenticate)  # type: ignore
+
+
+def chart_url(epoch: int) -> str:
+    return f'{agent.utils.consts.PPE_DATA_CHARTS_PATH}?mainChartDate={epoch}&type=DAY&meterPoint={METER_ID}&mo=A%2B'
+
+
+def test_login_page_served_instead_of_json_is_an_expiry() -> None:
+    assert agent.utils.session.is_session_expired(login_page(), expect_json=True)
+    assert not agent.utils.session.is_session_expired(login_page())
+    assert agent.utils.session.is_session_expired(httpx.Response(401))
+    assert not agent.utils.session.is_session_expired(httpx.Response(200, json={}), expect_json=True)
+
+
+@pytest.mark.anyio
+async def test_expired_session_is_renewed_once_for_all_of_the_waiting_requests(session_manager, energa_session) -> None:
+    energa_session.queued = [login_page() for _ in range(3)]
+    epoch = int(time.time() * 1000)
+
+    responses = await asyncio.gather(*(session_manager.get(chart_url(epoch), expect_json=True) for _ in range(3)))
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert all(response.json()['response']['mainChart'] for response in responses)
+    assert session_manager.relogins == 1
+    assert len(energa_session.requests) == 6  # Every request is replayed once
+
+
+@pytest.mark.anyio
+async def test_request_fails_if_the_renewed_session_is_rejected_as_well(session_manager, energa_session) -> None:
+    energa_session.queued = [login_page(), login_page()]
+
+    with pytest.raises(agent.utils.session.SessionExpiredError):
+        await session_manager.get(chart_url(int(time.time() * 1000)), expect_json=True)
+    assert session_manager.relogins == 1
+    assert len(energa_session.requests) == 2
+
+
+@pytest.mark.anyio
+async def test_query_is_answered_with_bad_gateway_once_the_replay_fails(app, client, session_manager, energa_session) -> None:
+    app.extra['session'].sessions['default'] = session_manager
+    energa_session.queued = [login_page(), login_page()]
+
+    response = await client.get('/energy/query', params={'date': time.strftime('%d-%m-%Y'), 'period': 'day'})
+
+    assert response.status_code == 502
+    assert 'Retry-After' in response.headers
+
+
+@pytest.mark.anyio
+async def test_query_is_answered_with_bad_gateway_if_the_chart_is_not_json(client, energa_session) -> None:
+    energa_session.queued = [httpx.Response(200, text='Service temporarily unavailable')]
+
+    response = await client.get('/energy/query', params={'date': time.strftime('%d-%m-%Y'), 'period': 'day'})
+
+    assert response.status_code == 502
+    assert response.json()['message'] == 'Energa returned a malformed chart'
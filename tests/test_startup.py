@@ -0,0 +1,73 @@
+import asyncio
+
+import fastapi
+import httpx
+import pytest
+
+import agent.service
+import agent.utils.consts
+import agent.utils.interprocess
+import agent.utils.scheduler
+import agent.utils.startup
+
+
+@pytest.fixture(name='startup')
+def fixture_startup(app: fastapi.FastAPI) -> agent.utils.startup.StartupState:
+    startup = agent.utils.startup.StartupState()
+    app.extra[agent.utils.consts.AGENT_STARTUP_FIELD] = startup
+    return startup
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('path', ['/energy/meters', '/energy/query?date=01-01-2024&period=DAY', '/energy/since?tm=0'])
+async def test_measurements_wait_for_the_login(client: httpx.AsyncClient, startup: agent.utils.startup.StartupState, path: str) -> None:
+    startup.set_login_failed('Energa is down')
+    response = await client.get(path)
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert (await client.get('/ready')).status_code == 503
+
+
+@pytest.mark.anyio
+async def test_static_pages_are_served_before_the_login(client: httpx.AsyncClient, startup: agent.utils.startup.StartupState) -> None:
+    startup.set_login_failed('Energa is down')
+    assert (await client.get('/energy/info')).status_code == 200
+    assert (await client.get('/health')).status_code == 200
+
+
+@pytest.mark.anyio
+async def test_only_the_failed_accounts_are_logged_in_again(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(agent.utils.consts, 'STARTUP_LOGIN_RETRY_DELAY', 0.0)
+    service = agent.service.PPEAgentService({'accounts': {
+        'healthy': {'email': 'healthy@example.com', 'password': 'secret'},
+        'failing': {'email': 'failing@example.com', 'password': 'secret'},
+    }})
+    startup: agent.utils.startup.StartupState = service._startup  # pylint: disable=protected-access
+    login_attempts: list[tuple[str, bool]] = []
+
+    async def login(account_name: str) -> None:
+        login_attempts.append((account_name, startup.is_ready))
+        if account_name == 'failing' and len(login_attempts) < 4:
+            raise ValueError('Invalid credentials')
+
+    monkeypatch.setattr(service, 'login', login)
+    prefetch_scheduler = agent.utils.scheduler.PrefetchScheduler(refresh=login, interval=0, jitter=0)  # type: ignore
+    worker_locks = agent.utils.interprocess.WorkerLocks(str(tmp_path / 'measurements.sqlite3.lock'), shared=False)
+    await asyncio.wait_for(service._login_in_background(prefetch_scheduler, worker_locks), timeout=5)  # pylint: disable=protected-access
+    worker_locks.close()
+    assert login_attempts == [('healthy', False), ('failing', False), ('failing', True), ('failing', True)]
+    assert startup.is_ready
+    assert not startup.failed_accounts
+
+
+@pytest.mark.anyio
+async def test_meters_of_the_accounts_being_logged_in_are_not_reported_unknown(
+    client: httpx.AsyncClient,
+    startup: agent.utils.startup.StartupState
+) -> None:
+    startup.set_ready()
+    startup.set_login_failed('Invalid credentials', 'failing')
+    assert (await client.get('/ready')).json() == {'status': 'ok', 'failed_accounts': ['failing']}
+    assert (await client.get('/energy/query?date=01-01-2024&period=DAY&meter=87654321')).status_code == 503
+    startup.set_logged_in('failing')
+    assert (await client.get('/energy/query?date=01-01-2024&period=DAY&meter=87654321')).status_code == 404
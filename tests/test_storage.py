@@ -0,0 +1,22 @@
+import os
+import stat
+
+import agent.utils.storage
+
+
+def test_database_is_readable_by_its_owner_only(tmp_path) -> None:
+    store = agent.utils.storage.MeasurementStore(str(tmp_path / 'measurements.sqlite3'))
+    store.save_session('default', [{'name': 'JSESSIONID', 'value': 'secret', 'domain': '', 'path': '/'}], [12345678])
+    store.close()
+
+    assert stat.S_IMODE(os.stat(tmp_path / 'measurements.sqlite3').st_mode) == 0o600
+
+
+def test_permissions_of_an_existing_database_are_restricted(tmp_path) -> None:
+    database_path = tmp_path / 'measurements.sqlite3'
+    database_path.touch(mode=0o644)
+    database_path.chmod(0o644)
+
+    agent.utils.storage.MeasurementStore(str(database_path)).close()
+
+    assert stat.S_IMODE(os.stat(database_path).st_mode) == 0o600
@@ -0,0 +1,19 @@
+import json
+import time
+
+import httpx
+import pytest
+
+from conftest import FakeEnergaSession
+
+
+@pytest.mark.anyio
+async def test_stream_failing_upstream_is_closed_with_an_error_event(client: httpx.AsyncClient, energa_session: FakeEnergaSession) -> None:
+    energa_session.queued = [httpx.Response(200, text='Service unavailable') for _ in range(2)]
+    response = await client.get('/energy/stream', params={'tm': int(time.time() * 1000) - 60 * 60 * 1000})
+
+    assert response.status_code == 200
+    event_fields = dict(line.split(': ', 1) for line in response.text.strip().split('\n'))
+    assert event_fields['event'] == 'error'
+    assert int(event_fields['retry']) >= 1000
+    assert json.loads(event_fields['data']) == {'status': 'error', 'code': 502, 'message': 'Energa returned a malformed chart'}